@@ -1,8 +1,23 @@
 from django.contrib import admin
-from .models import PDF
+from .models import PDF, PDFBlob
+from .storage import store_document_file
 
 @admin.register(PDF)
 class PDFAdmin(admin.ModelAdmin):
-    list_display = ('title', 'user', 'uploaded_at', 'file_size', 'num_pages')
+    list_display = ('title', 'user', 'uploaded_at', 'file_size', 'num_pages', 'extracted_at')
     list_filter = ('uploaded_at', 'user')
-    search_fields = ('title', 'user__username')
\ No newline at end of file
+    search_fields = ('title', 'user__username')
+    readonly_fields = ('file_size', 'num_pages', 'extracted_at', 'extraction_error')
+    exclude = ('blob',)
+
+    def save_model(self, request, obj, form, change):
+        # uploads go to the blob store, shared with identical uploads, instead of pdfs/
+        if 'file' in form.changed_data:
+            store_document_file(obj, form.cleaned_data['file'])
+        super().save_model(request, obj, form, change)
+
+@admin.register(PDFBlob)
+class PDFBlobAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'size', 'ref_count', 'created_at')
+    search_fields = ('sha256',)
+    readonly_fields = ('sha256', 'size', 'ref_count', 'slides')
\ No newline at end of file
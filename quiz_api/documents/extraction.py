@@ -0,0 +1,103 @@
+# documents/extraction.py
+
+"""
+Background text extraction of uploaded documents. Each page's text is stored once as a PDFPage, so
+question generation and anything else reading a document never parses the PDF again.
+"""
+
+import logging
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import PDF, PDFPage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DOCUMENT_EXTRACTION = {
+    'BATCH_SIZE': 100,  # pages per INSERT
+    'POLL_INTERVAL': 5,  # seconds between polls of extract_documents --loop when nothing is pending
+}
+
+
+def extraction_settings():
+    return {**DEFAULT_DOCUMENT_EXTRACTION, **getattr(settings, 'DOCUMENT_EXTRACTION', {})}
+
+
+def iter_page_texts(pdf_file):
+    """Yield the text of every page of a PDF, in order"""
+    # imported on first use, PyPDF2 is slow to import and most processes never read a PDF
+    from PyPDF2 import PdfReader
+
+    for page in PdfReader(pdf_file).pages:
+        yield page.extract_text() or ''
+
+
+def _store_pages(document, texts, batch_size):
+    """Insert the pages of `document` from an iterable of texts, `batch_size` at a time. Returns the page count"""
+    pages = (PDFPage(document=document, number=number, text=text) for number, text in enumerate(texts, 1))
+    count = 0
+    while batch := list(islice(pages, batch_size)):
+        PDFPage.objects.bulk_create(batch)
+        count += len(batch)
+    return count
+
+
+def extract_document(document):
+    """
+    Store the text of every page of `document` and fill in its page count and file size.
+
+    A document sharing its blob with one that was already extracted gets a copy of that document's
+    pages instead of reading the PDF. A failure is recorded on the document, which is then not
+    picked up again.
+    """
+    batch_size = extraction_settings()['BATCH_SIZE']
+    extracted = None
+    if document.blob_id:
+        extracted = (
+            PDF.objects
+            .filter(blob_id=document.blob_id, extracted_at__isnull=False, extraction_error='')
+            .exclude(pk=document.pk)
+            .first()
+        )
+
+    try:
+        with transaction.atomic():
+            document.pages.all().delete()
+            if extracted is not None:
+                texts = extracted.pages.order_by('number').values_list('text', flat=True).iterator()
+                document.num_pages = _store_pages(document, texts, batch_size)
+            else:
+                with document.file.open('rb') as pdf_file:
+                    document.num_pages = _store_pages(document, iter_page_texts(pdf_file), batch_size)
+            document.file_size = document.blob.size if document.blob_id else document.file.size
+    except Exception as e:
+        logger.exception(f"Text extraction failed for document {document.pk}")
+        document.extraction_error = str(e)
+        document.num_pages = None
+    else:
+        document.extraction_error = ''
+
+    document.extracted_at = timezone.now()
+    document.save(update_fields=['num_pages', 'file_size', 'extracted_at', 'extraction_error'])
+    return document
+
+
+def extract_next_document():
+    """
+    Extract the oldest document whose text has not been extracted yet, and return it, or None if
+    there is none. The row stays locked while it is extracted, so several workers can run at once.
+    """
+    with transaction.atomic():
+        document = (
+            PDF.objects
+            .select_for_update(skip_locked=True)
+            .filter(extracted_at__isnull=True)
+            .order_by('uploaded_at', 'id')
+            .first()
+        )
+        if document is None:
+            return None
+        return extract_document(document)
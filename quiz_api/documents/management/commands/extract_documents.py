@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from documents.extraction import extract_next_document, extraction_settings
+
+
+class Command(BaseCommand):
+    help = 'Extract and store the page texts of uploaded documents that have not been extracted yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling for new documents instead of exiting once none are left')
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help='Seconds to wait between polls with --loop (default: DOCUMENT_EXTRACTION POLL_INTERVAL)')
+
+    def handle(self, *args, **options):
+        interval = options['poll_interval'] or extraction_settings()['POLL_INTERVAL']
+
+        while True:
+            document = extract_next_document()
+            if document is None:
+                if not options['loop']:
+                    break
+                time.sleep(interval)
+                continue
+
+            if document.extraction_error:
+                self.stdout.write(self.style.ERROR(
+                    f"Document {document.pk} could not be extracted: {document.extraction_error}"
+                ))
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Document {document.pk}: {document.num_pages} pages, {document.file_size} bytes"
+                ))
@@ -2,14 +2,57 @@ from django.db import models
 from django.contrib.auth.models import User
 
 
+class PDFBlob(models.Model):
+    """
+    A PDF stored once per distinct content, shared by every upload of the same bytes.
+
+    Uploads reference a blob instead of owning a file; the blob and its file are removed when the
+    last reference goes away (see documents.storage).
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='blobs/')
+    size = models.PositiveBigIntegerField(help_text="File size in bytes")
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    slides = models.JSONField(null=True, blank=True,
+                              help_text="Slides extracted from the PDF, filled in the first time it is processed")
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} bytes, {self.ref_count} refs)"
+
+
 # Create your models here.
 class PDF(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     file = models.FileField(upload_to='pdfs/')
+    blob = models.ForeignKey(PDFBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='documents')
     title = models.CharField(max_length=200)
     uploaded_at = models.DateTimeField(auto_now_add=True)
-    file_size = models.IntegerField(help_text="File size in bytes")
+    file_size = models.IntegerField(null=True, blank=True, help_text="File size in bytes")
     num_pages = models.IntegerField(null=True, blank=True)
+    # set once the text of the pages is stored, or extraction failed (see documents.extraction)
+    extracted_at = models.DateTimeField(null=True, blank=True)
+    extraction_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['extracted_at', 'uploaded_at']),
+        ]
 
     def __str__(self):
         return self.title
+
+
+class PDFPage(models.Model):
+    """The text extracted from one page of a document, so the PDF is parsed only once"""
+    document = models.ForeignKey(PDF, on_delete=models.CASCADE, related_name='pages')
+    number = models.PositiveIntegerField(help_text="Page number, from 1")
+    text = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'number'], name='unique_document_page'),
+        ]
+
+    def __str__(self):
+        return f"{self.document} page {self.number}"
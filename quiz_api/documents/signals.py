@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import PDF
+from .storage import release_blob
+
+
+@receiver(post_delete, sender=PDF)
+def release_document_blob(sender, instance, **kwargs):
+    if instance.blob_id:
+        release_blob(instance.blob_id)
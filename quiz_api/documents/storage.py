@@ -0,0 +1,105 @@
+# documents/storage.py
+
+import hashlib
+import logging
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F, ProtectedError
+
+from .models import PDFBlob
+
+logger = logging.getLogger(__name__)
+
+
+def blob_path(sha256):
+    return f"blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}.pdf"
+
+
+def store_pdf(uploaded_file):
+    """
+    Store an uploaded PDF by content and return its PDFBlob with one more reference.
+
+    The file is hashed while it is streamed to a temporary file, so it is read only once; identical
+    uploads share the existing blob and nothing new is written to storage.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.TemporaryFile() as spooled:
+        for chunk in uploaded_file.chunks():
+            digest.update(chunk)
+            spooled.write(chunk)
+            size += len(chunk)
+        sha256 = digest.hexdigest()
+
+        if _add_reference(sha256):
+            return PDFBlob.objects.get(sha256=sha256)
+
+        spooled.seek(0)
+        name = default_storage.save(blob_path(sha256), File(spooled))
+
+    try:
+        with transaction.atomic():
+            return PDFBlob.objects.create(sha256=sha256, file=name, size=size, ref_count=1)
+    except IntegrityError:
+        # another upload of the same bytes created the blob first
+        default_storage.delete(name)
+        if not _add_reference(sha256):
+            raise
+        return PDFBlob.objects.get(sha256=sha256)
+
+
+def store_document_file(document, uploaded_file):
+    """
+    Point a documents.PDF at the blob of `uploaded_file` rather than at a copy of its own, releasing
+    the blob it had before, and queue it for text extraction. The caller saves the document.
+    """
+    previous_blob_id = document.blob_id
+    blob = store_pdf(uploaded_file)
+    document.blob = blob
+    document.file = blob.file.name
+    document.file_size = blob.size
+    document.num_pages = None
+    document.extracted_at = None
+    document.extraction_error = ''
+    if previous_blob_id:
+        release_blob(previous_blob_id)
+    return document
+
+
+def _add_reference(sha256):
+    return PDFBlob.objects.filter(sha256=sha256).update(ref_count=F('ref_count') + 1) > 0
+
+
+def release_blob(blob_id, count=1):
+    """
+    Drop `count` references to a blob. The row and file are deleted once the transaction commits if
+    nothing references the blob any more.
+    """
+    PDFBlob.objects.filter(pk=blob_id, ref_count__gte=count).update(ref_count=F('ref_count') - count)
+    transaction.on_commit(lambda: delete_unreferenced_blobs([blob_id]))
+
+
+def delete_unreferenced_blobs(blob_ids=None):
+    """
+    Delete blobs without references, and their files. Returns the number of bytes freed.
+    """
+    unreferenced = PDFBlob.objects.filter(ref_count__lte=0)
+    if blob_ids is not None:
+        unreferenced = unreferenced.filter(pk__in=blob_ids)
+
+    freed = 0
+    for blob in unreferenced:
+        # the conditional delete loses to an upload that took a new reference in the meantime
+        try:
+            deleted, _ = PDFBlob.objects.filter(pk=blob.pk, ref_count__lte=0).delete()
+        except ProtectedError:
+            logger.warning(f"PDF blob {blob.sha256} has no references counted but is still in use")
+            continue
+        if deleted:
+            default_storage.delete(blob.file.name)
+            freed += blob.size
+            logger.info(f"Deleted unreferenced PDF blob {blob.sha256}")
+    return freed
@@ -1,3 +1,128 @@
-from django.test import TestCase
+import tempfile
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from documents.extraction import extract_next_document
+from documents.models import PDF, PDFBlob, PDFPage
+from documents.storage import store_document_file, store_pdf
+from quizzes.testing import build_pdf, lecture_pages
+
+
+def upload_document(user, name, content, title=''):
+    """Store a document the way PDFAdmin.save_model does"""
+    document = store_document_file(PDF(user=user, title=title or name), SimpleUploadedFile(name, content))
+    document.save()
+    return document
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class PDFBlobStorageTest(TestCase):
+    """Test case for the content-addressed PDF storage"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='12345')
+
+    def upload(self, content=b'%PDF-1.4 same deck'):
+        return store_pdf(SimpleUploadedFile('deck.pdf', content, content_type='application/pdf'))
+
+    def test_identical_uploads_share_a_blob(self):
+        """Test that the same bytes are stored once and reference counted"""
+        first = self.upload()
+        second = self.upload()
+        other = self.upload(b'%PDF-1.4 another deck')
+
+        self.assertEqual(first.pk, second.pk)
+        self.assertNotEqual(first.pk, other.pk)
+        self.assertEqual(PDFBlob.objects.get(pk=first.pk).ref_count, 2)
+        self.assertEqual(first.size, len(b'%PDF-1.4 same deck'))
+        self.assertTrue(default_storage.exists(first.file.name))
+
+    def test_blob_is_deleted_with_its_last_reference(self):
+        """Test that deleting every document referencing a blob removes the blob and its file"""
+        documents = [upload_document(self.user, 'deck.pdf', b'%PDF-1.4 same deck') for _ in range(2)]
+        blob = documents[0].blob
+
+        with self.captureOnCommitCallbacks(execute=True):
+            documents[0].delete()
+        self.assertEqual(PDFBlob.objects.get(pk=blob.pk).ref_count, 1)
+        self.assertTrue(default_storage.exists(blob.file.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            documents[1].delete()
+        self.assertFalse(PDFBlob.objects.filter(pk=blob.pk).exists())
+        self.assertFalse(default_storage.exists(blob.file.name))
+
+    def test_documents_are_stored_as_blobs(self):
+        """Test that documents reference the blob of their content, and release it when their file is replaced"""
+        first = upload_document(self.user, 'deck.pdf', b'%PDF-1.4 same deck', title='Deck')
+        second = upload_document(self.user, 'copy.pdf', b'%PDF-1.4 same deck')
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual((second.title, second.file.name, second.file_size),
+                         ('copy.pdf', first.blob.file.name, len(b'%PDF-1.4 same deck')))
+        self.assertEqual(PDFBlob.objects.get(pk=first.blob_id).ref_count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            store_document_file(second, SimpleUploadedFile('new.pdf', b'%PDF-1.4 new deck'))
+            second.save()
+        self.assertNotEqual(second.blob_id, first.blob_id)
+        self.assertIsNone(second.extracted_at)
+        self.assertEqual(PDFBlob.objects.get(pk=first.blob_id).ref_count, 1)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), DOCUMENT_EXTRACTION={'BATCH_SIZE': 2})
+class DocumentExtractionTest(TestCase):
+    """Test case for storing the page texts of uploaded documents"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='12345')
+
+    def upload(self, content):
+        blob = store_pdf(SimpleUploadedFile('deck.pdf', content, content_type='application/pdf'))
+        return PDF.objects.create(user=self.user, file=blob.file.name, blob=blob, title='Deck')
+
+    def test_pages_are_stored_once_per_document(self):
+        """Test that extraction fills in the page count, file size and the text of every page"""
+        content = build_pdf(lecture_pages(5))
+        document = self.upload(content)
+
+        out = StringIO()
+        call_command('extract_documents', stdout=out)
+        self.assertIn(f'Document {document.pk}: 5 pages', out.getvalue())
+
+        document.refresh_from_db()
+        self.assertEqual((document.num_pages, document.file_size), (5, len(content)))
+        self.assertIsNotNone(document.extracted_at)
+        texts = list(document.pages.order_by('number').values_list('text', flat=True))
+        self.assertEqual(len(texts), 5)
+        self.assertTrue(texts[2].startswith('Lecture page 3'))
+        self.assertIsNone(extract_next_document())
+
+    def test_same_content_is_copied_instead_of_parsed(self):
+        """Test that a second upload of the same bytes gets the pages of the first without PyPDF2"""
+        content = build_pdf(lecture_pages(3))
+        first = self.upload(content)
+        extract_next_document()
+
+        second = self.upload(content)
+        with mock.patch('documents.extraction.iter_page_texts', side_effect=AssertionError('PDF was parsed')):
+            extract_next_document()
+        second.refresh_from_db()
+        self.assertEqual((second.num_pages, second.extraction_error), (3, ''))
+        self.assertEqual(list(second.pages.values_list('text', flat=True)),
+                         list(first.pages.values_list('text', flat=True)))
+
+    def test_unreadable_document_is_not_retried(self):
+        """Test that a failed extraction is recorded and the worker moves on"""
+        document = self.upload(b'%PDF-1.4 not really a PDF')
+        extract_next_document()
+        document.refresh_from_db()
+        self.assertTrue(document.extraction_error)
+        self.assertIsNone(document.num_pages)
+        self.assertFalse(PDFPage.objects.exists())
+        self.assertIsNone(extract_next_document())
@@ -3,6 +3,9 @@ ASGI config for quiz_api project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the project through an ASGI server (for example `uvicorn quiz_api.asgi:application`) to
+stream question generation events without tying up a worker thread per open connection.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
@@ -9,6 +9,8 @@ https://docs.djangoproject.com/en/5.0/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
+import os
+import tempfile
 from datetime import timedelta
 from pathlib import Path
 
@@ -188,6 +190,132 @@ CORS_ORIGIN_WHITELIST = [
     'http://127.0.0.1:3000',
 ]
 
+# QUESTION GENERATION
+# PDFs with at least MIN_PAGES pages are extracted by WORKERS processes (None: one per CPU), in
+# shards of SHARD_PAGES pages
+QUIZ_EXTRACTION = {
+    'WORKERS': None,
+    'MIN_PAGES': 40,
+    'SHARD_PAGES': 25,
+}
+
+# Backends that turn a prompt into generated questions, see quizzes.backends. QUIZ_GENERATION_BACKEND
+# picks the one in use: 'stub' runs without network access, 'replay' answers from a recorded run
+ANTHROPIC_API_KEY = os.environ.get('ANTHROPIC_API_KEY', '')
+
+QUIZ_GENERATION_BACKENDS = {
+    'default': {
+        'BACKEND': 'quizzes.backends.AnthropicBackend',
+        # retries are done by RETRY below, with the rate limiter and circuit breaker in the loop
+        'OPTIONS': {'model': 'claude-3-haiku-20240307', 'max_retries': 0},
+        # shared by all worker processes on the host
+        'LIMITS': {'REQUESTS_PER_MINUTE': 50, 'TOKENS_PER_MINUTE': 50000},
+        'RETRY': {'ATTEMPTS': 5, 'BASE_DELAY': 1.0, 'MAX_DELAY': 30.0},
+        # stop calling the provider for RESET_AFTER seconds after FAILURES retryable errors in a row
+        'CIRCUIT_BREAKER': {'FAILURES': 5, 'RESET_AFTER': 60},
+    },
+    'stub': {
+        'BACKEND': 'quizzes.backends.StubBackend',
+        'OPTIONS': {'latency': 0.5, 'jitter': 0.5, 'questions_per_slide': 2},
+    },
+    'replay': {
+        'BACKEND': 'quizzes.backends.ReplayBackend',
+        # a runtime file, kept out of the source tree
+        'OPTIONS': {'path': os.environ.get('QUIZ_RECORDING_PATH',
+                                           os.path.join(tempfile.gettempdir(), 'quiz_api', 'generation_recording.jsonl'))},
+    },
+}
+QUIZ_GENERATION_BACKEND = os.environ.get('QUIZ_GENERATION_BACKEND', 'default')
+
+# Number of slides sent to the LLM at the same time by generate_questions
+QUIZ_GENERATION_CONCURRENCY = 8
+
+# Adjacent slides are packed into one LLM request while they fit in TOKEN_BUDGET (estimated prompt
+# tokens of slide content, excluding the instructions) and there are at most MAX_SLIDES of them
+QUIZ_PACKING = {
+    'TOKEN_BUDGET': 1500,
+    'MAX_SLIDES': 6,
+}
+
+# Slides over MAX_SLIDE_TOKENS (estimated) are split into parts at bullet or sentence boundaries.
+# Requests reserve room for QUESTIONS_PER_SLIDE questions of TOKENS_PER_QUESTION output tokens per
+# slide, up to MAX_OUTPUT_TOKENS. Header and footer lines found on BOILERPLATE_REPEATS pages are trimmed
+# from slides over MAX_SLIDE_TOKENS, before they are split
+QUIZ_TOKEN_BUDGET = {
+    'MAX_SLIDE_TOKENS': 800,
+    'QUESTIONS_PER_SLIDE': 3,
+    'TOKENS_PER_QUESTION': 120,
+    'MAX_OUTPUT_TOKENS': 4000,
+    'BOILERPLATE_REPEATS': 3,
+}
+
+# Near-duplicate slides (shingle Jaccard similarity >= THRESHOLD) are generated only once. A group of
+# duplicates is sent for generation once none of its slides were seen in the last WINDOW slides
+QUIZ_DEDUP = {
+    'THRESHOLD': 0.7,
+    'SHINGLE_SIZE': 3,  # words per shingle
+    'NUM_PERM': 64,  # MinHash signature length
+    'WINDOW': 10,
+}
+
+# A re-uploaded deck is compared with the previous upload for the quiz: slides with the same text keep
+# their questions, and slides at least MATCH_THRESHOLD similar to a previous one count as edited
+QUIZ_REVISIONS = {
+    'MATCH_THRESHOLD': 0.5,
+    'SHINGLE_SIZE': 3,  # words per shingle
+}
+
+# Every generation job is traced stage by stage and slide by slide. The spans are appended to the JSONL
+# file at PATH (None: only the summary stored on the job is kept), see show_generation_trace. It is a
+# runtime file, kept out of the source tree
+QUIZ_TRACING = {
+    'PATH': os.environ.get('QUIZ_TRACING_PATH',
+                           os.path.join(tempfile.gettempdir(), 'quiz_api', 'generation_traces.jsonl')),
+}
+
+# Uploaded documents have the text of their pages stored by extract_documents, BATCH_SIZE pages per
+# INSERT, polling every POLL_INTERVAL seconds with --loop
+DOCUMENT_EXTRACTION = {
+    'BATCH_SIZE': 100,
+    'POLL_INTERVAL': 5,
+}
+
+# Quiz details are served from a cache of serialized quizzes keyed by quiz id and version: MAX_ENTRIES
+# per process, and in the SHARED_CACHE alias of CACHES (None: no shared cache) for TIMEOUT seconds
+QUIZ_PAYLOAD_CACHE = {
+    'MAX_ENTRIES': 512,
+    'SHARED_CACHE': None,
+    'TIMEOUT': 60 * 60,
+}
+
+# Quiz counts by category, tag and difficulty are served from the CACHE alias of CACHES for TIMEOUT
+# seconds, under the version of their counts read from the database, so no process serves them once a
+# count changes, even when the cache is local to each process
+QUIZ_FACETS = {
+    'CACHE': 'default',
+    'TIMEOUT': 5 * 60,
+}
+
+# Without PostgreSQL, quiz search uses an in-memory index per process, which checks every quiz for
+# changes made by other processes at most every RESYNC_INTERVAL seconds
+QUIZ_SEARCH = {
+    'RESYNC_INTERVAL': 60,
+}
+
+# Questions generated per slide are cached by slide text, prompt version and model
+QUIZ_QUESTION_CACHE = {
+    'TTL': 60 * 60 * 24 * 90,  # seconds
+    'MAX_SIZE': 50 * 1024 * 1024,  # bytes of cached question JSON
+}
+
+# Temp questions and temp PDFs left behind by abandoned reviews are deleted by sweep_temp_data once
+# they are older than MAX_AGE, BATCH_SIZE rows per transaction
+QUIZ_TEMP_DATA = {
+    'MAX_AGE': 60 * 60 * 24 * 7,  # seconds
+    'BATCH_SIZE': 500,
+    'SWEEP_INTERVAL': 60 * 60,  # seconds between sweeps with --loop
+}
+
 # LOGGING
 LOGGING = {
     'version': 1,
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Tag, Quiz, Question, Answer, TempQuestion, TempAnswer, TempPDF
+from .models import Category, Tag, Quiz, Question, Answer, TempQuestion, TempAnswer, TempPDF, GenerationJob
 
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name',)
@@ -24,7 +24,8 @@ class QuestionAdmin(admin.ModelAdmin):
     inlines = [AnswerInline]
 
 class QuizAdmin(admin.ModelAdmin):
-    list_display = ('title', 'creator', 'created_at', 'category', 'difficulty', 'time_limit')
+    list_display = ('title', 'creator', 'created_at', 'category', 'difficulty', 'time_limit', 'question_count',
+                    'attempt_count')
     list_filter = ('creator', 'created_at', 'category', 'difficulty')
     search_fields = ('title', 'description', 'creator__username')
     filter_horizontal = ('tags',)
@@ -45,9 +46,18 @@ class TempPDFAdmin(admin.ModelAdmin):
     list_filter = ('user', 'uploaded_at')
     search_fields = ('user__username', 'quiz__title')
 
+class GenerationJobAdmin(admin.ModelAdmin):
+    list_display = ('quiz', 'user', 'status', 'progress', 'total', 'num_questions', 'created_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('user__username', 'quiz__title')
+    readonly_fields = ('started_at', 'heartbeat_at', 'finished_at', 'worker', 'attempts',
+                       'input_tokens', 'output_tokens', 'cache_write_tokens', 'cache_read_tokens', 'question_cache_hits',
+                       'question_cache_misses', 'guard_stats', 'diff', 'failed_slides', 'trace_summary')
+
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(Tag, TagAdmin)
 admin.site.register(Quiz, QuizAdmin)
 admin.site.register(Question, QuestionAdmin)
 admin.site.register(TempQuestion, TempQuestionAdmin)
-admin.site.register(TempPDF, TempPDFAdmin)
\ No newline at end of file
+admin.site.register(TempPDF, TempPDFAdmin)
+admin.site.register(GenerationJob, GenerationJobAdmin)
\ No newline at end of file
@@ -7,3 +7,7 @@ class QuizConfig(AppConfig):
 
     def ready(self):
         import quizzes.signals
+        from django.db.models.signals import post_migrate
+        from .search import install_postgres_search
+
+        post_migrate.connect(install_postgres_search, sender=self)
@@ -0,0 +1,415 @@
+# quizzes/backends.py
+
+"""
+Question generation backends, configured in settings.QUIZ_GENERATION_BACKENDS the same way Django
+configures CACHES:
+
+    QUIZ_GENERATION_BACKENDS = {
+        'default': {'BACKEND': 'quizzes.backends.AnthropicBackend', 'OPTIONS': {...}},
+        'stub': {'BACKEND': 'quizzes.backends.StubBackend', 'OPTIONS': {'latency': 0.5}},
+    }
+    QUIZ_GENERATION_BACKEND = 'default'
+
+A backend turns a prompt into a Completion: the text of the model's answer and the tokens it used,
+including those written to and read from the provider's prompt cache, or streams the text as it is
+generated. Provider SDKs are imported the first time a backend is used, so loading the URLconf or running a management command does not pay for them.
+
+An entry can also set LIMITS, RETRY and CIRCUIT_BREAKER to send the backend's calls through an
+LLMGuard (see quizzes.llm_guard).
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .llm_guard import LLMGuard
+from .quiz_cache import LRUCache
+from .token_budget import estimate_tokens
+
+DEFAULT_BACKENDS = {
+    'default': {
+        'BACKEND': 'quizzes.backends.AnthropicBackend',
+        'OPTIONS': {},
+    },
+}
+
+
+# The model's answer and the tokens it used, as a dict with the keys of TokenUsage.FIELDS
+Completion = namedtuple('Completion', ['text', 'usage'])
+
+
+class TokenUsage:
+    """
+    Thread-safe running total of the tokens used by a generation run. Cache writes and reads are
+    the parts of the input written to or read from the provider's prompt cache; input_tokens is
+    the rest of the input.
+    """
+    FIELDS = ('input_tokens', 'output_tokens', 'cache_write_tokens', 'cache_read_tokens')
+
+    def __init__(self):
+        self.totals = dict.fromkeys(self.FIELDS, 0)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def add(self, usage):
+        with self._lock:
+            self.requests += 1
+            for field in self.FIELDS:
+                self.totals[field] += usage.get(field) or 0
+
+    def as_dict(self):
+        with self._lock:
+            return {**self.totals, 'requests': self.requests}
+
+
+class GenerationBackendError(Exception):
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class GenerationBackend:
+    """
+    Base class of the question generation backends. `complete` and `stream` run on the generation
+    thread pool, so implementations must be thread-safe and must not touch the database.
+    """
+    model_name = None
+    guard = None
+
+    def complete(self, prompt, max_tokens, temperature, system=None):
+        """
+        Return the Completion of `prompt`. `system` holds the instructions shared by every request,
+        which backends of providers with prompt caching mark as cacheable.
+        """
+        raise NotImplementedError
+
+    def request(self, prompt, max_tokens, temperature, system=None, tokens=0):
+        """
+        complete() through the backend's guard, if it has one. `tokens` is the estimated size of
+        the prompt, drawn from the tokens-per-minute limit.
+        """
+        if self.guard is None:
+            return self.complete(prompt, max_tokens, temperature, system=system)
+        return self.guard.call(self, self.complete, prompt, max_tokens, temperature, system=system, tokens=tokens)
+
+    def stream(self, prompt, max_tokens, temperature, system=None, usage=None):
+        """
+        Yield the text of the answer to `prompt` in chunks as it is generated, adding the tokens used
+        to `usage`, a TokenUsage, when one is given. Backends without a streaming API yield the whole
+        answer at once.
+        """
+        completion = self.complete(prompt, max_tokens, temperature, system=system)
+        if usage is not None:
+            usage.add(completion.usage)
+        yield completion.text
+
+    def request_stream(self, prompt, max_tokens, temperature, system=None, usage=None, tokens=0):
+        """stream() through the backend's guard, if it has one (see request)"""
+        if self.guard is None:
+            return self.stream(prompt, max_tokens, temperature, system=system, usage=usage)
+        return self.guard.stream(self, self.stream, prompt, max_tokens, temperature, system=system, usage=usage,
+                                 tokens=tokens)
+
+    def is_retryable(self, error):
+        """Whether a failed call may succeed when it is sent again"""
+        return getattr(error, 'retryable', False)
+
+    def retry_after(self, error):
+        """Seconds the provider asked to wait before retrying, if it said"""
+        return None
+
+
+class AnthropicBackend(GenerationBackend):
+    # shortest system prompt, in tokens, that models cache by name prefix; shorter ones are sent uncached
+    CACHE_MIN_TOKENS = {'claude-3-haiku': 2048, 'claude-3-5-haiku': 2048}
+    DEFAULT_CACHE_MIN_TOKENS = 1024
+
+    def __init__(self, model='claude-3-haiku-20240307', api_key=None, timeout=None, max_retries=None):
+        self.model_name = model
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                import anthropic
+
+                options = {'api_key': self.api_key or settings.ANTHROPIC_API_KEY}
+                if self.timeout is not None:
+                    options['timeout'] = self.timeout
+                if self.max_retries is not None:
+                    options['max_retries'] = self.max_retries
+                self._client = anthropic.Anthropic(**options)
+            return self._client
+
+    @property
+    def cache_min_tokens(self):
+        for prefix, tokens in self.CACHE_MIN_TOKENS.items():
+            if self.model_name.startswith(prefix):
+                return tokens
+        return self.DEFAULT_CACHE_MIN_TOKENS
+
+    def _message_options(self, prompt, max_tokens, temperature, system):
+        options = {
+            'model': self.model_name,
+            'max_tokens': max_tokens,
+            'temperature': temperature,
+            'messages': [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+        }
+        if system:
+            # cached by the provider for a few minutes, so every request after the first reads the
+            # instructions from the cache instead of paying for them as input again. Models ignore the
+            # marker for blocks shorter than cache_min_tokens.
+            options['system'] = [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+        return options
+
+    @staticmethod
+    def _usage(usage):
+        return {
+            'input_tokens': usage.input_tokens,
+            'output_tokens': usage.output_tokens,
+            'cache_write_tokens': getattr(usage, 'cache_creation_input_tokens', None) or 0,
+            'cache_read_tokens': getattr(usage, 'cache_read_input_tokens', None) or 0,
+        }
+
+    def complete(self, prompt, max_tokens, temperature, system=None):
+        message = self.client.messages.create(**self._message_options(prompt, max_tokens, temperature, system))
+        return Completion(message.content[0].text, self._usage(message.usage))
+
+    def stream(self, prompt, max_tokens, temperature, system=None, usage=None):
+        # the usage of a stream that is cut off is not reported, as the provider sends it at the end
+        with self.client.messages.stream(**self._message_options(prompt, max_tokens, temperature, system)) as stream:
+            yield from stream.text_stream
+            message = stream.get_final_message()
+        if usage is not None:
+            usage.add(self._usage(message.usage))
+
+    def is_retryable(self, error):
+        import anthropic
+
+        if isinstance(error, (anthropic.APIConnectionError, anthropic.APITimeoutError)):
+            return True
+        if isinstance(error, anthropic.APIStatusError):
+            return error.status_code in (408, 409, 429) or error.status_code >= 500
+        return False
+
+    def retry_after(self, error):
+        response = getattr(error, 'response', None)
+        try:
+            return float(response.headers['retry-after'])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
+
+
+class StubBackend(GenerationBackend):
+    """
+    Deterministic local stand-in for an LLM, for tests, benchmarks and offline development.
+
+    It answers every slide in the prompt with `questions_per_slide` questions built from the slide's
+    own words, after sleeping `latency` seconds (plus up to `jitter` more). Failures can be injected
+    for given slide numbers (`fail_on`), which fail every time, or for a `failure_rate` share of
+    attempts, which are retryable. Those are chosen by hashing the prompt and the number of times it
+    was sent, so a run is repeatable; the count is kept for the `max_prompts` most recent prompts,
+    so a long running worker does not hold on to every prompt it was sent. `calls` and
+    `max_in_flight` record how it was used.
+
+    Answers are streamed in chunks of `chunk_size` characters, `chunk_delay` seconds apart. The
+    answers of prompts with a slide in `cut_off_on` stop halfway with a retryable error, like a
+    dropped connection.
+
+    Token usage is estimated, and prompt caching is simulated: a system prompt of at least
+    `cache_min_tokens` is written to the cache by the first request and read by later ones until it
+    has not been used for `cache_ttl` seconds.
+    """
+    model_name = 'stub'
+    SLIDE_PATTERN = re.compile(r'^\s*Slide (\d+)\s*$', re.MULTILINE)
+
+    def __init__(self, latency=0, jitter=0, questions_per_slide=1, failure_rate=0, fail_on=(), seed=0,
+                 cache_min_tokens=1024, cache_ttl=300, chunk_size=64, chunk_delay=0, cut_off_on=(),
+                 max_prompts=10000):
+        self.latency = latency
+        self.jitter = jitter
+        self.questions_per_slide = questions_per_slide
+        self.failure_rate = failure_rate
+        self.fail_on = set(fail_on)
+        self.seed = seed
+        self.cache_min_tokens = cache_min_tokens
+        self.cache_ttl = cache_ttl
+        self.prompt_cache = {}
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.cut_off_on = set(cut_off_on)
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._attempts = LRUCache(max_prompts)
+        self._lock = threading.Lock()
+
+    def _slides(self, prompt):
+        parts = self.SLIDE_PATTERN.split(prompt)
+        return [(int(number), text.split()) for number, text in zip(parts[1::2], parts[2::2])]
+
+    def _questions(self, slide_number, words):
+        fragments = [' '.join(words[i:i + 6]) for i in range(0, len(words), 6)] or [f'Slide {slide_number}']
+        return [
+            {
+                'question_text': f'Which statement appears on slide {slide_number}? ({q + 1})',
+                'options': {letter: fragments[(q + i) % len(fragments)] for i, letter in enumerate('ABCD')},
+                'correct_answer': 'A',
+            }
+            for q in range(self.questions_per_slide)
+        ]
+
+    def _usage(self, prompt, system, text):
+        usage = {'input_tokens': estimate_tokens(prompt), 'output_tokens': estimate_tokens(text),
+                 'cache_write_tokens': 0, 'cache_read_tokens': 0}
+        system_tokens = estimate_tokens(system) if system else 0
+        if system_tokens < self.cache_min_tokens:
+            usage['input_tokens'] += system_tokens
+            return usage
+
+        now = time.monotonic()
+        with self._lock:
+            last_used = self.prompt_cache.get(system)
+            self.prompt_cache[system] = now
+        if last_used is not None and now - last_used < self.cache_ttl:
+            usage['cache_read_tokens'] = system_tokens
+        else:
+            usage['cache_write_tokens'] = system_tokens
+        return usage
+
+    def complete(self, prompt, max_tokens, temperature, system=None):
+        usage = TokenUsage()
+        text = ''.join(self.stream(prompt, max_tokens, temperature, system=system, usage=usage))
+        return Completion(text, usage.totals)
+
+    def stream(self, prompt, max_tokens, temperature, system=None, usage=None):
+        key = hashlib.sha256(prompt.encode()).hexdigest()
+        slides = self._slides(prompt)
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            attempt = self._attempts.get(key, 0) + 1
+            self._attempts.set(key, attempt)
+        rng = random.Random(f"{self.seed}:{key}:{attempt}")
+        try:
+            time.sleep(self.latency + rng.uniform(0, self.jitter))
+            if any(number in self.fail_on for number, _ in slides):
+                raise GenerationBackendError('Injected stub backend failure')
+            if rng.random() < self.failure_rate:
+                raise GenerationBackendError('Injected transient stub backend failure', retryable=True)
+            text = json.dumps({'slides': [
+                {'slide_number': number, 'questions': self._questions(number, words)}
+                for number, words in slides
+            ]})
+            cut_off = any(number in self.cut_off_on for number, _ in slides)
+            sent = text[:len(text) // 2] if cut_off else text
+            if usage is not None:
+                usage.add(self._usage(prompt, system, sent))
+
+            for start in range(0, len(sent), self.chunk_size):
+                if start and self.chunk_delay:
+                    time.sleep(self.chunk_delay)
+                yield sent[start:start + self.chunk_size]
+            if cut_off:
+                raise GenerationBackendError('Injected stub stream cut off', retryable=True)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class ReplayBackend(GenerationBackend):
+    """
+    Answers prompts from a JSONL recording of {"prompt_sha256", "text"} lines, where the hash covers
+    the system prompt too. Replayed answers use no tokens.
+
+    With `record` set to the alias of another backend, prompts missing from the recording are sent
+    to that backend and its answers are appended, so a run against the real API can be replayed
+    offline later. Without it, a missing prompt is an error.
+    """
+
+    def __init__(self, path, record=None, model_name='replay'):
+        self.path = path
+        self.record = record
+        self.model_name = model_name
+        self._answers = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._answers is None:
+            self._answers = {}
+            try:
+                with open(self.path) as recording:
+                    for line in recording:
+                        if line.strip():
+                            entry = json.loads(line)
+                            self._answers[entry['prompt_sha256']] = entry['text']
+            except FileNotFoundError:
+                if self.record is None:
+                    raise
+        return self._answers
+
+    def complete(self, prompt, max_tokens, temperature, system=None):
+        key = hashlib.sha256(f"{system or ''}\0{prompt}".encode()).hexdigest()
+        with self._lock:
+            text = self._load().get(key)
+        if text is not None:
+            return Completion(text, {})
+        if self.record is None:
+            raise GenerationBackendError(f"No recorded answer for prompt {key[:12]} in {self.path}")
+
+        completion = get_backend(self.record).request(prompt, max_tokens, temperature, system=system)
+        with self._lock:
+            self._answers[key] = completion.text
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'a') as recording:
+                recording.write(json.dumps({'prompt_sha256': key, 'text': completion.text}) + '\n')
+        return completion
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(alias=None):
+    """
+    The backend instance configured under `alias`, QUIZ_GENERATION_BACKEND by default.
+    Instances are created on first use and shared, as they hold connection pools.
+    """
+    alias = alias or getattr(settings, 'QUIZ_GENERATION_BACKEND', 'default')
+    with _backends_lock:
+        if alias not in _backends:
+            config = getattr(settings, 'QUIZ_GENERATION_BACKENDS', DEFAULT_BACKENDS)
+            if alias not in config:
+                raise GenerationBackendError(f"No question generation backend named '{alias}'")
+            backend = import_string(config[alias]['BACKEND'])(**config[alias].get('OPTIONS', {}))
+            backend.guard = LLMGuard.from_config(alias, config[alias])
+            _backends[alias] = backend
+        return _backends[alias]
+
+
+@receiver(setting_changed)
+def reset_backends(*, setting, **kwargs):
+    if setting in ('QUIZ_GENERATION_BACKENDS', 'QUIZ_GENERATION_BACKEND', 'ANTHROPIC_API_KEY'):
+        with _backends_lock:
+            _backends.clear()
@@ -0,0 +1,258 @@
+# quizzes/benchmark.py
+
+"""
+Benchmarks of the PDF to questions pipeline on synthetic decks, run by the benchmark_generation
+command, and of quiz search on a synthetic question bank, run by benchmark_search. Everything runs
+locally: the LLM is a StubBackend with a fixed latency, and the database writes of each run are
+rolled back.
+"""
+
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from itertools import accumulate
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from . import pdf_processor
+from .backends import TokenUsage, get_backend
+from .llm_guard import guard_stats
+from .models import Question, Quiz
+from .search import inverted_index, search_quizzes
+from .testing import build_pdf, lecture_pages
+
+# Metrics where a higher value is a regression, compared against the baseline
+COMPARED_METRICS = ['seconds', 'peak_rss_mb', 'queries', 'llm_calls', 'time_to_first_question']
+
+
+def current_rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # no procfs (macOS): fall back to the high-water mark, which cannot go down between stages
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class PeakRSSSampler:
+    """Samples the RSS on a background thread and keeps the highest value seen"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+@contextmanager
+def measure(stages, name, backend):
+    """
+    Record wall time, peak RSS, database queries, LLM calls and retries, and rate limiter waits of the
+    stage run in the with block
+    """
+    stage = {}
+    calls_before = backend.calls
+    guard_before = guard_stats()
+    started = time.perf_counter()
+    with PeakRSSSampler() as rss, CaptureQueriesContext(connection) as queries:
+        yield stage
+    stage.update({
+        'seconds': round(time.perf_counter() - started, 4),
+        'peak_rss_mb': round(rss.peak / 1024 / 1024, 1),
+        'queries': len(queries),
+        'llm_calls': backend.calls - calls_before,
+        'llm_retries': guard_stats()['retries'] - guard_before['retries'],
+        'limiter_wait_seconds': round(guard_stats()['limiter_wait_seconds'] - guard_before['limiter_wait_seconds'], 3),
+    })
+    stages[name] = stage
+
+
+def benchmark_deck(num_pages, words_per_page=60):
+    """
+    Run each stage on a synthetic deck of num_pages pages and return the metrics of every stage:
+
+      extraction   extract_slides_from_pdf on the file
+      generation   generate_questions on the extracted slides, without the question cache, with the
+                   (simulated) input, output and prompt cache tokens
+      persistence  save_temp_questions of the generated questions
+      pipeline     process_pdf_and_generate_questions end to end, as a generation job runs it,
+                   including the time until the first question is saved
+    """
+    backend = get_backend()
+    stages = {}
+    with tempfile.NamedTemporaryFile(suffix='.pdf') as pdf_file:
+        pdf_file.write(build_pdf(lecture_pages(num_pages, words_per_page=words_per_page)))
+        pdf_file.flush()
+
+        with transaction.atomic():
+            user = User.objects.create(username=f'benchmark-{num_pages}-{time.time_ns()}')
+            quiz = Quiz.objects.create(title=f'Benchmark deck ({num_pages} pages)', creator=user)
+
+            with measure(stages, 'extraction', backend) as stage:
+                slides = pdf_processor.extract_slides_from_pdf(pdf_file.name)
+                stage['slides'] = len(slides)
+
+            with measure(stages, 'generation', backend) as stage:
+                usage = TokenUsage()
+                data = pdf_processor.generate_questions(slides, use_cache=False, usage=usage)
+                stage['questions'] = sum(len(slide['questions']) for slide in data['slides'])
+                stage.update((field, usage.totals[field]) for field in TokenUsage.FIELDS)
+
+            with measure(stages, 'persistence', backend) as stage:
+                stage['questions'] = len(pdf_processor.save_temp_questions(quiz, data['slides']))
+
+            first_saved = []
+            save = pdf_processor.save_temp_questions
+
+            def timed_save(*args, **kwargs):
+                saved = save(*args, **kwargs)
+                if saved and not first_saved:
+                    first_saved.append(time.perf_counter())
+                return saved
+
+            started = time.perf_counter()
+            with measure(stages, 'pipeline', backend) as stage, \
+                    mock.patch.object(pdf_processor, 'save_temp_questions', timed_save):
+                stage['questions'] = pdf_processor.process_pdf_and_generate_questions(pdf_file.name, quiz)
+            stages['pipeline']['time_to_first_question'] = (
+                round(first_saved[0] - started, 4) if first_saved else None
+            )
+
+            transaction.set_rollback(True)
+    return stages
+
+
+def run_benchmarks(page_counts, latency=0.2, concurrency=None):
+    """
+    Benchmark every deck size with a StubBackend answering after `latency` seconds.
+    Returns a JSON-serializable report.
+    """
+    backends = {'benchmark': {'BACKEND': 'quizzes.backends.StubBackend', 'OPTIONS': {'latency': latency}}}
+    overrides = {'QUIZ_GENERATION_BACKENDS': backends, 'QUIZ_GENERATION_BACKEND': 'benchmark'}
+    if concurrency is not None:
+        overrides['QUIZ_GENERATION_CONCURRENCY'] = concurrency
+
+    with override_settings(**overrides):
+        decks = {str(num_pages): benchmark_deck(num_pages) for num_pages in page_counts}
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'database': connection.vendor,
+            'llm_latency': latency,
+            'concurrency': concurrency,
+        },
+        'decks': decks,
+    }
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def benchmark_search(num_questions, questions_per_quiz=100, num_queries=30, vocabulary_size=20000, seed=0):
+    """
+    Load a synthetic bank of `num_questions` questions, in quizzes of `questions_per_quiz`, and time
+    searches for common, rare and two-word terms, each fetching the first page of results. Word
+    frequencies follow a Zipf distribution, like natural text. The data is rolled back afterwards.
+
+    Returns the load time, the time of the first search (which builds the inverted index when the
+    database is not PostgreSQL) and the latency percentiles of the other searches, in milliseconds.
+    """
+    rng = random.Random(seed)
+    vocabulary = [f'word{n}' for n in range(vocabulary_size)]
+    cumulative = list(accumulate(1 / rank for rank in range(1, vocabulary_size + 1)))
+
+    def sentence(length):
+        return ' '.join(rng.choices(vocabulary, cum_weights=cumulative, k=length))
+
+    num_quizzes = math.ceil(num_questions / questions_per_quiz)
+    report = {'questions': num_questions, 'quizzes': num_quizzes, 'database': connection.vendor}
+    with transaction.atomic():
+        started = time.perf_counter()
+        user = User.objects.create(username=f'benchmark-search-{time.time_ns()}')
+        quizzes = Quiz.objects.bulk_create(
+            Quiz(title=sentence(4), description=sentence(20), creator=user, question_count=questions_per_quiz)
+            for _ in range(num_quizzes)
+        )
+        for quiz in quizzes:
+            Question.objects.bulk_create(
+                (Question(quiz=quiz, text=sentence(12)) for _ in range(questions_per_quiz)), batch_size=5000
+            )
+        report['load_seconds'] = round(time.perf_counter() - started, 3)
+
+        queries = (
+            [vocabulary[rng.randrange(10)] for _ in range(num_queries // 3)]
+            + [vocabulary[rng.randrange(vocabulary_size // 2, vocabulary_size)] for _ in range(num_queries // 3)]
+            + [f'{vocabulary[rng.randrange(vocabulary_size // 200)]} '
+               f'{vocabulary[rng.randrange(vocabulary_size // 200, vocabulary_size // 10)]}'
+               for _ in range(num_queries - 2 * (num_queries // 3))]
+        )
+        latencies = []
+        for text in queries:
+            started = time.perf_counter()
+            list(search_quizzes(Quiz.objects.all(), text)[:20])
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        report['first_search_ms'] = round(latencies[0], 2)
+        rest = latencies[1:] or latencies
+        report['search_ms'] = {
+            'p50': round(_percentile(rest, 0.5), 2),
+            'p95': round(_percentile(rest, 0.95), 2),
+            'max': round(max(rest), 2),
+        }
+        transaction.set_rollback(True)
+
+    # the index of the rolled back quizzes would only be dropped by the next search
+    inverted_index.clear()
+    return report
+
+
+def compare_to_baseline(report, baseline, tolerance=0.2):
+    """
+    Compare every metric of `report` present in `baseline`. Returns a list of rows
+    (deck, stage, metric, baseline value, current value, relative change, regressed), where a metric
+    regressed if it grew by more than `tolerance` (0.2 is 20%).
+    """
+    rows = []
+    for deck, stages in report['decks'].items():
+        for stage, metrics in stages.items():
+            baseline_metrics = baseline.get('decks', {}).get(deck, {}).get(stage, {})
+            for metric in COMPARED_METRICS:
+                old, new = baseline_metrics.get(metric), metrics.get(metric)
+                if old is None or new is None:
+                    continue
+                change = (new - old) / old if old else (0.0 if new == old else float('inf'))
+                rows.append((deck, stage, metric, old, new, change, change > tolerance))
+    return rows
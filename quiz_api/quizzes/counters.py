@@ -0,0 +1,125 @@
+# quizzes/counters.py
+
+"""
+The denormalized counters on Quiz: questions, attempts, completed attempts and the sum of their scores.
+
+Signals (see quizzes.signals) keep them current with atomic F() updates, in the transaction of the
+write that changed them. The rows removed by one delete() are counted together and written with one
+UPDATE per quiz once the delete is done, and rows removed because their quiz is being deleted are not
+counted at all. Paths that skip signals, such as bulk_create, call adjust_quiz_counters themselves.
+reconcile_quiz_counters recomputes everything from the child tables.
+"""
+
+import threading
+from collections import defaultdict
+
+from django.db.models import Count, F, FloatField, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Abs, Coalesce
+
+from .models import Question, Quiz
+
+COUNTERS = ('question_count', 'attempt_count', 'completed_attempt_count', 'score_sum')
+
+
+def adjust_quiz_counters(deltas):
+    """
+    Add `deltas`, {quiz id: {field: amount}}, to the quizzes' counters (or version). Quizzes with the
+    same deltas are updated together, so a batch costs one UPDATE per distinct change.
+    """
+    by_change = defaultdict(list)
+    for quiz_id, fields in deltas.items():
+        change = tuple(sorted((field, amount) for field, amount in fields.items() if amount))
+        if change:
+            by_change[change].append(quiz_id)
+    for change, quiz_ids in by_change.items():
+        Quiz.objects.filter(pk__in=quiz_ids).update(**{field: F(field) + amount for field, amount in change})
+
+
+def cascaded_from_quiz(origin):
+    """Whether a delete started from quizzes, whose counters then no longer matter"""
+    model = getattr(origin, 'model', type(origin))
+    return model is Quiz
+
+
+class _PendingDeletes(threading.local):
+    """
+    Deltas of the deletes in progress on this thread, by the instance or queryset the delete started
+    from. pre_delete is sent for every row before any post_delete, so once as many rows are done as
+    were announced the delete is over and its deltas are written.
+    """
+
+    def __init__(self):
+        self.deletes = {}
+
+    def add(self, origin, quiz_id, **deltas):
+        key = id(origin)
+        # the origin is kept, so its id cannot be reused by another delete while this one is pending
+        if key not in self.deletes or self.deletes[key]['origin'] is not origin:
+            self.deletes[key] = {'origin': origin, 'remaining': 0, 'deltas': defaultdict(lambda: defaultdict(int))}
+        pending = self.deletes[key]
+        pending['remaining'] += 1
+        for field, amount in deltas.items():
+            pending['deltas'][quiz_id][field] += amount
+
+    def done(self, origin):
+        pending = self.deletes.get(id(origin))
+        if pending is None or pending['origin'] is not origin:
+            return
+        pending['remaining'] -= 1
+        if pending['remaining'] <= 0:
+            del self.deletes[id(origin)]
+            adjust_quiz_counters(pending['deltas'])
+
+
+pending_deletes = _PendingDeletes()
+
+
+def attempt_contribution(attempt):
+    """What an attempt adds to its quiz's counters, as {field: amount}"""
+    completed = attempt.end_time is not None
+    return {
+        'attempt_count': 1,
+        'completed_attempt_count': int(completed),
+        'score_sum': (attempt.score or 0) if completed else 0,
+    }
+
+
+def reconcile_quiz_counters(batch_size=1000):
+    """
+    Recompute the counters of every quiz from the child tables, `batch_size` quizzes per UPDATE, and
+    write those that drifted. Returns the number of quizzes corrected.
+    """
+    from attempts.models import QuizAttempt
+
+    def count(queryset, aggregate, output_field):
+        return Coalesce(
+            Subquery(queryset.filter(quiz=OuterRef('pk')).order_by().values('quiz')
+                     .annotate(value=aggregate).values('value'), output_field=output_field),
+            Value(0, output_field=output_field),
+        )
+
+    completed = QuizAttempt.objects.filter(end_time__isnull=False)
+    actual = {
+        'question_count': count(Question.objects.all(), Count('pk'), IntegerField()),
+        'attempt_count': count(QuizAttempt.objects.all(), Count('pk'), IntegerField()),
+        'completed_attempt_count': count(completed, Count('pk'), IntegerField()),
+        'score_sum': count(completed, Sum('score'), FloatField()),
+    }
+
+    corrected = 0
+    last_id = 0
+    while True:
+        quiz_ids = list(Quiz.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not quiz_ids:
+            return corrected
+        last_id = quiz_ids[-1]
+
+        # scores are floats, summed in whatever order the database picks
+        drifted = (
+            Quiz.objects.filter(pk__in=quiz_ids)
+            .annotate(**{f'actual_{field}': expression for field, expression in actual.items()})
+            .annotate(score_drift=Abs(F('score_sum') - F('actual_score_sum')))
+            .filter(Q(*[~Q(**{field: F(f'actual_{field}')}) for field in COUNTERS if field != 'score_sum'],
+                      score_drift__gt=1e-6, _connector=Q.OR))
+        )
+        corrected += Quiz.objects.filter(pk__in=drifted.values('pk')).update(**actual)
@@ -0,0 +1,122 @@
+# quizzes/dedup.py
+
+import random
+import zlib
+from collections import defaultdict
+
+from .question_cache import normalize_slide_text
+
+# Mersenne prime larger than any 32-bit shingle hash, for the (a * x + b) % p hash family
+_PRIME = (1 << 61) - 1
+
+
+def shingles(text, size):
+    """Set of hashed word n-grams of the normalized slide text"""
+    words = normalize_slide_text(text).lower().split()
+    if len(words) <= size:
+        return {zlib.crc32(' '.join(words).encode())} if words else set()
+    return {zlib.crc32(' '.join(words[i:i + size]).encode()) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def lsh_bands(num_perm, threshold):
+    """
+    Pick the (bands, rows) split of the signature whose S-curve threshold, (1 / bands) ** (1 / rows),
+    is closest to the requested similarity threshold.
+    """
+    options = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(options, key=lambda option: abs((1 / option[0]) ** (1 / option[1]) - threshold))
+
+
+class MinHasher:
+    def __init__(self, num_perm, seed=1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.params = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+
+    def signature(self, shingle_set):
+        if not shingle_set:
+            return (0,) * self.num_perm
+        return tuple(min((a * x + b) % _PRIME for x in shingle_set) for a, b in self.params)
+
+
+class NearDuplicateFilter:
+    """
+    Streaming near-duplicate detection with MinHash/LSH.
+
+    Slides are fed in order with add(). LSH buckets only propose candidate groups; a slide joins a
+    group when its exact shingle Jaccard similarity with the group's first slide reaches `threshold`.
+    A group is released once no member has been seen for `window` slides (or on flush), represented
+    by its longest slide, so the final frame of a build-up animation is the one that gets questions.
+
+    add() and flush() return events:
+      ('slide', slide_number, slide, [merged slide numbers]) for a released representative, and
+      ('duplicate', representative slide_number, slide_number) for a slide matching a group that was
+      already released, such as a recap of an earlier slide.
+    """
+
+    def __init__(self, threshold, shingle_size=3, num_perm=64, window=None):
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.window = window
+        self.hasher = MinHasher(num_perm)
+        self.bands, self.rows = lsh_bands(num_perm, threshold)
+        self.buckets = defaultdict(list)
+        # released groups keep their shingles and representative number, but not their slide texts
+        self.groups = []
+        self.open_groups = []
+
+    def _match(self, slide_shingles, band_keys):
+        candidates = {group for key in band_keys for group in self.buckets[key]}
+        for group in sorted(candidates):
+            if jaccard(slide_shingles, self.groups[group]['shingles']) >= self.threshold:
+                return group
+        return None
+
+    def _release(self, group):
+        members = group.pop('members')
+        slide_number, slide = max(members, key=lambda member: (len(member[1].split()), -member[0]))
+        group['representative'] = slide_number
+        duplicates = sorted(number for number, _ in members if number != slide_number)
+        return ('slide', slide_number, slide, duplicates)
+
+    def add(self, slide_number, slide):
+        slide_shingles = shingles(slide, self.shingle_size)
+        signature = self.hasher.signature(slide_shingles)
+        band_keys = [(band, signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+        events = []
+        match = self._match(slide_shingles, band_keys)
+        if match is None:
+            match = len(self.groups)
+            self.groups.append({'shingles': slide_shingles, 'members': [], 'representative': None})
+            self.open_groups.append(match)
+            for key in band_keys:
+                self.buckets[key].append(match)
+
+        group = self.groups[match]
+        if group['representative'] is not None:
+            events.append(('duplicate', group['representative'], slide_number))
+        else:
+            group['members'].append((slide_number, slide))
+            group['last_seen'] = slide_number
+
+        if self.window is not None:
+            still_open = []
+            for index in self.open_groups:
+                if self.groups[index]['last_seen'] <= slide_number - self.window:
+                    events.append(self._release(self.groups[index]))
+                else:
+                    still_open.append(index)
+            self.open_groups = still_open
+        return events
+
+    def flush(self):
+        events = [self._release(self.groups[index]) for index in self.open_groups]
+        self.open_groups = []
+        return events
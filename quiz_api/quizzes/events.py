@@ -0,0 +1,150 @@
+# quizzes/events.py
+
+import asyncio
+import json
+import time
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+from .models import GenerationJob, TempQuestion
+from .serializers import GenerationJobSerializer, TempQuestionSerializer
+
+
+def format_event(event, data, event_id=None):
+    """One Server-Sent Events message"""
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def parse_event_id(value):
+    """The question id in a Last-Event-ID header, or 0 to start over when it is missing or not ours"""
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets views accept `Accept: text/event-stream`, as sent by EventSource. Regular responses, such
+    as validation errors, are sent as a single `error` event.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return format_event('error', data).encode(self.charset)
+
+
+class GenerationEventStream:
+    """
+    The progress of a generation job as Server-Sent Events:
+
+      slide     the TempQuestionSerializer data of all the questions of a slide saved so far
+      progress  slides processed so far out of the slides read from the PDF
+      done      the finished job, when generation succeeded or failed
+
+    The job runs in a generation worker; the stream polls its row and the new temp questions, so
+    it can be opened, dropped and reopened at any time. Slide events carry the id of their last
+    question, and `last_event_id` (the Last-Event-ID header of a reconnecting client) resumes after it.
+    Questions are saved as they stream in, so a slide's questions can arrive over several polls and
+    between those of other slides: the slide is then sent again with all of them, and clients should
+    replace what they have for a slide_number rather than add to it.
+
+    The stream is iterable both synchronously (WSGI) and asynchronously (ASGI). Under ASGI the
+    database is only touched in short sync_to_async calls, so an open connection does not hold a
+    worker thread between polls.
+    """
+
+    def __init__(self, job, poll_interval=0.5, heartbeat_interval=15, last_event_id=None):
+        self.job = job
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.last_question_id = parse_event_id(last_event_id)
+        self.progress = None
+        self.finished = False
+
+    def poll(self):
+        """Events for what changed since the last poll"""
+        job = GenerationJob.objects.get(pk=self.job.pk)
+        events = []
+
+        job_questions = TempQuestion.objects.filter(job=job)
+        # slide number -> id of its newest question, for the slides that got questions since the last poll
+        latest = {}
+        for pk, slide_number in job_questions.filter(pk__gt=self.last_question_id).values_list('pk', 'slide_number'):
+            latest[slide_number] = max(pk, latest.get(slide_number, 0))
+        if latest:
+            last = max(latest.values())
+            questions = defaultdict(list)
+            for question in (job_questions.filter(slide_number__in=latest, pk__lte=last)
+                             .order_by('pk').prefetch_related('temp_answers')):
+                questions[question.slide_number].append(question)
+            # in the order their newest question was saved, so resuming after a slide's id misses nothing
+            for slide_number in sorted(latest, key=latest.get):
+                events.append(format_event('slide', {
+                    'slide_number': slide_number,
+                    'questions': TempQuestionSerializer(questions[slide_number], many=True).data,
+                }, event_id=latest[slide_number]))
+            self.last_question_id = last
+
+        if (job.progress, job.total) != self.progress:
+            self.progress = (job.progress, job.total)
+            events.append(format_event('progress', {'progress': job.progress, 'total': job.total}))
+
+        if job.status in (GenerationJob.STATUS_SUCCEEDED, GenerationJob.STATUS_FAILED):
+            events.append(format_event('done', GenerationJobSerializer(job).data))
+            self.finished = True
+        return events
+
+    def __iter__(self):
+        idle = 0
+        while not self.finished:
+            events = self.poll()
+            yield from events
+            if self.finished:
+                return
+            idle = 0 if events else idle + self.poll_interval
+            if idle >= self.heartbeat_interval:
+                # comment line, keeps proxies from closing a quiet connection
+                idle = 0
+                yield ': keep-alive\n\n'
+            time.sleep(self.poll_interval)
+
+    async def __aiter__(self):
+        poll = sync_to_async(self.poll)
+        idle = 0
+        while not self.finished:
+            events = await poll()
+            for event in events:
+                yield event
+            if self.finished:
+                return
+            idle = 0 if events else idle + self.poll_interval
+            if idle >= self.heartbeat_interval:
+                idle = 0
+                yield ': keep-alive\n\n'
+            await asyncio.sleep(self.poll_interval)
+
+
+def event_stream_response(request, job, **kwargs):
+    """
+    Stream the events of `job`, asynchronously when the request is served through ASGI.
+    """
+    django_request = getattr(request, '_request', request)
+    stream = GenerationEventStream(job, last_event_id=django_request.headers.get('Last-Event-ID'), **kwargs)
+    content = stream.__aiter__() if isinstance(django_request, ASGIRequest) else iter(stream)
+
+    response = StreamingHttpResponse(content, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
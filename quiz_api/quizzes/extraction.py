@@ -0,0 +1,79 @@
+# quizzes/extraction.py
+
+"""
+PDF text extraction, kept free of Django imports so the functions can run in a process pool
+whatever the start method of the platform is.
+"""
+
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+# Splits a page in front of a line that is just "Slide" or a number like "3." (several slides per page)
+SLIDE_SPLIT_PATTERN = re.compile(r'\n(?=(?:Slide|^\d+\.)\s*\n)', flags=re.MULTILINE)
+
+
+def split_page_text(text):
+    return [potential_slide.strip() for potential_slide in SLIDE_SPLIT_PATTERN.split(text or '')
+            if potential_slide.strip()]  # Ignore empty slides
+
+
+def extract_page_range(pdf_path, start, stop):
+    """
+    Slide texts of pages [start, stop), in page order. This is the unit of work of one shard.
+    """
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(pdf_path)
+    slides = []
+    for index in range(start, stop):
+        slides.extend(split_page_text(reader.pages[index].extract_text()))
+    return slides
+
+
+def page_shards(num_pages, shard_pages):
+    return [(start, min(start + shard_pages, num_pages)) for start in range(0, num_pages, shard_pages)]
+
+
+def iter_slide_texts(pdf_file, workers=1, min_pages=40, shard_pages=25):
+    """
+    Yield the slide texts of a PDF in page order while the file is still being read.
+
+    Files are read shard by shard (`shard_pages` pages each) with a fresh reader, so parsed pages do not
+    pile up in memory on long files. Files with at least `min_pages` pages have their shards extracted
+    by up to `workers` processes, with only a few shards in flight ahead of the consumer. File objects
+    are read serially in this process.
+    """
+    # imported on first use, PyPDF2 is slow to import and most processes never read a PDF
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(pdf_file)
+    num_pages = len(reader.pages)
+
+    if not isinstance(pdf_file, (str, os.PathLike)):
+        for page in reader.pages:
+            yield from split_page_text(page.extract_text())
+        return
+    del reader
+
+    shards = iter(page_shards(num_pages, shard_pages))
+    if workers <= 1 or num_pages < min_pages:
+        for start, stop in shards:
+            yield from extract_page_range(pdf_file, start, stop)
+        return
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        window = deque(executor.submit(extract_page_range, pdf_file, start, stop)
+                       for start, stop in islice(shards, workers * 2))
+        while window:
+            slides = window.popleft().result()
+            for start, stop in islice(shards, 1):
+                window.append(executor.submit(extract_page_range, pdf_file, start, stop))
+            yield from slides
+    finally:
+        # also runs when the consumer stops early, so no shards are left running
+        executor.shutdown(wait=True, cancel_futures=True)
+
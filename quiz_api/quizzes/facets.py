@@ -0,0 +1,202 @@
+# quizzes/facets.py
+
+"""
+Quiz counts by category, tag and difficulty for browsing, overall and within a category or difficulty.
+
+They are stored as FacetCount rows and kept current by signals (see quizzes.signals) as quizzes are
+created, recategorized, retagged or deleted, and as categories and tags are deleted: every change
+is a set of +1/-1 deltas written with one UPDATE per distinct amount. Paths that skip signals, such
+as queryset updates, leave the counts to rebuild_facet_counts.
+
+Reads go through a cache whose keys carry the version of the scope: the sum of the versions of its
+rows, which every change of a row bumps in the same UPDATE. Rows are never deleted, only counted down
+to 0, so the sum only grows. It is read from the database on every request, so every process sees a
+change as soon as it commits, whether or not the cache is shared between them, and writes lock no
+row besides the counts they change.
+"""
+
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from .models import Category, FacetCount, Quiz, Tag
+
+DEFAULT_FACETS = {
+    'CACHE': 'default',  # alias in CACHES of the cache facets are served from
+    'TIMEOUT': 5 * 60,  # seconds facets are kept in the cache
+}
+
+
+def facet_settings():
+    return {**DEFAULT_FACETS, **getattr(settings, 'QUIZ_FACETS', {})}
+
+
+def _cache():
+    return caches[facet_settings()['CACHE']]
+
+
+def category_scope(category_id):
+    return f'category:{category_id or ""}'
+
+
+def difficulty_scope(difficulty):
+    return f'difficulty:{difficulty}'
+
+
+def quiz_facets(category_id, difficulty):
+    """The (scope, facet, value) counts a quiz with this category and difficulty is counted in, tags aside"""
+    category = str(category_id or '')
+    return [
+        ('', 'category', category),
+        ('', 'difficulty', difficulty),
+        (category_scope(category_id), 'difficulty', difficulty),
+        (difficulty_scope(difficulty), 'category', category),
+    ]
+
+
+def tag_facets(category_id, difficulty, tag_ids):
+    """The (scope, facet, value) counts of tags `tag_ids` on a quiz with this category and difficulty"""
+    keys = []
+    for tag_id in tag_ids:
+        keys += [
+            ('', 'tag', str(tag_id)),
+            (category_scope(category_id), 'tag', str(tag_id)),
+            (difficulty_scope(difficulty), 'tag', str(tag_id)),
+        ]
+    return keys
+
+
+def adjust_facet_counts(deltas):
+    """
+    Add `deltas`, {(scope, facet, value): amount}, to the facet counts. Missing rows are created,
+    and counts changed by the same amount are updated together.
+    """
+    deltas = {key: amount for key, amount in deltas.items() if amount}
+    if not deltas:
+        return
+    FacetCount.objects.bulk_create(
+        [FacetCount(scope=scope, facet=facet, value=value) for (scope, facet, value), amount in deltas.items()
+         if amount > 0],
+        ignore_conflicts=True,
+    )
+
+    by_change = defaultdict(lambda: defaultdict(list))
+    for (scope, facet, value), amount in deltas.items():
+        by_change[amount][scope, facet].append(value)
+    for amount, groups in by_change.items():
+        rows = Q(*[Q(scope=scope, facet=facet, value__in=values) for (scope, facet), values in groups.items()],
+                 _connector=Q.OR)
+        FacetCount.objects.filter(rows).update(count=F('count') + amount, version=F('version') + 1)
+
+
+def quiz_deltas(quizzes, sign):
+    """Deltas adding (sign 1) or removing (sign -1) `quizzes`, as (category id, difficulty, tag ids)"""
+    deltas = Counter()
+    for category_id, difficulty, tag_ids in quizzes:
+        for key in quiz_facets(category_id, difficulty) + tag_facets(category_id, difficulty, tag_ids):
+            deltas[key] += sign
+    return deltas
+
+
+def tagged_quizzes(quiz_ids):
+    """{quiz id: (category id, difficulty, tag ids)} of the given quizzes"""
+    quizzes = {quiz_id: (category_id, difficulty, [])
+               for quiz_id, category_id, difficulty in Quiz.objects.filter(pk__in=quiz_ids)
+               .values_list('pk', 'category', 'difficulty')}
+    for quiz_id, tag_id in Quiz.tags.through.objects.filter(quiz__in=quiz_ids).values_list('quiz', 'tag'):
+        quizzes[quiz_id][2].append(tag_id)
+    return quizzes
+
+
+def count_facets():
+    """All facet counts recomputed from the quiz and quiz tag tables, {(scope, facet, value): count}"""
+    counts = Counter()
+    by_quiz = (Quiz.objects.order_by().values('category', 'difficulty').annotate(n=Count('pk'))
+               .values_list('category', 'difficulty', 'n'))
+    for category_id, difficulty, n in by_quiz:
+        for key in quiz_facets(category_id, difficulty):
+            counts[key] += n
+    by_tag = (Quiz.tags.through.objects.order_by().values('quiz__category', 'quiz__difficulty', 'tag')
+              .annotate(n=Count('pk')).values_list('quiz__category', 'quiz__difficulty', 'tag', 'n'))
+    for category_id, difficulty, tag_id, n in by_tag:
+        for key in tag_facets(category_id, difficulty, [tag_id]):
+            counts[key] += n
+    return counts
+
+
+def rebuild_facet_counts():
+    """
+    Recompute every facet count and write those that drifted, bumping their versions. Returns the
+    number of counts corrected.
+    Changes committed by other processes while the counts are recomputed may be lost, so run this
+    when quizzes are not being edited, or run it twice.
+    """
+    with transaction.atomic():
+        actual = count_facets()
+        stored = {(row.scope, row.facet, row.value): row for row in FacetCount.objects.all()}
+
+        changed = []
+        for key, row in stored.items():
+            # values no quiz has anymore go down to 0, deleting them could take a version sum back
+            if row.count != actual.get(key, 0):
+                row.count = actual.get(key, 0)
+                row.version += 1
+                changed.append(row)
+        missing = [FacetCount(scope=scope, facet=facet, value=value, count=count, version=1)
+                   for (scope, facet, value), count in actual.items() if (scope, facet, value) not in stored]
+
+        FacetCount.objects.bulk_update(changed, ['count', 'version'], batch_size=1000)
+        FacetCount.objects.bulk_create(missing, batch_size=1000)
+    return len(changed) + len(missing)
+
+
+def invalidate_facet_cache(facet, value):
+    """Make the cached facets showing `value` of `facet` stale, as when a category or tag is renamed"""
+    FacetCount.objects.filter(facet=facet, value=str(value)).update(version=F('version') + 1)
+
+
+def _read_facets(scope):
+    rows = FacetCount.objects.filter(scope=scope, count__gt=0).order_by('-count', 'value')
+    by_facet = defaultdict(list)
+    for facet, value, count in rows.values_list('facet', 'value', 'count'):
+        by_facet[facet].append((value, count))
+
+    categories = Category.objects.in_bulk([int(value) for value, _ in by_facet['category'] if value])
+    tags = Tag.objects.in_bulk([int(value) for value, _ in by_facet['tag']])
+    labels = dict(Quiz.DIFFICULTY_CHOICES)
+
+    facets = {'category': [], 'tag': [], 'difficulty': []}
+    for value, count in by_facet['category']:
+        category = categories.get(int(value)) if value else None
+        # rows of a deleted category are drift, left for the rebuild
+        if value and category is None:
+            continue
+        facets['category'].append({'id': category and category.pk, 'name': category and category.name,
+                                   'count': count})
+    for value, count in by_facet['tag']:
+        if int(value) in tags:
+            facets['tag'].append({'id': int(value), 'name': tags[int(value)].name, 'count': count})
+    for value, count in by_facet['difficulty']:
+        facets['difficulty'].append({'value': value, 'name': labels.get(value, value), 'count': count})
+
+    # every quiz has exactly one category and one difficulty, so either adds up to the quizzes in scope
+    totals = by_facet['category'] if scope.startswith('difficulty:') else by_facet['difficulty']
+    return {'total': sum(count for _, count in totals), **facets}
+
+
+def get_facets(scope=''):
+    """
+    The category, tag and difficulty counts of the quizzes in `scope` (see FacetCount), each most
+    frequent first, with the number of quizzes in scope as 'total'.
+    """
+    cache = _cache()
+    version = FacetCount.objects.filter(scope=scope).aggregate(version=Sum('version'))['version'] or 0
+    key = f'quiz-facets:{scope}:{version}'
+    facets = cache.get(key)
+    if facets is None:
+        facets = _read_facets(scope)
+        cache.set(key, facets, facet_settings()['TIMEOUT'])
+    return facets
@@ -0,0 +1,182 @@
+# quizzes/jobs.py
+
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .backends import TokenUsage
+from .llm_guard import guard_stats
+from .models import GenerationJob, TempQuestion
+from .pdf_processor import process_pdf_and_generate_questions
+from .revisions import DeckRevision
+from .tracing import Tracer, job_trace_id, tracing_settings
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationInProgress(Exception):
+    """A quiz already has a queued or running generation job, the next upload has to wait for it"""
+
+    def __init__(self, job):
+        super().__init__(f"Question generation is already {job.status} for this quiz (job {job.pk})")
+        self.job = job
+
+
+def enqueue_generation_job(temp_pdf):
+    """
+    Queue question generation for an uploaded PDF. The job is picked up by a
+    `run_generation_worker` process, so the request that uploaded the file can return straight away.
+
+    Raises GenerationInProgress if the quiz has a job queued or running, as each upload of a deck is
+    diffed against the one before (see quizzes.revisions).
+    """
+    active = GenerationJob.objects.filter(quiz=temp_pdf.quiz, status__in=GenerationJob.ACTIVE_STATUSES)
+    try:
+        with transaction.atomic():
+            if (job := active.first()) is not None:
+                raise GenerationInProgress(job)
+            return GenerationJob.objects.create(
+                quiz=temp_pdf.quiz,
+                user=temp_pdf.user,
+                temp_pdf=temp_pdf,
+            )
+    except IntegrityError:
+        # another upload queued its job in the meantime, see one_active_generation_job_per_quiz
+        job = active.first()
+        if job is None:
+            raise
+        raise GenerationInProgress(job)
+
+
+def claim_next_job(worker_id):
+    """
+    Atomically mark the oldest queued job as running and return it, or None if the queue is empty.
+
+    skip_locked lets several workers poll the table at once without handing out the same job twice.
+    """
+    with transaction.atomic():
+        job = (
+            GenerationJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=GenerationJob.STATUS_QUEUED)
+            .order_by('created_at', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+
+        job.status = GenerationJob.STATUS_RUNNING
+        job.worker = worker_id
+        job.started_at = job.heartbeat_at = timezone.now()
+        job.attempts += 1
+        job.save(update_fields=['status', 'worker', 'started_at', 'heartbeat_at', 'attempts'])
+    return job
+
+
+def requeue_stale_jobs(stale_after, max_attempts=3):
+    """
+    Put jobs whose worker died mid-run, which have not reported progress for `stale_after` seconds,
+    back in the queue, and give up on them after max_attempts. Returns the number of jobs that were
+    requeued.
+    """
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    stale = GenerationJob.objects.filter(status=GenerationJob.STATUS_RUNNING, heartbeat_at__lt=cutoff)
+
+    stale.filter(attempts__gte=max_attempts).update(
+        status=GenerationJob.STATUS_FAILED,
+        error='Worker stopped responding too many times',
+        finished_at=timezone.now(),
+    )
+    return stale.filter(attempts__lt=max_attempts).update(status=GenerationJob.STATUS_QUEUED, worker='')
+
+
+def run_job(job):
+    """
+    Generate the questions for a claimed job, recording progress as slides are processed, and the
+    tokens its LLM calls used, its question cache hits and misses and what the LLM guard did to its
+    calls, whether or not it succeeds. A worker runs one job at a time, so the guard's counters of the
+    process are attributed to the job they moved during.
+
+    When the quiz had a deck generated before, only the slides that changed since are generated, and
+    the diff against the previous deck is stored on the job (see quizzes.revisions). So are the slides
+    whose questions failed, which the next upload of the deck generates again.
+
+    The run is traced, one trace per attempt, and a summary of the trace is stored on the job (see
+    quizzes.tracing).
+    """
+    usage = TokenUsage()
+    failed_slides = set()
+    cache_counts = Counter()
+    stats_before = guard_stats()
+    tracer = Tracer(job_trace_id(job.pk, job.attempts))
+    root = tracer.start_span('generation_job', job=job.pk, quiz=job.quiz_id)
+
+    def report_progress(done, total):
+        GenerationJob.objects.filter(pk=job.pk).update(progress=done, total=total, heartbeat_at=timezone.now())
+
+    try:
+        if job.temp_pdf is None:
+            raise ValueError('The uploaded PDF for this job no longer exists')
+        if job.attempts > 1:
+            # the questions an attempt that died had saved are generated again
+            TempQuestion.objects.filter(job=job).delete()
+
+        revision = DeckRevision(job.quiz, job=job)
+        num_questions = process_pdf_and_generate_questions(
+            job.temp_pdf.file.path,
+            job.quiz,
+            progress_callback=report_progress,
+            blob=job.temp_pdf.blob,
+            usage=usage,
+            regenerate=revision.regenerate,
+            tracer=tracer,
+            job=job,
+            failed_slides=failed_slides,
+            cache_counts=cache_counts,
+        )
+        with tracer.span('carry_over'):
+            diff = revision.apply()
+    except Exception as e:
+        logger.exception(f"Generation job {job.pk} failed")
+        root.end(error=e)
+        job.status = GenerationJob.STATUS_FAILED
+        job.error = str(e)
+        # match the old synchronous behaviour: a PDF that failed to process is not kept around
+        if job.temp_pdf is not None:
+            job.temp_pdf.delete()
+            job.temp_pdf = None
+    else:
+        job.status = GenerationJob.STATUS_SUCCEEDED
+        job.num_questions = num_questions
+        job.slides = revision.slides
+        job.failed_slides = sorted(failed_slides)
+        job.diff = diff
+
+    for field in TokenUsage.FIELDS:
+        setattr(job, field, usage.totals[field])
+    job.question_cache_hits = cache_counts['hits']
+    job.question_cache_misses = cache_counts['misses']
+    job.guard_stats = {name: round(value - stats_before[name], 3) for name, value in guard_stats().items()}
+    root.set(status=job.status, questions=job.num_questions)
+    root.end()
+    job.trace_summary = tracer.summary()
+    _export_trace(tracer)
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'num_questions', 'temp_pdf', 'finished_at', 'slides',
+                            'failed_slides', 'diff', 'trace_summary', 'question_cache_hits', 'question_cache_misses',
+                            'guard_stats', *TokenUsage.FIELDS])
+    return job
+
+
+def _export_trace(tracer):
+    path = tracing_settings()['PATH']
+    if not path:
+        return
+    try:
+        tracer.export(path)
+    except OSError:
+        # the summary on the job is enough to go on, a full disk should not fail the job
+        logger.exception(f"Could not write trace {tracer.trace_id} to {path}")
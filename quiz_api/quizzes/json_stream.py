@@ -0,0 +1,124 @@
+# quizzes/json_stream.py
+
+"""
+Incremental parsing of the LLM's answers while they stream in, so questions can be used as soon as
+they are complete and the questions of an answer that is cut off are not lost with it.
+"""
+
+import json
+
+
+class QuestionStreamParser:
+    """
+    Parses an answer of the form {"slides": [{"slide_number": N, "questions": [{...}, ...]}, ...]}
+    fed in as arbitrary chunks of text. feed() returns the (slide_number, question) pairs whose
+    question object was closed by that chunk.
+
+    Anything before the first "{", such as a markdown fence, is ignored, and question objects that
+    are not valid JSON are skipped. A question is held back until its slide's number is known, which
+    only matters when the model writes "slide_number" after "questions".
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        # [opening character, key in the parent object, offset] of every open object and array
+        self.stack = []
+        self.in_string = False
+        self.escaped = False
+        self.string_start = None
+        self.key_candidate = None
+        self.key = None
+        self.scalar = ''
+        self.slide_number = None
+        self.pending = []
+
+    def _in_slide(self):
+        return len(self.stack) == 3 and self.stack[1][1] == 'slides' and self.stack[2][0] == '{'
+
+    def _set_slide_number(self, value):
+        if self._in_slide() and self.key == 'slide_number':
+            try:
+                self.slide_number = int(value)
+            except (TypeError, ValueError):
+                pass
+
+    def _string_done(self, end):
+        try:
+            value = json.loads(self.buffer[self.string_start:end])
+        except ValueError:
+            value = None
+        if self.stack[-1][0] == '{' and self.key is None:
+            self.key_candidate = value
+        else:
+            self._set_slide_number(value)
+
+    def _scalar_done(self):
+        if self.scalar:
+            try:
+                self._set_slide_number(float(self.scalar))
+            except ValueError:
+                pass
+            self.scalar = ''
+
+    def _closed(self, start, end, found):
+        depth = len(self.stack)
+        if depth == 4 and self.stack[1][1] == 'slides' and self.stack[3][1] == 'questions':
+            # a question object, inside a slide's questions array
+            try:
+                question = json.loads(self.buffer[start:end])
+            except ValueError:
+                return
+            if self.slide_number is None:
+                self.pending.append(question)
+            else:
+                found.append((self.slide_number, question))
+        elif depth == 2 and self.stack[1][1] == 'slides':
+            # a slide object
+            if self.slide_number is not None:
+                found.extend((self.slide_number, question) for question in self.pending)
+            self.pending = []
+            self.slide_number = None
+
+    def feed(self, text):
+        found = []
+        offset = len(self.buffer)
+        self.buffer += text
+        for index in range(offset, len(self.buffer)):
+            char = self.buffer[index]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    self._string_done(index + 1)
+                continue
+            if not self.stack and char != '{':
+                continue
+
+            if char == '"':
+                self.in_string = True
+                self.string_start = index
+            elif char in '{[':
+                parent_key = self.key if self.stack and self.stack[-1][0] == '{' else None
+                self.stack.append([char, parent_key, index])
+                self.key = None
+                if self._in_slide():
+                    self.slide_number = None
+                    self.pending = []
+            elif char in '}]':
+                self._scalar_done()
+                _, _, start = self.stack.pop()
+                if char == '}':
+                    self._closed(start, index + 1, found)
+                self.key = None
+            elif char == ':':
+                self.key = self.key_candidate
+            elif char == ',':
+                self._scalar_done()
+                if self.stack[-1][0] == '{':
+                    self.key = None
+            elif not char.isspace():
+                self.scalar += char
+        return found
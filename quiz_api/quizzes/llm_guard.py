@@ -0,0 +1,296 @@
+# quizzes/llm_guard.py
+
+"""
+Protection for LLM calls: a token-bucket rate limiter shared by every process on the host, retries
+with jittered exponential backoff, and a circuit breaker. Configured per backend with the LIMITS,
+RETRY and CIRCUIT_BREAKER keys of QUIZ_GENERATION_BACKENDS (see quizzes.backends).
+"""
+
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: the limiter is only shared between the threads of one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_stats = {'limiter_waits': 0, 'limiter_wait_seconds': 0.0, 'retries': 0, 'gave_up': 0,
+          'circuit_opened': 0, 'circuit_rejected': 0}
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def guard_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['limiter_wait_seconds'] = round(stats['limiter_wait_seconds'], 3)
+    return stats
+
+
+def reset_guard_stats():
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider that has been failing"""
+
+
+class TokenBucketLimiter:
+    """
+    Token buckets for requests and tokens per minute. Each bucket holds up to a minute's worth and
+    refills continuously, so short bursts go through and sustained load is spread out.
+
+    The bucket levels live in a JSON file that is locked while they are updated, so every worker
+    process on the host draws from the same buckets.
+    """
+
+    def __init__(self, path, requests_per_minute=None, tokens_per_minute=None):
+        self.path = path
+        self.limits = {name: limit for name, limit in
+                       [('requests', requests_per_minute), ('tokens', tokens_per_minute)] if limit}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @contextmanager
+    def _locked_state(self):
+        with self._lock, open(self.path, 'a+') as state_file:
+            if fcntl:
+                fcntl.flock(state_file, fcntl.LOCK_EX)
+            try:
+                state_file.seek(0)
+                try:
+                    state = json.loads(state_file.read() or '{}')
+                except ValueError:
+                    state = {}
+                yield state
+                state_file.seek(0)
+                state_file.truncate()
+                state_file.write(json.dumps(state))
+                state_file.flush()
+            finally:
+                if fcntl:
+                    fcntl.flock(state_file, fcntl.LOCK_UN)
+
+    def _try_acquire(self, wanted):
+        """Take `wanted` from the buckets if they all have enough, else return the seconds to wait"""
+        with self._locked_state() as state:
+            now = time.time()
+            wait = 0
+            for name, limit in self.limits.items():
+                bucket = state.setdefault(name, {'level': limit, 'updated': now})
+                bucket['level'] = min(limit, bucket['level'] + max(0, now - bucket['updated']) * limit / 60)
+                bucket['updated'] = now
+                # a request larger than a whole minute's budget waits for a full bucket
+                amount = min(wanted[name], limit)
+                if bucket['level'] < amount:
+                    wait = max(wait, (amount - bucket['level']) * 60 / limit)
+            if not wait:
+                for name, limit in self.limits.items():
+                    state[name]['level'] -= min(wanted[name], limit)
+            return wait
+
+    def acquire(self, tokens=0):
+        """Block until one request using `tokens` tokens may be sent. Returns the seconds waited."""
+        wanted = {'requests': 1, 'tokens': tokens}
+        waited = 0
+        while True:
+            wait = self._try_acquire(wanted)
+            if not wait:
+                break
+            time.sleep(wait)
+            waited += wait
+
+        if waited:
+            _count('limiter_waits')
+            _count('limiter_wait_seconds', waited)
+        return waited
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` retryable errors in a row and rejects calls for `reset_after` seconds,
+    then lets a single trial call through: its success closes the circuit, its failure reopens it,
+    and a trial that ends without either, like a stream its consumer closed, lets the next one
+    through. The state is kept per process.
+    """
+
+    def __init__(self, failures=5, reset_after=60):
+        self.failure_threshold = failures
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call may not be sent, and return whether it is the trial call"""
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            if time.monotonic() - self.opened_at >= self.reset_after and not self.trial_running:
+                self.trial_running = True
+                return True
+        _count('circuit_rejected')
+        raise CircuitOpenError('The LLM provider is failing, not sending more requests for now')
+
+    def end_trial(self):
+        with self._lock:
+            self.trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            reopen = self.trial_running
+            self.trial_running = False
+            if reopen or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                _count('circuit_opened')
+                logger.warning(f"LLM circuit breaker opened after {self.failures} failures")
+
+
+class LLMGuard:
+    """
+    Sends calls through the rate limiter, retries retryable errors with full-jitter exponential
+    backoff (a random delay up to base_delay * 2 ** attempt, capped at max_delay, or the provider's
+    Retry-After when it gives one), and trips the circuit breaker when the provider keeps failing.
+    Any of the three can be left out.
+    """
+
+    def __init__(self, limiter=None, attempts=1, base_delay=1.0, max_delay=30.0, breaker=None):
+        self.limiter = limiter
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+
+    @classmethod
+    def from_config(cls, alias, config):
+        """Build the guard described by a QUIZ_GENERATION_BACKENDS entry, or None if it has none"""
+        limits = config.get('LIMITS')
+        retry = config.get('RETRY')
+        circuit = config.get('CIRCUIT_BREAKER')
+        if not (limits or retry or circuit):
+            return None
+
+        limiter = None
+        if limits:
+            path = limits.get('STATE_FILE') or os.path.join(tempfile.gettempdir(), 'quiz_api', f'llm_limits_{alias}.json')
+            limiter = TokenBucketLimiter(
+                path,
+                requests_per_minute=limits.get('REQUESTS_PER_MINUTE'),
+                tokens_per_minute=limits.get('TOKENS_PER_MINUTE'),
+            )
+        retry = retry or {}
+        return cls(
+            limiter=limiter,
+            attempts=retry.get('ATTEMPTS', 1),
+            base_delay=retry.get('BASE_DELAY', 1.0),
+            max_delay=retry.get('MAX_DELAY', 30.0),
+            breaker=CircuitBreaker(circuit.get('FAILURES', 5), circuit.get('RESET_AFTER', 60)) if circuit else None,
+        )
+
+    def backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _before_call(self, tokens):
+        """Wait for the limiter, and return whether the call is the circuit breaker's trial call"""
+        trial = self.breaker.before_call() if self.breaker else False
+        try:
+            if self.limiter:
+                self.limiter.acquire(tokens)
+        except BaseException:
+            if trial:
+                self.breaker.end_trial()
+            raise
+        return trial
+
+    def _retry_delay(self, backend, error, attempt):
+        """Record a failed attempt and return the seconds to wait before the next one, or None to give up"""
+        if not backend.is_retryable(error):
+            # a bad request says nothing about the provider's health
+            if self.breaker:
+                self.breaker.record_success()
+            return None
+        if self.breaker:
+            self.breaker.record_failure()
+        if attempt + 1 >= self.attempts:
+            _count('gave_up')
+            return None
+        delay = self.backoff(attempt, backend.retry_after(error))
+        logger.warning(f"Retrying LLM call in {delay:.1f}s after {type(error).__name__}: {error}")
+        _count('retries')
+        return delay
+
+    def call(self, backend, function, *args, tokens=0, **kwargs):
+        """Call `function` on behalf of `backend`, which decides which errors are worth retrying"""
+        for attempt in range(self.attempts):
+            trial = self._before_call(tokens)
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(backend, e, attempt)
+                if delay is None:
+                    raise
+            else:
+                if self.breaker:
+                    self.breaker.record_success()
+                return result
+            finally:
+                # after the outcome was recorded, or if the call was interrupted without one
+                if trial:
+                    self.breaker.end_trial()
+            time.sleep(delay)
+
+    def stream(self, backend, function, *args, tokens=0, **kwargs):
+        """
+        Like call(), for a `function` returning an iterator of chunks. An attempt that fails before
+        its first chunk is retried; once part of the answer has been passed on, the error is raised
+        to the caller, which keeps what it received. A consumer that stops reading early closes
+        the stream without a verdict on the provider.
+        """
+        for attempt in range(self.attempts):
+            trial = self._before_call(tokens)
+            received = False
+            try:
+                for chunk in function(*args, **kwargs):
+                    received = True
+                    yield chunk
+            except Exception as e:
+                if received:
+                    if self.breaker and backend.is_retryable(e):
+                        self.breaker.record_failure()
+                    raise
+                delay = self._retry_delay(backend, e, attempt)
+                if delay is None:
+                    raise
+            else:
+                if self.breaker:
+                    self.breaker.record_success()
+                return
+            finally:
+                # also runs on GeneratorExit, which is not an Exception
+                if trial:
+                    self.breaker.end_trial()
+            time.sleep(delay)
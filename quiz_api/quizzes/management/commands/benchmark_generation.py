@@ -0,0 +1,51 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from quizzes.benchmark import compare_to_baseline, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Benchmark PDF extraction, question generation and saving on synthetic decks, offline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, nargs='+', default=[10, 100, 500],
+                            help='Page counts of the synthetic decks to benchmark')
+        parser.add_argument('--latency', type=float, default=0.2,
+                            help='Seconds the stub LLM takes to answer each request')
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Concurrent LLM requests (default: QUIZ_GENERATION_CONCURRENCY)')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+        parser.add_argument('--baseline', help='JSON report of an earlier run to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Relative growth of a metric over the baseline counted as a regression')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Exit with an error when a metric regressed against the baseline')
+
+    def handle(self, *args, **options):
+        report = run_benchmarks(options['pages'], latency=options['latency'], concurrency=options['concurrency'])
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output + '\n')
+            self.stderr.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+        if not options['baseline']:
+            return
+        with open(options['baseline']) as baseline_file:
+            rows = compare_to_baseline(report, json.load(baseline_file), tolerance=options['tolerance'])
+
+        regressions = 0
+        for deck, stage, metric, old, new, change, regressed in rows:
+            line = f"{deck:>5} pages  {stage:<12} {metric:<24} {old:>10} -> {new:<10} {change:+.1%}"
+            if regressed:
+                regressions += 1
+                self.stderr.write(self.style.ERROR(line))
+            else:
+                self.stderr.write(line)
+
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f"{regressions} metric(s) regressed by more than {options['tolerance']:.0%}")
@@ -0,0 +1,19 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from quizzes.benchmark import benchmark_search
+
+
+class Command(BaseCommand):
+    help = 'Benchmark quiz search on a synthetic question bank, rolled back afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=1000000, help='Questions in the synthetic bank')
+        parser.add_argument('--questions-per-quiz', type=int, default=100)
+        parser.add_argument('--queries', type=int, default=30, help='Searches to time')
+
+    def handle(self, *args, **options):
+        report = benchmark_search(options['questions'], questions_per_quiz=options['questions_per_quiz'],
+                                  num_queries=options['queries'])
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from quizzes.facets import rebuild_facet_counts
+
+
+class Command(BaseCommand):
+    help = 'Recompute the quiz counts by category, tag and difficulty from the quiz and tag tables'
+
+    def handle(self, *args, **options):
+        corrected = rebuild_facet_counts()
+        self.stdout.write(self.style.SUCCESS(f"Corrected {corrected} facet counts"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from quizzes.counters import reconcile_quiz_counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute the question and attempt counters of every quiz from the questions and attempts tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Quizzes recomputed per UPDATE')
+
+    def handle(self, *args, **options):
+        corrected = reconcile_quiz_counters(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Corrected the counters of {corrected} quizzes"))
@@ -0,0 +1,49 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+
+from quizzes.jobs import claim_next_job, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = 'Process queued question generation jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty instead of polling for new jobs')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait between polls when the queue is empty')
+        parser.add_argument('--stale-after', type=int, default=30 * 60,
+                            help='Seconds after which a running job is assumed to belong to a dead worker')
+
+    def handle(self, *args, **options):
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.stdout.write(f"Generation worker {worker_id} started")
+
+        while True:
+            requeued = requeue_stale_jobs(options['stale_after'])
+            if requeued:
+                self.stdout.write(f"Requeued {requeued} stale job(s)")
+
+            job = claim_next_job(worker_id)
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f"Running generation job {job.pk} for quiz {job.quiz_id}")
+            job = run_job(job)
+            stats = job.guard_stats
+            self.stdout.write(
+                f"Job {job.pk}: waited {stats['limiter_wait_seconds']}s for the rate limiter "
+                f"({stats['limiter_waits']} times), {stats['retries']} retries, "
+                f"{stats['circuit_rejected']} calls rejected by the circuit breaker, "
+                f"{job.question_cache_hits} question cache hits and {job.question_cache_misses} misses"
+            )
+            if job.status == job.STATUS_SUCCEEDED:
+                self.stdout.write(self.style.SUCCESS(f"Job {job.pk}: {job.num_questions} questions generated"))
+            else:
+                self.stdout.write(self.style.ERROR(f"Job {job.pk} failed: {job.error}"))
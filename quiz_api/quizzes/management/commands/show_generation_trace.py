@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from quizzes.models import GenerationJob
+from quizzes.tracing import job_trace_id, load_trace, summarize, tracing_settings
+
+
+class Command(BaseCommand):
+    help = 'Print where the time of a generation job went, stage by stage, from its trace'
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_id', type=int, help='Generation job to show the trace of')
+        parser.add_argument('--path', default=None,
+                            help='JSONL file of exported spans (default: QUIZ_TRACING PATH)')
+        parser.add_argument('--attempt', type=int, default=None,
+                            help='Attempt of a retried job to show (default: the latest)')
+        parser.add_argument('--width', type=int, default=40, help='Width of the bars in characters')
+
+    def handle(self, *args, **options):
+        try:
+            job = GenerationJob.objects.get(pk=options['job_id'])
+        except GenerationJob.DoesNotExist:
+            raise CommandError(f"Generation job {options['job_id']} does not exist")
+
+        attempt = options['attempt'] or job.attempts
+        path = options['path'] or tracing_settings()['PATH']
+        spans = load_trace(path, job_trace_id(job.pk, attempt)) if path else []
+        # the summary on the job, of its latest attempt, is used once the spans are no longer in the file
+        summary = summarize(spans) if spans else None
+        if summary is None and attempt == job.attempts:
+            summary = job.trace_summary
+        if not summary or not summary['stages']:
+            raise CommandError(f"No trace was recorded for attempt {attempt} of generation job {job.pk}")
+
+        total = summary['seconds'] or 1
+        self.stdout.write(f"{job}: {summary['seconds']:.3f}s")
+        for stage in summary['stages']:
+            names = stage['path'].split('/')
+            label = '  ' * (len(names) - 1) + names[-1]
+            share = stage['seconds'] / total
+            bar = '#' * max(1, round(min(share, 1) * options['width'])) if stage['seconds'] else ''
+            line = (f"{label:<32} {stage['seconds']:>9.3f}s {share:>7.1%}  {bar:<{options['width']}}"
+                    f" x{stage['count']}")
+            if stage['errors']:
+                self.stdout.write(self.style.ERROR(f"{line}  {stage['errors']} failed"))
+            else:
+                self.stdout.write(line)
+
+        if summary['slides']:
+            outcomes = ', '.join(f"{count} {outcome}" for outcome, count in sorted(summary['slides'].items()))
+            self.stdout.write(f"\nSlides: {outcomes}")
+        for slide in summary['slowest_slides']:
+            self.stdout.write(f"  slide {slide['slide_number']:<5} {slide['seconds']:>9.3f}s  {slide['outcome']}")
+        if summary['tokens']:
+            tokens = ', '.join(f"{count} {name.replace('_', ' ')}" for name, count in summary['tokens'].items())
+            self.stdout.write(f"\nTokens: {tokens}")
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from quizzes.sweeper import sweep_expired_temp_data, temp_data_settings
+
+
+class Command(BaseCommand):
+    help = 'Delete temp questions, temp answers and temp PDFs that were never reviewed, and their files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=None,
+                            help='Seconds after which temp data is considered abandoned (default: QUIZ_TEMP_DATA MAX_AGE)')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Rows deleted per transaction (default: QUIZ_TEMP_DATA BATCH_SIZE)')
+        parser.add_argument('--skip-files', action='store_true',
+                            help='Do not scan storage for orphaned files')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep sweeping every --interval seconds instead of exiting after one sweep')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Seconds between sweeps with --loop (default: QUIZ_TEMP_DATA SWEEP_INTERVAL)')
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or temp_data_settings()['SWEEP_INTERVAL']
+
+        while True:
+            report = sweep_expired_temp_data(
+                max_age=options['max_age'],
+                batch_size=options['batch_size'],
+                include_files=not options['skip_files'],
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"Deleted {report['temp_questions']} temp questions, {report['temp_answers']} temp answers, "
+                f"{report['temp_pdfs']} temp PDFs and {report['orphaned_files']} orphaned files, "
+                f"freeing {report['bytes_freed']} bytes in {report['seconds']}s"
+            ))
+            if not options['loop']:
+                break
+            time.sleep(interval)
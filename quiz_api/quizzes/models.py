@@ -2,6 +2,8 @@
 
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+from documents.models import PDFBlob
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
@@ -10,6 +12,9 @@ class Tag(models.Model):
     name = models.CharField(max_length=50)
 
 class Quiz(models.Model):
+    # only ever written by atomic UPDATEs, see save()
+    MAINTAINED_FIELDS = ('version', 'question_count', 'attempt_count', 'completed_attempt_count', 'score_sum')
+
     DIFFICULTY_CHOICES = [
         ('not_specified', 'Not Specified'),
         ('easy', 'Easy'),
@@ -25,10 +30,34 @@ class Quiz(models.Model):
     tags = models.ManyToManyField(Tag, blank=True, related_name='quizzes')
     difficulty = models.CharField(max_length=20, choices=DIFFICULTY_CHOICES, default='not_specified')
     time_limit = models.IntegerField(null=True, blank=True, help_text="Time limit in minutes")
+    # bumped in the database by every write to the quiz, its questions or answers (see quizzes.quiz_cache)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    # denormalized counts of the quiz's questions and attempts, kept current by quizzes.counters
+    question_count = models.PositiveIntegerField(default=0, editable=False)
+    attempt_count = models.PositiveIntegerField(default=0, editable=False)
+    completed_attempt_count = models.PositiveIntegerField(default=0, editable=False)
+    score_sum = models.FloatField(default=0, editable=False, help_text="Sum of the scores of completed attempts")
+
+    class Meta:
+        indexes = [
+            # the quiz list: a creator's quizzes, newest first (see QuizCursorPagination)
+            models.Index(fields=['creator', '-created_at', '-id']),
+        ]
 
     def __str__(self):
         return self.title
 
+    @property
+    def average_score(self):
+        return self.score_sum / self.completed_attempt_count if self.completed_attempt_count else None
+
+    def save(self, *args, **kwargs):
+        # saving a copy read before a concurrent UPDATE must not write its stale counters and version back
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.MAINTAINED_FIELDS]
+        super().save(*args, **kwargs)
+
 
 class Question(models.Model):
     QUESTION_TYPES = [
@@ -39,6 +68,8 @@ class Question(models.Model):
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='questions')
     text = models.TextField()
     question_type = models.CharField(max_length=20, choices=QUESTION_TYPES, default='mcq')
+    slide_number = models.IntegerField(null=True, blank=True,
+                                       help_text="Slide of the latest uploaded deck the question was generated from")
 
 class Answer(models.Model):
     question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='answers')
@@ -59,6 +90,12 @@ class TempQuestion(models.Model):
     text = models.TextField()
     question_type = models.CharField(max_length=20, choices=QUESTION_TYPES, default='mcq')
     slide_number = models.IntegerField(default=0, null=True, blank=True)
+    duplicate_slide_numbers = models.JSONField(default=list, blank=True,
+                                               help_text="Near-duplicate slides merged into this slide")
+    # the generation job of the deck the question belongs to, which the next upload is diffed against
+    job = models.ForeignKey('GenerationJob', on_delete=models.SET_NULL, null=True, blank=True,
+                            related_name='temp_questions')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def __str__(self):
         return f"Temp: {self.text[:50]}"
@@ -76,10 +113,110 @@ class TempPDF(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='temp_pdfs')
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='temp_pdfs', null=True, blank=True)
     file = models.FileField(upload_to='temp_pdfs/')
-    uploaded_at = models.DateTimeField(auto_now_add=True)
+    blob = models.ForeignKey(PDFBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='temp_pdfs')
+    uploaded_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def __str__(self):
         return f"{self.user.username}'s PDF uploaded at {self.uploaded_at}"
 
 
+class GenerationJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='generation_jobs')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='generation_jobs')
+    temp_pdf = models.ForeignKey(TempPDF, on_delete=models.SET_NULL, null=True, blank=True, related_name='generation_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    progress = models.PositiveIntegerField(default=0, help_text="Number of slides processed so far")
+    total = models.PositiveIntegerField(default=0, help_text="Number of slides extracted from the PDF")
+    num_questions = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    # tokens used by the job's LLM calls; cache writes and reads are the input tokens written to and
+    # read from the provider's prompt cache, and are not counted in input_tokens
+    input_tokens = models.PositiveIntegerField(default=0)
+    output_tokens = models.PositiveIntegerField(default=0)
+    cache_write_tokens = models.PositiveIntegerField(default=0)
+    cache_read_tokens = models.PositiveIntegerField(default=0)
+    # slides (or parts of split slides) answered from the question cache, and looked up in it in vain
+    question_cache_hits = models.PositiveIntegerField(default=0)
+    question_cache_misses = models.PositiveIntegerField(default=0)
+    guard_stats = models.JSONField(null=True, blank=True,
+                                   help_text="Rate limiter waits, retries and circuit breaker rejections of the job's LLM calls")
+    slides = models.JSONField(null=True, blank=True, help_text="Slide texts of the deck, compared against by the next upload")
+    failed_slides = models.JSONField(default=list, blank=True,
+                                     help_text="Slides whose questions could not be generated, generated again by the next upload")
+    diff = models.JSONField(null=True, blank=True, help_text="Summary of the changes since the previous upload")
+    trace_summary = models.JSONField(null=True, blank=True, help_text="Time spent in each stage of the run, see quizzes.tracing")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # set when the job is claimed and whenever it reports progress, a job that stops updating it is stale
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    ACTIVE_STATUSES = [STATUS_QUEUED, STATUS_RUNNING]
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+        constraints = [
+            # two jobs of a quiz would carry over and renumber each other's questions
+            models.UniqueConstraint(fields=['quiz'], condition=models.Q(status__in=['queued', 'running']),
+                                    name='one_active_generation_job_per_quiz'),
+        ]
+
+    def __str__(self):
+        return f"Generation job {self.pk} for {self.quiz.title} ({self.status})"
+
+
+class CachedSlideQuestions(models.Model):
+    """Parsed LLM output for one slide, keyed by a hash of the slide text, prompt version and model"""
+    key = models.CharField(max_length=64, unique=True)
+    model_name = models.CharField(max_length=100)
+    prompt_version = models.CharField(max_length=20)
+    questions = models.JSONField(default=list)
+    size = models.PositiveIntegerField(default=0, help_text="Size of the cached questions in bytes")
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"Cached questions {self.key[:12]} ({self.model_name}, v{self.prompt_version})"
+
+
+class FacetCount(models.Model):
+    """
+    Number of quizzes having a category, tag or difficulty `value` among the quizzes of a `scope`: ''
+    for all quizzes, 'category:<id>' ('category:' for uncategorized ones) or 'difficulty:<level>'.
+    Kept current by quizzes.facets.
+    """
+    FACET_CHOICES = [
+        ('category', 'Category'),
+        ('tag', 'Tag'),
+        ('difficulty', 'Difficulty'),
+    ]
+
+    scope = models.CharField(max_length=50, blank=True)
+    facet = models.CharField(max_length=20, choices=FACET_CHOICES)
+    value = models.CharField(max_length=50, blank=True, help_text="Category or tag id, or difficulty level")
+    count = models.IntegerField(default=0)
+    version = models.PositiveIntegerField(default=0, help_text="Number of times the row was changed")
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'facet', 'value'], name='unique_facet_count'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope or 'all'} {self.facet}={self.value}: {self.count}"
@@ -0,0 +1,21 @@
+# quizzes/pagination.py
+
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class QuizCursorPagination(CursorPagination):
+    """
+    Keyset pagination of the quiz list, newest first. Each page is one indexed range scan from the
+    cursor, however deep into the list it is, and quizzes created while paging do not shift pages.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class SearchPagination(PageNumberPagination):
+    """Numbered pages of search results, which are ordered by rank and so cannot use a cursor"""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -1,123 +1,870 @@
-import anthropic
-import json
-from PyPDF2 import PdfReader
+import logging
+import os
+import queue
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
+from django.db import transaction
+from documents.models import PDFBlob, PDFPage
 from .models import TempQuestion, TempAnswer
-import re
+from . import question_cache
+from .backends import TokenUsage, get_backend
+from .dedup import NearDuplicateFilter
+from .extraction import iter_slide_texts, split_page_text
+from .json_stream import QuestionStreamParser
+from .token_budget import BoilerplateTrimmer, estimate_tokens, max_output_tokens, split_slide
+from .tracing import NULL_TRACER
 
-client = anthropic.Anthropic(api_key=settings.ANTHROPIC_API_KEY)
+logger = logging.getLogger(__name__)
 
+# bump whenever SYSTEM_PROMPT or build_prompt change, so cached questions from the old prompt are not reused
+PROMPT_VERSION = "5"
 
-def extract_slides_from_pdf(pdf_file):
-    reader = PdfReader(pdf_file)
-    slides = []
-    slide_number = 1
 
-    for page in reader.pages:
-        text = page.extract_text()
+def iter_slides_from_pdf(pdf_file, workers=None):
+    """
+    Yield the slides of a PDF, numbered in page order, while later pages are still being read.
 
-        # Split the page content if it contains multiple slides
-        potential_slides = re.split(r'\n(?=(?:Slide|^\d+\.)\s*\n)', text, flags=re.MULTILINE)
+    Large files are sharded by page range across a process pool (see quizzes.extraction), tuned by
+    QUIZ_EXTRACTION. `workers` overrides the configured number of processes. Page numbers and the
+    headers and footers repeated across pages are trimmed from slides over budget (QUIZ_TOKEN_BUDGET).
+    """
+    config = getattr(settings, 'QUIZ_EXTRACTION', {})
+    if workers is None:
+        workers = config.get('WORKERS') or os.cpu_count() or 1
 
-        for potential_slide in potential_slides:
-            if potential_slide.strip():  # Ignore empty slides
-                slides.append(f"Slide {slide_number}\n\n{potential_slide.strip()}\n")
-                slide_number += 1
+    slide_texts = iter_slide_texts(
+        pdf_file,
+        workers=workers,
+        min_pages=config.get('MIN_PAGES', 40),
+        shard_pages=config.get('SHARD_PAGES', 25),
+    )
+    yield from _numbered_slides(slide_texts)
 
-    return slides
 
+def iter_slides_from_document(document, first_page=1, last_page=None):
+    """
+    Yield the slides of pages `first_page` to `last_page` (inclusive, None for the last page) of a
+    stored documents.PDF, like iter_slides_from_pdf but from the page texts stored by its extraction,
+    without reading the PDF. Slides are numbered from 1 within the range.
+    """
+    if document.extracted_at is None or document.extraction_error:
+        raise ValueError(f"The text of document {document.pk} has not been extracted")
 
-def generate_questions(slides):
-    all_slides = []
+    pages = PDFPage.objects.filter(document=document, number__gte=first_page)
+    if last_page is not None:
+        pages = pages.filter(number__lte=last_page)
+    texts = pages.order_by('number').values_list('text', flat=True).iterator()
+    return _numbered_slides(slide for text in texts for slide in split_page_text(text))
 
-    for i, slide in enumerate(slides, 1):
-        print(f"Processing Slide {i} of {len(slides)}...")
 
-        if len(slide.split()) < 20:  # Skip slides with very little content
-            print(f"Skipping Slide {i} due to insufficient content.")
-            continue
+def _numbered_slides(slide_texts):
+    budget = _token_budget_settings()
+    trimmer = BoilerplateTrimmer(min_repeats=budget['BOILERPLATE_REPEATS'], max_tokens=budget['MAX_SLIDE_TOKENS'])
+    for slide_number, text in enumerate(slide_texts, 1):
+        yield f"Slide {slide_number}\n\n{trimmer.clean(text)}\n"
 
-        prompt = f"""
-        You are an expert in creating educational content about databases. Based on the following slide content (Slide {i} of {len(slides)}), generate multiple-choice questions that directly test the understanding of the information presented. Each question should have 4 options (A, B, C, D). Provide the correct answer for each question.
 
-        Guidelines:
-        1. Use ONLY the information explicitly stated in the slide content. Do not introduce any external knowledge or inferences.
-        2. Create questions that directly relate to the key points, definitions, and concepts presented in the slide.
-        3. Use the exact wording and terminology from the slide whenever possible.
-        4. Avoid creating questions about trivial details, slide titles, or formatting.
-        5. Generate 1-3 questions per slide, depending on the content density.
-        6. Ensure that the correct answer and at least one incorrect option are taken directly from the slide content.
-        7. If the slide doesn't contain enough substantial information to create meaningful questions, don't generate any questions for that slide.
+def extract_slides_from_pdf(pdf_file, workers=None):
+    return list(iter_slides_from_pdf(pdf_file, workers=workers))
 
-        Format the output as a JSON object with the following structure:
-        {{
+
+DEFAULT_TOKEN_BUDGET = {
+    'MAX_SLIDE_TOKENS': 800,
+    'QUESTIONS_PER_SLIDE': 3,
+    'TOKENS_PER_QUESTION': 120,
+    'MAX_OUTPUT_TOKENS': 4000,
+    'BOILERPLATE_REPEATS': 3,
+}
+
+
+def _token_budget_settings():
+    return {**DEFAULT_TOKEN_BUDGET, **getattr(settings, 'QUIZ_TOKEN_BUDGET', {})}
+
+
+class SlidePacker:
+    """
+    Groups a stream of adjacent slides into batches that are sent to the LLM in a single request.
+
+    A batch is closed once adding the next slide would take it over `token_budget` or `max_slides`,
+    or when the next entry is another part of a slide already in the batch, so the answer for a
+    slide number always belongs to a single part. A slide that is over budget on its own still gets
+    a batch to itself. Entries start with their slide number.
+    """
+
+    def __init__(self, token_budget, max_slides):
+        self.token_budget = token_budget
+        self.max_slides = max_slides
+        self.batch = []
+        self.batch_tokens = 0
+
+    def add(self, entry, slide):
+        """Add an entry for `slide`, returning the batch it closed (if any)"""
+        closed = None
+        tokens = estimate_tokens(slide)
+        if self.batch and (self.batch_tokens + tokens > self.token_budget or len(self.batch) >= self.max_slides
+                           or any(other[0] == entry[0] for other in self.batch)):
+            closed = self.flush()
+        self.batch.append(entry)
+        self.batch_tokens += tokens
+        return closed
+
+    def flush(self):
+        closed = self.batch
+        self.batch = []
+        self.batch_tokens = 0
+        return closed
+
+
+# The instructions and worked examples are the same for every request, so they go in the system
+# prompt, which the provider caches (see AnthropicBackend); only the slide content changes from
+# request to request. Providers only cache prompts of a minimum length, 2048 tokens for the Haiku
+# models, which the examples take it past.
+SYSTEM_PROMPT = """
+You are an expert in creating educational content about databases. Based on the slide content you are given, generate multiple-choice questions that directly test the understanding of the information presented. Each question should have 4 options (A, B, C, D). Provide the correct answer for each question.
+
+Guidelines:
+1. Use ONLY the information explicitly stated in the slide content. Do not introduce any external knowledge or inferences.
+2. Create questions that directly relate to the key points, definitions, and concepts presented in the slide.
+3. Use the exact wording and terminology from the slide whenever possible.
+4. Avoid creating questions about trivial details, slide titles, or formatting.
+5. Generate 1-3 questions per slide, depending on the content density.
+6. Ensure that the correct answer and at least one incorrect option are taken directly from the slide content.
+7. If the slide doesn't contain enough substantial information to create meaningful questions, don't generate any questions for that slide.
+8. Treat every slide separately. Each question must be based on a single slide and listed under that slide's number.
+
+Format the output as a JSON object with the following structure, with one entry per slide:
+{
+    "slides": [
+        {
+            "slide_number": 1,
             "questions": [
-                {{
+                {
                     "question_text": "Question text here",
-                    "options": {{
+                    "options": {
                         "A": "Option A text",
                         "B": "Option B text",
                         "C": "Option C text",
                         "D": "Option D text"
-                    }},
+                    },
                     "correct_answer": "Correct option letter"
-                }},
+                },
                 ...
             ]
-        }}
+        },
+        ...
+    ]
+}
 
-        If no meaningful questions can be generated using only the slide content, return an empty questions array.
+If no meaningful questions can be generated for a slide using only its content, return an empty questions array for that slide.
 
-        Slide content:
-        {slide}
-        """
+Examples of slides and the answer expected for them:
+
+Example 1. Slide content:
+Slide 4
+
+Normalization
+- First normal form (1NF): every column holds a single, atomic value, and there are no repeating groups
+- Second normal form (2NF): 1NF, and every non-key column depends on the whole primary key
+- Third normal form (3NF): 2NF, and no non-key column depends on another non-key column
+- Normalizing removes update, insertion and deletion anomalies
+
+Slide 5
+
+Questions?
+
+Slide 6
+
+B+ tree indexes
+- Keep keys sorted, so they answer both equality and range queries
+- All records are reached through the leaf level, and the leaves are linked for range scans
+- The tree stays balanced: every leaf is at the same depth
+
+Answer:
+{
+    "slides": [
+        {
+            "slide_number": 4,
+            "questions": [
+                {
+                    "question_text": "What does first normal form (1NF) require of every column?",
+                    "options": {
+                        "A": "That it holds a single, atomic value",
+                        "B": "That it depends on the whole primary key",
+                        "C": "That it depends on another non-key column",
+                        "D": "That it is part of the primary key"
+                    },
+                    "correct_answer": "A"
+                },
+                {
+                    "question_text": "Which normal form requires that every non-key column depends on the whole primary key?",
+                    "options": {
+                        "A": "First normal form (1NF)",
+                        "B": "Second normal form (2NF)",
+                        "C": "Third normal form (3NF)",
+                        "D": "None of them"
+                    },
+                    "correct_answer": "B"
+                },
+                {
+                    "question_text": "Which anomalies does normalizing remove?",
+                    "options": {
+                        "A": "Only deletion anomalies",
+                        "B": "Repeating groups, but no anomalies",
+                        "C": "Update, insertion and deletion anomalies",
+                        "D": "Only update anomalies"
+                    },
+                    "correct_answer": "C"
+                }
+            ]
+        },
+        {
+            "slide_number": 5,
+            "questions": []
+        },
+        {
+            "slide_number": 6,
+            "questions": [
+                {
+                    "question_text": "Why can a B+ tree index answer range queries?",
+                    "options": {
+                        "A": "Because it hashes its keys",
+                        "B": "Because it keeps its keys sorted",
+                        "C": "Because every record is stored in the root",
+                        "D": "Because it is rebuilt for every query"
+                    },
+                    "correct_answer": "B"
+                },
+                {
+                    "question_text": "What does it mean that a B+ tree stays balanced?",
+                    "options": {
+                        "A": "Every leaf holds the same number of records",
+                        "B": "The root has exactly two children",
+                        "C": "Every leaf is at the same depth",
+                        "D": "The leaves are linked for range scans"
+                    },
+                    "correct_answer": "C"
+                }
+            ]
+        }
+    ]
+}
+
+Example 2. Slide content:
+Slide 12
+
+Transactions: the ACID properties
+- Atomicity: all of the transaction's changes happen, or none of them do
+- Consistency: a transaction takes the database from one valid state to another
+- Isolation: concurrent transactions do not see each other's intermediate states
+- Durability: once committed, changes survive crashes
+
+Slide 13
+
+Joins
+- An inner join returns only the rows with a match in both tables
+- A left outer join returns every row of the left table, with NULLs where the right table has no match
+
+Answer:
+{
+    "slides": [
+        {
+            "slide_number": 12,
+            "questions": [
+                {
+                    "question_text": "Which ACID property guarantees that all of a transaction's changes happen, or none of them do?",
+                    "options": {
+                        "A": "Atomicity",
+                        "B": "Consistency",
+                        "C": "Isolation",
+                        "D": "Durability"
+                    },
+                    "correct_answer": "A"
+                },
+                {
+                    "question_text": "According to the isolation property, what do concurrent transactions not see?",
+                    "options": {
+                        "A": "Each other's committed changes",
+                        "B": "Each other's intermediate states",
+                        "C": "The valid states of the database",
+                        "D": "Changes that survived a crash"
+                    },
+                    "correct_answer": "B"
+                },
+                {
+                    "question_text": "What does durability guarantee once a transaction is committed?",
+                    "options": {
+                        "A": "That it can be rolled back",
+                        "B": "That no other transaction runs at the same time",
+                        "C": "That its changes survive crashes",
+                        "D": "That it takes the database to a valid state"
+                    },
+                    "correct_answer": "C"
+                }
+            ]
+        },
+        {
+            "slide_number": 13,
+            "questions": [
+                {
+                    "question_text": "Which rows does an inner join return?",
+                    "options": {
+                        "A": "Every row of the left table",
+                        "B": "Every row of both tables",
+                        "C": "Only the rows with a match in both tables",
+                        "D": "Only the rows without a match"
+                    },
+                    "correct_answer": "C"
+                },
+                {
+                    "question_text": "What does a left outer join return for a left table row with no match in the right table?",
+                    "options": {
+                        "A": "Nothing, the row is left out",
+                        "B": "The row, with NULLs for the right table",
+                        "C": "The row, joined with every row of the right table",
+                        "D": "An error"
+                    },
+                    "correct_answer": "B"
+                }
+            ]
+        }
+    ]
+}
+
+Example 3. Slide content:
+Slide 20
+
+Agenda
+- Locking
+- Recovery
+
+Slide 21
+
+Two-phase locking (2PL)
+- Growing phase: a transaction acquires locks and releases none
+- Shrinking phase: it releases locks and acquires no new ones
+- 2PL guarantees conflict-serializable schedules, but deadlocks are still possible
+
+Answer:
+{
+    "slides": [
+        {
+            "slide_number": 20,
+            "questions": []
+        },
+        {
+            "slide_number": 21,
+            "questions": [
+                {
+                    "question_text": "What does a transaction do in the growing phase of two-phase locking?",
+                    "options": {
+                        "A": "It acquires locks and releases none",
+                        "B": "It releases locks and acquires no new ones",
+                        "C": "It commits its changes",
+                        "D": "It detects deadlocks"
+                    },
+                    "correct_answer": "A"
+                },
+                {
+                    "question_text": "Which statement about two-phase locking (2PL) is true?",
+                    "options": {
+                        "A": "It prevents every deadlock",
+                        "B": "It guarantees conflict-serializable schedules, but deadlocks are still possible",
+                        "C": "It releases every lock in the growing phase",
+                        "D": "It only applies to read-only transactions"
+                    },
+                    "correct_answer": "B"
+                }
+            ]
+        }
+    ]
+}
+
+Example 4. Slide content:
+Slide 34
 
-        message = client.messages.create(
-            model="claude-3-haiku-20240307",
-            max_tokens=4000,
-            temperature=0.2,
-            messages=[
+Write-ahead logging (WAL)
+- A change is written to the log before the data page it changes is written to disk
+- After a crash, recovery redoes the logged changes of committed transactions
+- and undoes the changes of transactions that did not commit
+
+Answer:
+{
+    "slides": [
+        {
+            "slide_number": 34,
+            "questions": [
                 {
-                    "role": "user",
-                    "content": prompt
+                    "question_text": "In write-ahead logging, what is written to disk first?",
+                    "options": {
+                        "A": "The data page that is changed",
+                        "B": "The log record of the change",
+                        "C": "The index of the table",
+                        "D": "The commit of the next transaction"
+                    },
+                    "correct_answer": "B"
+                },
+                {
+                    "question_text": "After a crash, what does recovery do with the changes of transactions that did not commit?",
+                    "options": {
+                        "A": "It redoes them",
+                        "B": "It keeps them as they are",
+                        "C": "It undoes them",
+                        "D": "It writes them to the log"
+                    },
+                    "correct_answer": "C"
                 }
             ]
-        )
+        }
+    ]
+}
+""".strip()
+
+
+def build_prompt(batch):
+    """The per-request part of the prompt: the content of the slides in the batch"""
+    slide_numbers = ', '.join(str(slide_number) for slide_number, _ in batch)
+    slide_content = '\n\n'.join(slide for _, slide in batch)
+    return f"Generate the questions for Slides {slide_numbers}.\n\nSlide content:\n{slide_content}"
+
+
+def _is_question(question):
+    return (isinstance(question, dict) and isinstance(question.get('question_text'), str)
+            and isinstance(question.get('options'), dict) and bool(question['options'])
+            and 'correct_answer' in question)
+
+
+def generate_batch_questions(batch, backend=None, usage=None, on_question=None, tracer=NULL_TRACER):
+    """
+    Ask the LLM for the questions of a batch of slides and return them as {slide_number: questions}.
+    The tokens the request used are added to `usage`, a TokenUsage, when one is given.
+
+    The answer is streamed and parsed as it arrives, and `on_question(slide_number, question)` is
+    called for each question as soon as it is complete. Incomplete or malformed questions are left
+    out rather than failing the batch.
+
+    Runs on the generation thread pool, so it must not touch the database. API errors, including a
+    stream cut off midway, are raised to the caller once the questions received before them have been
+    passed to on_question; the caller decides what a failed batch means for the rest of the deck.
+    The request is traced as an llm_batch span of `tracer`.
+    """
+    backend = backend or get_backend()
+    budget = _token_budget_settings()
+    # slides the model left out of its answer simply get no questions
+    questions = {slide_number: [] for slide_number, _ in batch}
+    request_usage = TokenUsage()
+
+    with tracer.span('llm_batch', slides=list(questions)) as span:
+        with span.child('build_prompt'):
+            prompt = build_prompt(batch)
+            max_tokens = max_output_tokens(
+                len(batch),
+                questions_per_slide=budget['QUESTIONS_PER_SLIDE'],
+                tokens_per_question=budget['TOKENS_PER_QUESTION'],
+                limit=budget['MAX_OUTPUT_TOKENS'],
+            )
+
+        try:
+            with span.child('llm') as llm, llm.child('parse', aggregate=True) as parse:
+                chunks = backend.request_stream(prompt, max_tokens=max_tokens, temperature=0.2, system=SYSTEM_PROMPT,
+                                                usage=request_usage,
+                                                tokens=estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(prompt))
+                parser = QuestionStreamParser()
+                for chunk in chunks:
+                    with parse.timed():
+                        found = parser.feed(chunk)
+                    for slide_number, question in found:
+                        if slide_number in questions and _is_question(question):
+                            questions[slide_number].append(question)
+                            if on_question:
+                                on_question(slide_number, question)
+        finally:
+            if usage is not None and request_usage.requests:
+                usage.add(request_usage.totals)
+            span.set(questions=sum(len(slide_questions) for slide_questions in questions.values()),
+                     **request_usage.totals)
+    return questions
 
+
+def _slide_result(slide_number, questions, duplicates=(), error=None):
+    return {
+        "slide_number": slide_number,
+        "questions": questions,
+        "duplicate_slide_numbers": list(duplicates),
+        "error": error,
+    }
+
+
+def _answer_from_cache(batch, use_cache):
+    """
+    Split a batch of (slide_number, slide, cache key, duplicates) entries into results for the
+    slides in the question cache and the entries that still need the LLM.
+    """
+    cached = question_cache.get_cached_questions(entry[2] for entry in batch) if use_cache else {}
+    results = [_slide_result(number, cached[key], duplicates) for number, _, key, duplicates in batch if key in cached]
+    remaining = [entry for entry in batch if entry[2] not in cached]
+    return results, remaining
+
+
+def _collect(finished, in_flight, use_cache, model_name):
+    """
+    Turn finished LLM calls into the final results of their slides, which carry the merged
+    near-duplicates and any error, and cache the fresh questions
+    """
+    results = []
+    fresh = {}
+    for future in finished:
+        entries = in_flight.pop(future)
+        slide_numbers = [entry[0] for entry in entries]
+        error = None
         try:
-            slide_questions = json.loads(message.content[0].text)
-            if slide_questions['questions']:
-                all_slides.append({
-                    "slide_number": i,
-                    "questions": slide_questions['questions']
-                })
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON for Slide {i}: {e}")
-            continue
+            questions = future.result()
+        except Exception as e:
+            logger.warning(f"Error generating questions for Slides {slide_numbers}: {e}")
+            questions = {}
+            error = str(e)
+        else:
+            fresh.update((key, questions[number]) for number, _, key, _ in entries)
+
+        # the questions themselves were already handed out as they streamed in
+        results.extend(_slide_result(number, [], duplicates, error) for number, _, _, duplicates in entries)
+
+    if use_cache:
+        question_cache.store_questions(fresh, model_name, PROMPT_VERSION, run_eviction=False)
+    return results
+
+
+def iter_generated_questions(slides, progress_callback=None, concurrency=None, use_cache=True, dedupe=True,
+                             usage=None, regenerate=None, tracer=NULL_TRACER, cache_counts=None):
+    """
+    Generate questions for a stream of slides, yielding each slide's result as soon as it is ready.
+
+    The stages run interleaved so nothing waits for the whole deck: short slides are skipped,
+    near-duplicates are collapsed (QUIZ_DEDUP), slides too large for one prompt are split into parts
+    (QUIZ_TOKEN_BUDGET), adjacent slides are packed into batches (QUIZ_PACKING),
+    each batch is answered from the question cache or sent to the LLM on a pool of `concurrency`
+    threads, and questions are yielded as they stream in while later slides are still coming in. At
+    most 2 * concurrency batches are in flight, so memory does not grow with the size of the deck.
+
+    Results are dicts with slide_number, questions, duplicate_slide_numbers and error, yielded in
+    completion order. A slide can appear more than once: a near-duplicate found after its
+    representative was sent comes back as a result with no questions and just the merged slide
+    number, so consumers should merge results by slide_number. The parts of a split slide also
+    come back as separate results for the same slide_number, and so do the questions of an LLM
+    answer, which are yielded as soon as each one is complete, followed by a final result with no
+    questions once the answer is finished (or failed, keeping the questions received before).
+
+    The tokens used by the LLM calls are added to `usage`, a TokenUsage, when one is given, and the
+    question cache 'hits' and 'misses' to `cache_counts`, a Counter.
+    `regenerate(slide_number, slide)`, when given, sees every slide and picks the ones that get questions
+    (see quizzes.revisions); the others are skipped.
+
+    Every slide is traced as a span of `tracer` from the time it is read until it is finished, with
+    its outcome (generated, cached, failed, duplicate, skipped or unchanged), as are the LLM batches.
+    """
+    if concurrency is None:
+        concurrency = getattr(settings, 'QUIZ_GENERATION_CONCURRENCY', 1)
+    concurrency = max(1, concurrency)
+    backend = get_backend()
+    packing = getattr(settings, 'QUIZ_PACKING', {})
+    packer = SlidePacker(packing.get('TOKEN_BUDGET', 1500), packing.get('MAX_SLIDES', 6))
+    dedup = getattr(settings, 'QUIZ_DEDUP', {})
+    dedup_filter = NearDuplicateFilter(
+        threshold=dedup.get('THRESHOLD', 0.7),
+        shingle_size=dedup.get('SHINGLE_SIZE', 3),
+        num_perm=dedup.get('NUM_PERM', 64),
+        window=dedup.get('WINDOW', 10),
+    ) if dedupe else None
+    max_slide_tokens = _token_budget_settings()['MAX_SLIDE_TOKENS']
+
+    seen = 0
+    done = 0
+    in_flight = {}
+    # (slide_number, question) pairs streamed in by the pool, and None whenever a batch finishes
+    arrivals = queue.SimpleQueue()
+    # split slides: slide_number -> [parts not finished yet, slides the whole slide stands for, a part failed]
+    parts_left = {}
+    slide_spans = {}
+    questions_per_slide = Counter()
+
+    def finish_slide(slide_number, outcome):
+        span = slide_spans.pop(slide_number, None)
+        if span is not None:
+            span.set(outcome=outcome, questions=questions_per_slide[slide_number])
+            span.end()
 
-    return {"slides": all_slides}
+    def report(results=(), slides_done=0, outcome=None):
+        # a result stands for its slide plus the near-duplicates merged into it, once all its parts are done
+        nonlocal done
+        done += slides_done
+        for result in results:
+            slide_number = result['slide_number']
+            questions_per_slide[slide_number] += len(result['questions'])
+            split = parts_left.get(slide_number)
+            if split is None:
+                done += 1 + len(result['duplicate_slide_numbers'])
+                finish_slide(slide_number, 'failed' if result['error'] else outcome)
+                continue
+            split[0] -= 1
+            split[2] = split[2] or bool(result['error'])
+            if not split[0]:
+                done += split[1]
+                del parts_left[slide_number]
+                finish_slide(slide_number, 'failed' if split[2] else outcome)
+        if progress_callback:
+            progress_callback(done, seen)
+        return results
 
+    def send(batch):
+        with cache_lookup.timed():
+            results, remaining = _answer_from_cache(batch, use_cache)
+        if use_cache and cache_counts is not None:
+            cache_counts['hits'] += len(results)
+            cache_counts['misses'] += len(remaining)
+        if remaining:
+            logger.debug(f"Processing Slides {', '.join(str(entry[0]) for entry in remaining)}...")
+            future = executor.submit(generate_batch_questions, [(number, slide) for number, slide, _, _ in remaining],
+                                     backend, usage, lambda number, question: arrivals.put((number, question)), tracer)
+            future.add_done_callback(lambda _: arrivals.put(None))
+            in_flight[future] = remaining
+        return report(results, outcome='cached')
+
+    def drain(block=False):
+        """
+        Yield the questions streamed in so far, then the final results of the batches that finished.
+        With `block`, wait until a batch finishes, yielding its questions as they arrive.
+        """
+        waiting = []
+        while True:
+            # a batch's questions are queued before it finishes, so they are all yielded before its final result
+            finished = [future for future in in_flight if future.done()]
+            items = waiting
+            while True:
+                try:
+                    items.append(arrivals.get_nowait())
+                except queue.Empty:
+                    break
+            streamed = defaultdict(list)
+            for item in items:
+                if item is not None:
+                    streamed[item[0]].append(item[1])
+                    questions_per_slide[item[0]] += 1
+            yield from (_slide_result(number, questions) for number, questions in streamed.items())
+
+            if finished or not block:
+                yield from report(_collect(finished, in_flight, use_cache, backend.model_name), outcome='generated')
+                return
+            waiting = [arrivals.get()]
+
+    def handle(events):
+        results = []
+        for event in events:
+            if event[0] == 'duplicate':
+                _, representative, slide_number = event
+                results.append(_slide_result(representative, [], [slide_number]))
+                finish_slide(slide_number, 'duplicate')
+                report(slides_done=1)
+            else:
+                _, slide_number, slide, duplicates = event
+                for duplicate in duplicates:
+                    finish_slide(duplicate, 'duplicate')
+                parts = split_slide(slide, max_slide_tokens)
+                if len(parts) > 1:
+                    parts_left[slide_number] = [len(parts), 1 + len(duplicates), False]
+                for index, part in enumerate(parts):
+                    key = question_cache.cache_key(part, backend.model_name, PROMPT_VERSION)
+                    # the merged near-duplicates are reported once, with the first part
+                    closed = packer.add((slide_number, part, key, duplicates if index == 0 else []), part)
+                    if closed:
+                        results.extend(send(closed))
+        return results
+
+    with tracer.span('cache_lookup', aggregate=True) as cache_lookup, tracer.span('dedup', aggregate=True) as dedup_span, \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for slide_number, slide in enumerate(slides, 1):
+            seen += 1
+            slide_spans[slide_number] = tracer.start_span('slide', slide_number=slide_number)
+            if regenerate is not None and not regenerate(slide_number, slide):
+                finish_slide(slide_number, 'unchanged')
+                report(slides_done=1)
+                continue
+            if len(slide.split()) < 20:  # Skip slides with very little content
+                logger.debug(f"Skipping Slide {slide_number} due to insufficient content.")
+                finish_slide(slide_number, 'skipped')
+                report(slides_done=1)
+                continue
+
+            if dedup_filter:
+                with dedup_span.timed():
+                    events = dedup_filter.add(slide_number, slide)
+                yield from handle(events)
+            else:
+                yield from handle([('slide', slide_number, slide, [])])
+
+            # hand back whatever has arrived without waiting, and block once too much is in flight
+            yield from drain()
+            while len(in_flight) >= concurrency * 2:
+                yield from drain(block=True)
+
+        if dedup_filter:
+            yield from handle(dedup_filter.flush())
+        batch = packer.flush()
+        if batch:
+            yield from send(batch)
+        while in_flight:
+            yield from drain(block=True)
+
+    if use_cache:
+        question_cache.evict()
+
+
+def generate_questions(slides, progress_callback=None, concurrency=None, use_cache=True, dedupe=True, usage=None):
+    """
+    Generate questions for every slide and return them in slide order (see iter_generated_questions).
+
+    Slides whose LLM call failed are listed in `failed_slides` instead of aborting the whole deck.
+    """
+    questions = {}
+    duplicates = defaultdict(list)
+    failed_slides = []
+
+    for result in iter_generated_questions(slides, progress_callback=progress_callback, concurrency=concurrency,
+                                           use_cache=use_cache, dedupe=dedupe, usage=usage):
+        slide_number = result['slide_number']
+        questions.setdefault(slide_number, []).extend(result['questions'])
+        duplicates[slide_number].extend(result['duplicate_slide_numbers'])
+        if result['error']:
+            failed_slides.append(slide_number)
+
+    all_slides = [
+        {"slide_number": i, "questions": questions[i], "duplicate_slide_numbers": sorted(duplicates[i])}
+        for i in sorted(questions)
+        if questions[i]
+    ]
+    return {"slides": all_slides, "failed_slides": sorted(failed_slides)}
 
-def process_pdf_and_generate_questions(pdf_file, quiz):
-    slides = extract_slides_from_pdf(pdf_file)
-    questions_data = generate_questions(slides)
+
+def _remember_slides(slides, blob):
+    """Pass slides through, storing them on the blob once the whole PDF has been read"""
+    extracted = []
+    for slide in slides:
+        extracted.append(slide)
+        yield slide
+    PDFBlob.objects.filter(pk=blob.pk).update(slides=extracted)
+
+
+def _timed_slides(slides, span):
+    """Pass slides through, timing the reads in `span` and counting them"""
+    count = 0
+    while True:
+        with span.timed():
+            slide = next(slides, None)
+        if slide is None:
+            span.set(slides=count)
+            return
+        count += 1
+        yield slide
+
+
+def process_pdf_and_generate_questions(pdf_file, quiz, progress_callback=None, blob=None, usage=None, regenerate=None,
+                                       tracer=NULL_TRACER, document=None, pages=None, job=None, failed_slides=None,
+                                       cache_counts=None):
+    """
+    Extract, generate and save the questions of a PDF as one streaming pipeline.
+
+    Each slide's questions are saved as soon as they are generated, while later pages are still being
+    read, so the first TempQuestion rows appear long before the deck is finished. When the PDF's
+    content-addressed `blob` has been processed before, its stored slides are used instead of
+    reading the file again, and the question cache answers the LLM calls. Given an extracted
+    documents.PDF as `document`, the slides of its stored `pages`, a (first, last) page range or None
+    for all of them, are used instead and `pdf_file` is not read (see iter_slides_from_document).
+    The tokens used are added to `usage`, a TokenUsage, and the question cache hits and misses to
+    `cache_counts`, when they are given, and `regenerate` picks the slides that get questions (see
+    iter_generated_questions). The questions are saved as those
+    of `job`, the GenerationJob running this, if any. The numbers of the slides whose questions could
+    not be generated, with the near-duplicates merged into them, are added to `failed_slides`, a set,
+    when one is given.
+
+    The time spent reading slides and saving questions is traced as the extract and save spans of
+    `tracer`, next to the spans of iter_generated_questions.
+    Returns the number of questions saved.
+    """
+    if document is not None:
+        slides, source = iter_slides_from_document(document, *(pages or (1, None))), 'document'
+    elif blob is not None and blob.slides is not None:
+        slides, source = iter(blob.slides), 'stored'
+    elif blob is not None:
+        slides, source = _remember_slides(iter_slides_from_pdf(pdf_file), blob), 'pdf'
+    else:
+        slides, source = iter_slides_from_pdf(pdf_file), 'pdf'
 
     total_questions = 0
-    for slide_data in questions_data['slides']:
+    failed = []
+    duplicates = defaultdict(list)
+    saved_ids = defaultdict(list)
+
+    with tracer.span('extract', aggregate=True, source=source) as extract, \
+            tracer.span('save', aggregate=True) as save:
+        for result in iter_generated_questions(_timed_slides(slides, extract), progress_callback=progress_callback,
+                                               usage=usage, regenerate=regenerate, tracer=tracer,
+                                               cache_counts=cache_counts):
+            slide_number = result['slide_number']
+            duplicates[slide_number].extend(result['duplicate_slide_numbers'])
+            if result['error']:
+                failed.append(slide_number)
+
+            with save.timed():
+                if result['questions']:
+                    result = {**result, 'duplicate_slide_numbers': sorted(duplicates[slide_number])}
+                    saved = save_temp_questions(quiz, [result], job=job)
+                    saved_ids[slide_number].extend(temp_question.pk for temp_question in saved)
+                    total_questions += len(saved)
+                elif result['duplicate_slide_numbers'] and saved_ids[slide_number]:
+                    # a late near-duplicate of a slide whose questions are already saved
+                    TempQuestion.objects.filter(pk__in=saved_ids[slide_number]).update(
+                        duplicate_slide_numbers=sorted(duplicates[slide_number])
+                    )
+        save.set(questions=total_questions)
+
+    if failed_slides is not None:
+        for slide_number in failed:
+            failed_slides.update([slide_number, *duplicates[slide_number]])
+    if failed and not total_questions:
+        raise RuntimeError(f"Question generation failed for all {len(failed)} slides")
+
+    return total_questions
+
+
+def save_temp_questions(quiz, slides_data, job=None):
+    """
+    Store generated questions as TempQuestion/TempAnswer rows with two bulk INSERTs in one transaction,
+    as questions of the generation `job` when one is given. Returns the saved TempQuestion objects.
+    """
+    temp_questions = []
+    answers_data = []
+    for slide_data in slides_data:
         for q_data in slide_data['questions']:
-            temp_question = TempQuestion.objects.create(
+            temp_questions.append(TempQuestion(
                 quiz=quiz,
+                job=job,
                 text=q_data['question_text'],
                 question_type='mcq',
-                slide_number=slide_data['slide_number']
-            )
+                slide_number=slide_data['slide_number'],
+                duplicate_slide_numbers=slide_data.get('duplicate_slide_numbers', []),
+            ))
+            answers_data.append(q_data)
 
-            for key, value in q_data['options'].items():
-                TempAnswer.objects.create(
-                    temp_question=temp_question,
-                    text=value,
-                    is_correct=(key == q_data['correct_answer']),
-                )
-            total_questions += 1
+    with transaction.atomic():
+        # bulk_create sets the primary keys on Postgres, so the answers can point at them directly
+        TempQuestion.objects.bulk_create(temp_questions)
+        TempAnswer.objects.bulk_create([
+            TempAnswer(
+                temp_question=temp_question,
+                text=value,
+                is_correct=(key == q_data['correct_answer']),
+            )
+            for temp_question, q_data in zip(temp_questions, answers_data)
+            for key, value in q_data['options'].items()
+        ])
 
-    return total_questions
\ No newline at end of file
+    return temp_questions
@@ -0,0 +1,140 @@
+# quizzes/question_cache.py
+
+import hashlib
+import json
+import re
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import CachedSlideQuestions
+
+DEFAULT_CACHE_SETTINGS = {
+    'TTL': 60 * 60 * 24 * 90,  # seconds
+    'MAX_SIZE': 50 * 1024 * 1024,  # bytes of cached question JSON
+}
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+
+def _cache_settings():
+    return {**DEFAULT_CACHE_SETTINGS, **getattr(settings, 'QUIZ_QUESTION_CACHE', {})}
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def normalize_slide_text(slide):
+    """
+    Drop the "Slide N" header added by extract_slides_from_pdf and collapse whitespace, so the same
+    slide hashes the same wherever it appears in a deck.
+    """
+    text = re.sub(r'^\s*Slide \d+\s*', '', slide)
+    return ' '.join(text.split())
+
+
+def cache_key(slide, model_name, prompt_version):
+    normalized = normalize_slide_text(slide)
+    return hashlib.sha256(f"{prompt_version}\0{model_name}\0{normalized}".encode()).hexdigest()
+
+
+def get_cached_questions(keys):
+    """
+    Return {key: questions} for the keys that have a live cache entry, and bump their usage.
+    """
+    keys = set(keys)
+    if not keys:
+        return {}
+
+    cutoff = timezone.now() - timedelta(seconds=_cache_settings()['TTL'])
+    found = dict(
+        CachedSlideQuestions.objects
+        .filter(key__in=keys, created_at__gte=cutoff)
+        .values_list('key', 'questions')
+    )
+    if found:
+        CachedSlideQuestions.objects.filter(key__in=found).update(
+            hits=F('hits') + 1,
+            last_used_at=timezone.now(),
+        )
+
+    _count('hits', len(found))
+    _count('misses', len(keys) - len(found))
+    return found
+
+
+def store_questions(entries, model_name, prompt_version, run_eviction=True):
+    """
+    Cache the parsed questions for each key in `entries`, then evict down to the configured limits.
+    An existing entry for a key, such as an expired one, is overwritten and starts a new TTL.
+    Callers storing many small groups of entries can pass run_eviction=False and call evict() once.
+    """
+    if not entries:
+        return
+
+    now = timezone.now()
+    CachedSlideQuestions.objects.bulk_create(
+        [
+            CachedSlideQuestions(
+                key=key,
+                model_name=model_name,
+                prompt_version=prompt_version,
+                questions=questions,
+                size=len(json.dumps(questions)),
+                created_at=now,
+                last_used_at=now,
+            )
+            for key, questions in entries.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['key'],
+        update_fields=['model_name', 'prompt_version', 'questions', 'size', 'created_at', 'last_used_at'],
+    )
+    _count('stores', len(entries))
+    if run_eviction:
+        evict()
+
+
+def evict():
+    """
+    Delete expired entries, then the least recently used ones until the cache fits in MAX_SIZE.
+    Returns the number of entries removed.
+    """
+    config = _cache_settings()
+    cutoff = timezone.now() - timedelta(seconds=config['TTL'])
+    removed, _ = CachedSlideQuestions.objects.filter(created_at__lt=cutoff).delete()
+
+    total_size = CachedSlideQuestions.objects.aggregate(total=Sum('size'))['total'] or 0
+    if total_size > config['MAX_SIZE']:
+        stale_ids = []
+        entries = CachedSlideQuestions.objects.order_by('last_used_at').values_list('id', 'size')
+        for entry_id, size in entries.iterator():
+            if total_size <= config['MAX_SIZE']:
+                break
+            stale_ids.append(entry_id)
+            total_size -= size
+        removed += CachedSlideQuestions.objects.filter(id__in=stale_ids).delete()[0]
+
+    _count('evictions', removed)
+    return removed
+
+
+def cache_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    totals = CachedSlideQuestions.objects.aggregate(size=Sum('size'))
+    stats['entries'] = CachedSlideQuestions.objects.count()
+    stats['size'] = totals['size'] or 0
+    return stats
+
+
+def reset_cache_stats():
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
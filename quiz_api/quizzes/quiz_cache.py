@@ -0,0 +1,129 @@
+# quizzes/quiz_cache.py
+
+"""
+Serialized quiz details, cached by quiz id and version. Every write to a quiz, its questions or their
+answers bumps the quiz's version (see quizzes.signals), so a cached payload never needs invalidating:
+the next read simply looks for the new version, and the old entries age out of the LRU.
+"""
+
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+
+from .models import Quiz
+
+DEFAULT_PAYLOAD_CACHE = {
+    'MAX_ENTRIES': 512,  # payloads kept in each process
+    'SHARED_CACHE': None,  # alias in CACHES of a cache shared by all processes, None for none
+    'TIMEOUT': 60 * 60,  # seconds payloads are kept in the shared cache
+}
+
+_stats_lock = threading.Lock()
+_stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+
+def _payload_cache_settings():
+    return {**DEFAULT_PAYLOAD_CACHE, **getattr(settings, 'QUIZ_PAYLOAD_CACHE', {})}
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cache_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def bump_version(*quiz_ids):
+    """Invalidate the cached payloads of the given quizzes. Call after writes that bypass signals"""
+    quiz_ids = {quiz_id for quiz_id in quiz_ids if quiz_id is not None}
+    if quiz_ids:
+        Quiz.objects.filter(pk__in=quiz_ids).update(version=F('version') + 1)
+
+
+def payload_key(quiz):
+    """
+    The cache key of a quiz's payload, from its id, version and creation time. The creation time tells
+    apart quizzes that got the id of a deleted one, which some databases reuse.
+    """
+    return f'{quiz.pk}-{quiz.created_at.timestamp():.6f}-v{quiz.version}'
+
+
+def quiz_etag(quiz):
+    return f'"quiz-{payload_key(quiz)}"'
+
+
+class LRUCache:
+    """A thread-safe mapping that forgets its least recently used entries beyond `max_entries`"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_local = LRUCache(DEFAULT_PAYLOAD_CACHE['MAX_ENTRIES'])
+
+
+def clear_local_cache():
+    _local.clear()
+
+
+def get_quiz_payload(quiz, build):
+    """
+    The serialized `quiz` at the version it was read with, from the process's LRU, then the shared
+    cache if one is configured, and otherwise from build(), which is then cached in both.
+
+    Read the version before building: a payload built from newer data than its version is harmless,
+    as that version's readers are only ever handed fresher data.
+    """
+    config = _payload_cache_settings()
+    _local.max_entries = config['MAX_ENTRIES']
+    key = payload_key(quiz)
+
+    payload = _local.get(key)
+    if payload is not None:
+        _count('local_hits')
+        return payload
+
+    shared = caches[config['SHARED_CACHE']] if config['SHARED_CACHE'] else None
+    shared_key = f'quiz-payload:{key}'
+    if shared is not None:
+        payload = shared.get(shared_key)
+        if payload is not None:
+            _count('shared_hits')
+            _local.set(key, payload)
+            return payload
+
+    _count('misses')
+    payload = build()
+    _local.set(key, payload)
+    if shared is not None:
+        shared.set(shared_key, payload, config['TIMEOUT'])
+    return payload
@@ -0,0 +1,220 @@
+# quizzes/revisions.py
+
+"""
+Diffing a re-uploaded deck against the previous upload for the same quiz, so only the slides that
+were added or edited are sent to the LLM, and the questions of the unchanged slides are carried over
+to their new slide numbers, whether they are still pending or were already added to the quiz.
+"""
+
+import hashlib
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, IntegerField, Max, Value, When
+from django.utils import timezone
+
+from .dedup import jaccard, shingles
+from .models import GenerationJob, Question, TempQuestion
+from .question_cache import normalize_slide_text
+from .quiz_cache import bump_version
+
+DEFAULT_REVISION_SETTINGS = {
+    'MATCH_THRESHOLD': 0.5,
+    'SHINGLE_SIZE': 3,
+}
+
+
+def _revision_settings():
+    return {**DEFAULT_REVISION_SETTINGS, **getattr(settings, 'QUIZ_REVISIONS', {})}
+
+
+def fingerprint(slide):
+    return hashlib.sha256(normalize_slide_text(slide).encode()).hexdigest()
+
+
+class DeckDiff:
+    """
+    Compares the slides of a new upload, as they stream in, with the slides of the previous one.
+
+    A slide whose normalized text is that of a previous slide is unchanged and needs no new questions.
+    Once the whole deck has been seen, finish() pairs the other new slides with the previous slides
+    left over, most similar first by shingle Jaccard similarity: a pair at or above `threshold` is an
+    edited slide, and the slides still left over were added or removed. A previous slide numbered in
+    `redo`, such as one whose questions failed, counts as edited even when its text is the same.
+    """
+
+    def __init__(self, previous_slides, threshold=0.5, shingle_size=3, redo=()):
+        self.previous_slides = list(previous_slides)
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.redo = set(redo)
+        self.slides = []
+        # new slide number -> previous slide number
+        self.unchanged = {}
+        self.changed = {}
+        self.added = []
+        self.removed = []
+        self._previous_by_fingerprint = defaultdict(deque)
+        for slide_number, slide in enumerate(self.previous_slides, 1):
+            self._previous_by_fingerprint[fingerprint(slide)].append(slide_number)
+
+    def regenerate(self, slide_number, slide):
+        """Record the next slide of the new deck and return whether it needs new questions"""
+        self.slides.append(slide)
+        previous = self._previous_by_fingerprint.get(fingerprint(slide))
+        if not previous:
+            return True
+        previous_number = previous.popleft()
+        if previous_number in self.redo:
+            self.changed[slide_number] = previous_number
+            return True
+        self.unchanged[slide_number] = previous_number
+        return False
+
+    def finish(self):
+        matched = {*self.unchanged.values(), *self.changed.values()}
+        old = [(number, shingles(slide, self.shingle_size))
+               for number, slide in enumerate(self.previous_slides, 1) if number not in matched]
+        new = [(number, shingles(slide, self.shingle_size))
+               for number, slide in enumerate(self.slides, 1)
+               if number not in self.unchanged and number not in self.changed]
+
+        pairs = sorted(
+            ((jaccard(new_shingles, old_shingles), new_number, old_number)
+             for new_number, new_shingles in new for old_number, old_shingles in old),
+            key=lambda pair: (-pair[0], pair[1], pair[2]),
+        )
+        for similarity, new_number, old_number in pairs:
+            if similarity < self.threshold:
+                break
+            if new_number in self.changed or old_number in matched:
+                continue
+            self.changed[new_number] = old_number
+            matched.add(old_number)
+
+        self.added = [number for number, _ in new if number not in self.changed]
+        self.removed = [number for number, _ in old if number not in matched]
+        return self
+
+
+def _renumber(queryset, mapping):
+    """Move the rows of `queryset` from the slide numbers in `mapping` to their new numbers, in one UPDATE"""
+    moves = {old: new for old, new in mapping.items() if old != new}
+    if not moves:
+        return
+    queryset.filter(slide_number__in=moves).update(slide_number=Case(
+        *[When(slide_number=old, then=Value(new)) for old, new in moves.items()],
+        output_field=IntegerField(),
+    ))
+
+
+class DeckRevision:
+    """
+    The upload being generated for a quiz by `job`, diffed against the latest deck generated for it
+    before. Pass `regenerate` to the generation pipeline, then apply() the diff once it has succeeded.
+
+    The previous slides whose questions failed, and those left with no questions, pending or in the
+    quiz, are generated again even if they did not change.
+    """
+
+    def __init__(self, quiz, job=None):
+        self.quiz = quiz
+        self.job = job
+        previous = (
+            GenerationJob.objects
+            .filter(quiz=quiz, status=GenerationJob.STATUS_SUCCEEDED, slides__isnull=False)
+            .exclude(slides=[])
+            .exclude(pk=getattr(job, 'pk', None))
+            .order_by('-finished_at', '-id')
+            .values('id', 'slides', 'failed_slides')
+            .first()
+        )
+        self.previous_job_id = previous['id'] if previous else None
+        # questions added to the quiz from here on belong to the new upload, whatever their slide number
+        self.last_question = Question.objects.filter(quiz=quiz).aggregate(last=Max('pk'))['last'] or 0
+        self.pending = TempQuestion.objects.filter(quiz=quiz, job_id=self.previous_job_id)
+        self.promoted = Question.objects.filter(quiz=quiz, pk__lte=self.last_question, slide_number__isnull=False)
+
+        previous_slides = previous['slides'] if previous else []
+        redo = set()
+        if previous:
+            redo = {*previous['failed_slides'], *self._without_questions(len(previous_slides))}
+        config = _revision_settings()
+        self.diff = DeckDiff(previous_slides, threshold=config['MATCH_THRESHOLD'],
+                             shingle_size=config['SHINGLE_SIZE'], redo=redo)
+
+    def _without_questions(self, num_slides):
+        """The previous slide numbers that no pending question of the previous job or question of the quiz is from"""
+        covered = set(self.promoted.values_list('slide_number', flat=True))
+        for slide_number, duplicates in self.pending.values_list('slide_number', 'duplicate_slide_numbers'):
+            covered.add(slide_number)
+            covered.update(duplicates)
+        return set(range(1, num_slides + 1)) - covered
+
+    @property
+    def slides(self):
+        return self.diff.slides
+
+    def regenerate(self, slide_number, slide):
+        # the first upload of a deck is generated in full
+        return self.diff.regenerate(slide_number, slide) or self.previous_job_id is None
+
+    def apply(self):
+        """
+        Carry the questions of the previous upload over to the new slide numbers. Pending questions
+        of the previous job are kept for unchanged slides, and become questions of the new job, as
+        recent as its own for the sweeper (see quizzes.sweeper), while
+        those of edited or removed slides are dropped, as the edited slides got new ones, and so did
+        the slides generated again. Pending questions of other jobs, such as failed ones, are left alone.
+        Questions already in the quiz are all kept: they follow their slide when it is unchanged or
+        edited, and lose their slide number when it was removed.
+
+        Returns a summary of the diff, or None for the first upload of a deck.
+        """
+        if self.previous_job_id is None:
+            return None
+
+        diff = self.diff.finish()
+        kept = {old: new for new, old in diff.unchanged.items()}
+        edited = {old: new for new, old in diff.changed.items()}
+        pending, promoted = self.pending, self.promoted
+
+        with transaction.atomic():
+            stale = pending.exclude(slide_number__in=kept)
+            dropped = stale.count()
+            stale.delete()
+
+            # the near-duplicates merged into a carried over slide follow it, or go if they changed
+            moved = []
+            for temp_question in pending.exclude(duplicate_slide_numbers=[]).only('duplicate_slide_numbers'):
+                temp_question.duplicate_slide_numbers = sorted(
+                    kept[number] for number in temp_question.duplicate_slide_numbers if number in kept
+                )
+                moved.append(temp_question)
+            TempQuestion.objects.bulk_update(moved, ['duplicate_slide_numbers'])
+
+            carried_over = pending.count()
+            _renumber(pending, kept)
+            # the kept questions expire with the new upload, not the one they were generated for
+            fields = {'created_at': timezone.now()}
+            if self.job is not None:
+                fields['job'] = self.job
+            pending.update(**fields)
+
+            to_review = promoted.filter(slide_number__in=[*edited, *diff.removed]).count()
+            promoted.filter(slide_number__in=diff.removed).update(slide_number=None)
+            _renumber(promoted, {**kept, **edited})
+            bump_version(self.quiz.pk)
+
+        return {
+            'previous_job': self.previous_job_id,
+            'slides': len(diff.slides),
+            'unchanged': len(diff.unchanged),
+            'changed': sorted(diff.changed),
+            'added': diff.added,
+            'removed': diff.removed,
+            'temp_questions_carried_over': carried_over,
+            'temp_questions_dropped': dropped,
+            'questions_to_review': to_review,
+        }
@@ -0,0 +1,288 @@
+# quizzes/search.py
+
+"""
+Full-text search of quizzes by their title, description and question texts.
+
+On PostgreSQL, quizzes and questions have a `search_vector` tsvector column with a GIN index, set up
+by install_postgres_search after migrate and kept current by triggers, so bulk writes are covered too.
+The columns are not model fields and only ever read here. Other databases, such as the SQLite test
+runs, get an inverted index built in Python and kept between searches. Writes in the process mark
+their quizzes for re-indexing (see quizzes.signals), and every RESYNC_INTERVAL seconds (QUIZ_SEARCH)
+the versions of all quizzes are compared with the index, to pick up the writes of other processes.
+
+Both rank a quiz by its own match, where a title term weighs more than a description term, plus the
+best matching question. A quiz matches when all the search terms are in its title and description,
+or all are in one of its questions.
+"""
+
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+from .models import Question, Quiz
+
+SEARCH_CONFIG = 'english'
+
+DEFAULT_SEARCH = {
+    'RESYNC_INTERVAL': 60,  # seconds between full checks of the in-memory index against the quiz table
+}
+
+# ts_rank's default weights of the A (title), B (description) and C (question) labels
+WEIGHTS = {'title': 1.0, 'description': 0.4, 'question': 0.2}
+
+POSTGRES_SETUP = [
+    "ALTER TABLE quizzes_quiz ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    "ALTER TABLE quizzes_question ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    f"""
+    CREATE OR REPLACE FUNCTION quizzes_quiz_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.description, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION quizzes_question_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.text, '')), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS quizzes_quiz_search_vector ON quizzes_quiz",
+    """
+    CREATE TRIGGER quizzes_quiz_search_vector BEFORE INSERT OR UPDATE OF title, description ON quizzes_quiz
+    FOR EACH ROW EXECUTE FUNCTION quizzes_quiz_search_vector()
+    """,
+    "DROP TRIGGER IF EXISTS quizzes_question_search_vector ON quizzes_question",
+    """
+    CREATE TRIGGER quizzes_question_search_vector BEFORE INSERT OR UPDATE OF text ON quizzes_question
+    FOR EACH ROW EXECUTE FUNCTION quizzes_question_search_vector()
+    """,
+    # rows written before the triggers existed; the trigger fills the column in
+    "UPDATE quizzes_quiz SET title = title WHERE search_vector IS NULL",
+    "UPDATE quizzes_question SET text = text WHERE search_vector IS NULL",
+    "CREATE INDEX IF NOT EXISTS quizzes_quiz_search_vector_idx ON quizzes_quiz USING GIN (search_vector)",
+    "CREATE INDEX IF NOT EXISTS quizzes_question_search_vector_idx ON quizzes_question USING GIN (search_vector)",
+]
+
+# ids of the quizzes matching the query, each side answered from its GIN index
+POSTGRES_MATCHES = f"""
+    SELECT id FROM quizzes_quiz WHERE search_vector @@ websearch_to_tsquery('{SEARCH_CONFIG}', %s)
+    UNION
+    SELECT quiz_id FROM quizzes_question WHERE search_vector @@ websearch_to_tsquery('{SEARCH_CONFIG}', %s)
+"""
+
+# rank of a matching quiz: its own match plus that of its best matching question
+POSTGRES_RANK = f"""
+    SELECT
+        CASE WHEN quizzes_quiz.search_vector @@ query THEN ts_rank(quizzes_quiz.search_vector, query) ELSE 0 END
+        + COALESCE((
+            SELECT MAX(ts_rank(question.search_vector, query)) FROM quizzes_question question
+            WHERE question.quiz_id = quizzes_quiz.id AND question.search_vector @@ query
+        ), 0)
+    FROM websearch_to_tsquery('{SEARCH_CONFIG}', %s) query
+"""
+
+
+def search_settings():
+    return {**DEFAULT_SEARCH, **getattr(settings, 'QUIZ_SEARCH', {})}
+
+
+def install_postgres_search(sender, using='default', **kwargs):
+    """post_migrate receiver adding the search columns, triggers and indexes on PostgreSQL"""
+    from django.db import connections
+
+    target = connections[using]
+    if target.vendor != 'postgresql':
+        return
+    with target.cursor() as cursor:
+        for statement in POSTGRES_SETUP:
+            cursor.execute(statement)
+
+
+def search_quizzes(queryset, text):
+    """
+    The quizzes of `queryset` matching the search `text`, best first, each with its `rank`. Returns a
+    queryset on PostgreSQL, where ranking and paging happen in the database, and a list otherwise.
+    """
+    if connection.vendor == 'postgresql':
+        return (
+            queryset
+            .filter(pk__in=RawSQL(POSTGRES_MATCHES, [text, text]))
+            .annotate(rank=RawSQL(POSTGRES_RANK, [text], output_field=FloatField()))
+            .order_by('-rank', '-id')
+        )
+
+    ranks = inverted_index.search(text)
+    if not ranks:
+        return []
+
+    # the filters of `queryset` are applied in the database, in chunks to stay under parameter limits
+    matches = []
+    quiz_ids = list(ranks)
+    for start in range(0, len(quiz_ids), 5000):
+        matches.extend(queryset.filter(pk__in=quiz_ids[start:start + 5000]))
+    for quiz in matches:
+        quiz.rank = round(ranks[quiz.pk], 6)
+    matches.sort(key=lambda quiz: (-quiz.rank, -quiz.pk))
+    return matches
+
+
+WORD_PATTERN = re.compile(r'\w+')
+STOP_WORDS = frozenset(
+    'a an and are as at be by for from has have how in is it its of on or that the this to was what '
+    'when where which who why will with'.split()
+)
+
+
+def terms(text):
+    """The normalized search terms of `text`: lowercase words minus stop words, without a plural s"""
+    result = []
+    for word in WORD_PATTERN.findall((text or '').lower()):
+        if word in STOP_WORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        result.append(word)
+    return result
+
+
+class InvertedIndex:
+    """
+    Term -> postings index of quizzes and questions, held in memory. Before a search, the quizzes
+    marked with mark_changed() are re-indexed if their version changed since they were indexed, or
+    removed if they were deleted. At most every RESYNC_INTERVAL seconds, every quiz is checked that
+    way instead, at the cost of one query over the quiz table.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changed_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # quiz id -> (version, created_at) when indexed; databases that reuse ids give new quizzes the
+        # version a deleted one had
+        self.versions = {}
+        # term -> {quiz id: weighted term frequency} of the quizzes' own fields
+        self.quiz_postings = defaultdict(dict)
+        # term -> {question id: weighted term frequency}, and the terms and quiz of every question
+        self.question_postings = defaultdict(dict)
+        self.quiz_terms = {}
+        self.question_terms = {}
+        self.question_quiz = {}
+        self.quiz_questions = defaultdict(set)
+        # quizzes written to since the last search, and when every quiz was last checked
+        self.changed = set()
+        self.checked_at = None
+
+    def mark_changed(self, *quiz_ids):
+        """Have the next search re-index these quizzes. Call once the write is committed"""
+        with self._changed_lock:
+            self.changed.update(quiz_ids)
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def _remove(self, quiz_id):
+        for term in self.quiz_terms.pop(quiz_id, ()):
+            self.quiz_postings[term].pop(quiz_id, None)
+        for question_id in self.quiz_questions.pop(quiz_id, ()):
+            for term in self.question_terms.pop(question_id, ()):
+                self.question_postings[term].pop(question_id, None)
+            self.question_quiz.pop(question_id, None)
+        self.versions.pop(quiz_id, None)
+
+    @staticmethod
+    def _weighted(fields):
+        weights = Counter()
+        for field, text in fields:
+            for term in terms(text):
+                weights[term] += WEIGHTS[field]
+        # damp long texts, like ts_rank's length normalization
+        length = sum(weights.values())
+        return {term: weight / math.log2(2 + length) for term, weight in weights.items()}
+
+    def sync(self):
+        with self._changed_lock:
+            marked, self.changed = self.changed, set()
+        now = time.monotonic()
+        quizzes = Quiz.objects.all()
+        if self.checked_at is not None and now - self.checked_at < search_settings()['RESYNC_INTERVAL']:
+            if not marked:
+                return
+            quizzes = quizzes.filter(pk__in=marked)
+            checked = marked
+        else:
+            self.checked_at = now
+            checked = set(self.versions)
+
+        current = {quiz_id: (version, created_at)
+                   for quiz_id, version, created_at in quizzes.values_list('id', 'version', 'created_at')}
+        changed = [quiz_id for quiz_id, version in current.items() if self.versions.get(quiz_id) != version]
+        for quiz_id in checked - set(current):
+            self._remove(quiz_id)
+        if not changed:
+            return
+
+        for start in range(0, len(changed), 5000):
+            batch = changed[start:start + 5000]
+            for quiz_id in batch:
+                self._remove(quiz_id)
+            for quiz_id, title, description in Quiz.objects.filter(pk__in=batch).values_list(
+                    'id', 'title', 'description'):
+                weights = self._weighted([('title', title), ('description', description)])
+                self.quiz_terms[quiz_id] = list(weights)
+                for term, weight in weights.items():
+                    self.quiz_postings[term][quiz_id] = weight
+            questions = Question.objects.filter(quiz_id__in=batch).values_list('id', 'quiz_id', 'text')
+            for question_id, quiz_id, text in questions.iterator(chunk_size=5000):
+                weights = self._weighted([('question', text)])
+                self.question_terms[question_id] = list(weights)
+                self.question_quiz[question_id] = quiz_id
+                self.quiz_questions[quiz_id].add(question_id)
+                for term, weight in weights.items():
+                    self.question_postings[term][question_id] = weight
+        # a quiz written to while it was read is simply indexed again next time
+        self.versions.update((quiz_id, current[quiz_id]) for quiz_id in changed)
+
+    @staticmethod
+    def _all_terms(postings, query_terms):
+        """{id: score} of the entries having every term, rarest term first to keep the candidates few"""
+        lists = sorted((postings.get(term, {}) for term in query_terms), key=len)
+        if not lists or not lists[0]:
+            return {}
+        candidates = set(lists[0])
+        for other in lists[1:]:
+            candidates &= other.keys()
+        return {entry: sum(postings[term][entry] for term in query_terms) for entry in candidates}
+
+    def search(self, text):
+        """{quiz id: rank} of the quizzes matching every term of `text`"""
+        query_terms = list(dict.fromkeys(terms(text)))
+        if not query_terms:
+            return {}
+        with self._lock:
+            self.sync()
+            ranks = defaultdict(float, self._all_terms(self.quiz_postings, query_terms))
+            best = {}
+            for question_id, score in self._all_terms(self.question_postings, query_terms).items():
+                quiz_id = self.question_quiz[question_id]
+                best[quiz_id] = max(best.get(quiz_id, 0), score)
+        for quiz_id, score in best.items():
+            ranks[quiz_id] += score
+        return dict(ranks)
+
+
+inverted_index = InvertedIndex()
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Quiz, Question, Answer, TempPDF, TempQuestion, TempAnswer
+from .models import Quiz, Question, Answer, TempPDF, TempQuestion, TempAnswer, GenerationJob
 
 
 class AnswerSerializer(serializers.ModelSerializer):
@@ -13,7 +13,8 @@ class QuestionSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Question
-        fields = ['id', 'text', 'question_type', 'answers']
+        fields = ['id', 'text', 'question_type', 'slide_number', 'answers']
+        read_only_fields = ['slide_number']
 
     def create(self, validated_data):
         # Remove answers data from the validated_data
@@ -64,8 +65,26 @@ class QuizSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Quiz
-        fields = '__all__'
-        read_only_fields = ['creator', 'created_at']
+        # attempts change the attempt counters without a new version, they would go stale in the cached payload
+        exclude = ['attempt_count', 'completed_attempt_count', 'score_sum']
+        read_only_fields = ['creator', 'created_at', 'version', 'question_count']
+
+
+class QuizSummarySerializer(serializers.ModelSerializer):
+    """The quiz list's representation: no questions, just how many there are"""
+
+    class Meta:
+        model = Quiz
+        fields = ['id', 'title', 'difficulty', 'category', 'tags', 'question_count']
+        read_only_fields = fields
+
+
+class QuizSearchResultSerializer(QuizSummarySerializer):
+    rank = serializers.FloatField(read_only=True)
+
+    class Meta(QuizSummarySerializer.Meta):
+        fields = QuizSummarySerializer.Meta.fields + ['rank']
+        read_only_fields = fields
 
 
 class TempAnswerSerializer(serializers.ModelSerializer):
@@ -80,7 +99,7 @@ class TempQuestionSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = TempQuestion
-        fields = ['id', 'text', 'question_type', 'temp_answers', 'slide_number']
+        fields = ['id', 'text', 'question_type', 'temp_answers', 'slide_number', 'duplicate_slide_numbers']
 
 
 class TempPDFSerializer(serializers.ModelSerializer):
@@ -95,4 +114,12 @@ class TempQuestionBySlideSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = TempQuestion
-        fields = ['id', 'text', 'question_type', 'temp_answers', 'slide_number']
+        fields = ['id', 'text', 'question_type', 'temp_answers', 'slide_number', 'duplicate_slide_numbers']
+
+
+class GenerationJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = GenerationJob
+        fields = ['id', 'quiz', 'status', 'progress', 'total', 'num_questions', 'error',
+                  'input_tokens', 'output_tokens', 'cache_write_tokens', 'cache_read_tokens', 'question_cache_hits', 'question_cache_misses', 'guard_stats', 'diff', 'failed_slides', 'trace_summary', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
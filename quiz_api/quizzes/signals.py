@@ -1,18 +1,194 @@
-from django.db.models.signals import post_save, post_delete
+from collections import Counter
+
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save, m2m_changed
 from django.dispatch import receiver
+from django.db import transaction
 from django.db.models import F
 
-from .models import Question
+from attempts.models import QuizAttempt
+from documents.storage import release_blob
+from .counters import adjust_quiz_counters, attempt_contribution, cascaded_from_quiz, pending_deletes
+from .facets import adjust_facet_counts, invalidate_facet_cache, quiz_deltas, tag_facets, tagged_quizzes
+from .models import Category, Tag, Quiz, Question, Answer, TempPDF
+from .quiz_cache import bump_version
+from .search import inverted_index
 
 
-@receiver(post_save, sender=Question)
-def increment_num_questions(sender, instance, created, **kwargs):
+@receiver(post_save, sender=Quiz)
+def bump_quiz_version(sender, instance, created, **kwargs):
+    if not created:
+        bump_version(instance.pk)
+
+
+@receiver(m2m_changed, sender=Quiz.tags.through)
+def bump_quiz_version_on_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        bump_version(instance.pk)
+    elif pk_set:
+        bump_version(*pk_set)
+
+
+@receiver(pre_save, sender=Quiz)
+def remember_quiz_facets(sender, instance, update_fields=None, **kwargs):
+    previous = None
+    if not instance._state.adding and (update_fields is None or {'category', 'difficulty'} & set(update_fields)):
+        previous = Quiz.objects.filter(pk=instance.pk).values_list('category', 'difficulty').first()
+    instance._faceted = previous
+
+
+@receiver(post_save, sender=Quiz)
+def count_saved_quiz_facets(sender, instance, created, **kwargs):
     if created:
-        instance.quiz.num_questions = F('num_questions') + 1
-        instance.quiz.save()
+        # a new quiz has no tags yet, they are counted as they are added
+        adjust_facet_counts(quiz_deltas([(instance.category_id, instance.difficulty, [])], 1))
+        return
+    previous = getattr(instance, '_faceted', None)
+    if previous is None or previous == (instance.category_id, instance.difficulty):
+        return
+    tag_ids = list(instance.tags.values_list('pk', flat=True))
+    deltas = quiz_deltas([(*previous, tag_ids)], -1)
+    deltas.update(quiz_deltas([(instance.category_id, instance.difficulty, tag_ids)], 1))
+    adjust_facet_counts(deltas)
+
+
+@receiver(pre_delete, sender=Quiz)
+def count_deleted_quiz_facets(sender, instance, **kwargs):
+    # tag links are deleted with the quiz without m2m_changed, so its tags are read now
+    adjust_facet_counts(quiz_deltas(tagged_quizzes([instance.pk]).values(), -1))
+
+
+@receiver(m2m_changed, sender=Quiz.tags.through)
+def count_quiz_tag_facets(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Count added and removed tags. pk_set holds only the links actually added, but for removals it
+    holds whatever was asked for, so the links that exist are looked up before they go.
+    """
+    links = Quiz.tags.through.objects.filter(**{'tag' if reverse else 'quiz': instance})
+    if action in ('pre_remove', 'pre_clear'):
+        if action == 'pre_remove':
+            links = links.filter(**{'quiz__in' if reverse else 'tag__in': pk_set})
+        instance._removed_links = list(links.values_list('quiz', 'tag'))
+        return
+    if action == 'post_add' and pk_set:
+        changes = [(quiz_id, instance.pk) for quiz_id in pk_set] if reverse else [
+            (instance.pk, tag_id) for tag_id in pk_set]
+        sign = 1
+    elif action in ('post_remove', 'post_clear'):
+        changes, sign = getattr(instance, '_removed_links', []), -1
+    else:
+        return
+
+    # read rather than taken from the instance, which may have been loaded before a recategorization
+    quizzes = {quiz_id: (category_id, difficulty) for quiz_id, category_id, difficulty in Quiz.objects.filter(
+        pk__in={quiz_id for quiz_id, _ in changes}).values_list('pk', 'category', 'difficulty')}
+    deltas = Counter()
+    for quiz_id, tag_id in changes:
+        category_id, difficulty = quizzes[quiz_id]
+        for key in tag_facets(category_id, difficulty, [tag_id]):
+            deltas[key] += sign
+    adjust_facet_counts(deltas)
+
+
+@receiver(pre_delete, sender=Category)
+def count_uncategorized_quizzes(sender, instance, **kwargs):
+    # the category's quizzes are set to no category by a queryset update, which sends no signals
+    quizzes = tagged_quizzes(instance.quizzes.values('pk')).values()
+    deltas = quiz_deltas(quizzes, -1)
+    deltas.update(quiz_deltas([(None, difficulty, tag_ids) for _, difficulty, tag_ids in quizzes], 1))
+    adjust_facet_counts(deltas)
+
+
+@receiver(pre_delete, sender=Tag)
+def count_deleted_tag(sender, instance, **kwargs):
+    # its links are deleted without m2m_changed
+    links = Quiz.tags.through.objects.filter(tag=instance).values_list('quiz__category', 'quiz__difficulty')
+    deltas = Counter()
+    for category_id, difficulty in links:
+        for key in tag_facets(category_id, difficulty, [instance.pk]):
+            deltas[key] -= 1
+    adjust_facet_counts(deltas)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Tag)
+def invalidate_facet_names(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_facet_cache('category' if sender is Category else 'tag', instance.pk)
+
+
+@receiver(post_save, sender=Quiz)
+@receiver(post_delete, sender=Quiz)
+def reindex_quiz(sender, instance, **kwargs):
+    quiz_id = instance.pk
+    transaction.on_commit(lambda: inverted_index.mark_changed(quiz_id))
 
 
+@receiver(post_save, sender=Question)
 @receiver(post_delete, sender=Question)
-def decrement_num_questions(sender, instance, **kwargs):
-    instance.quiz.num_questions = F('num_questions') - 1
-    instance.quiz.save()
+def reindex_question_quiz(sender, instance, **kwargs):
+    quiz_id = instance.quiz_id
+    transaction.on_commit(lambda: inverted_index.mark_changed(quiz_id))
+
+
+@receiver(post_save, sender=Question)
+def count_saved_question(sender, instance, created, **kwargs):
+    adjust_quiz_counters({instance.quiz_id: {'question_count': int(created), 'version': 1}})
+
+
+@receiver(pre_delete, sender=Question)
+def count_deleted_question(sender, instance, origin=None, **kwargs):
+    if not cascaded_from_quiz(origin):
+        pending_deletes.add(origin, instance.quiz_id, question_count=-1, version=1)
+
+
+@receiver(post_save, sender=Answer)
+def bump_answer_quiz_version(sender, instance, **kwargs):
+    Quiz.objects.filter(questions=instance.question_id).update(version=F('version') + 1)
+
+
+@receiver(post_delete, sender=Answer)
+def bump_deleted_answer_quiz_version(sender, instance, origin=None, **kwargs):
+    # answers deleted with their question or quiz are covered by the question's delete
+    if getattr(origin, 'model', type(origin)) is Answer:
+        bump_answer_quiz_version(sender, instance)
+
+
+@receiver(pre_save, sender=QuizAttempt)
+def remember_attempt_contribution(sender, instance, **kwargs):
+    # read from the database rather than from when the instance was loaded, which may be long ago
+    previous = None
+    if not instance._state.adding:
+        previous = QuizAttempt.objects.filter(pk=instance.pk).only('quiz_id', 'end_time', 'score').first()
+    instance._counted = (previous.quiz_id, attempt_contribution(previous)) if previous else None
+
+
+@receiver(post_save, sender=QuizAttempt)
+def count_saved_attempt(sender, instance, **kwargs):
+    deltas = {instance.quiz_id: attempt_contribution(instance)}
+    if getattr(instance, '_counted', None):
+        quiz_id, counted = instance._counted
+        deltas.setdefault(quiz_id, {})
+        for field, amount in counted.items():
+            deltas[quiz_id][field] = deltas[quiz_id].get(field, 0) - amount
+    adjust_quiz_counters(deltas)
+
+
+@receiver(pre_delete, sender=QuizAttempt)
+def count_deleted_attempt(sender, instance, origin=None, **kwargs):
+    if not cascaded_from_quiz(origin):
+        contribution = attempt_contribution(instance)
+        pending_deletes.add(origin, instance.quiz_id, **{field: -amount for field, amount in contribution.items()})
+
+
+@receiver(post_delete, sender=Question)
+@receiver(post_delete, sender=QuizAttempt)
+def write_deleted_counts(sender, instance, origin=None, **kwargs):
+    pending_deletes.done(origin)
+
+
+@receiver(post_delete, sender=TempPDF)
+def release_temp_pdf_blob(sender, instance, **kwargs):
+    if instance.blob_id:
+        release_blob(instance.blob_id)
@@ -0,0 +1,154 @@
+# quizzes/sweeper.py
+
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from documents.models import PDFBlob
+from documents.storage import delete_unreferenced_blobs
+from .models import GenerationJob, TempAnswer, TempPDF, TempQuestion
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TEMP_DATA_SETTINGS = {
+    'MAX_AGE': 60 * 60 * 24 * 7,  # seconds
+    'BATCH_SIZE': 500,
+    'SWEEP_INTERVAL': 60 * 60,  # seconds
+}
+
+# Directories whose files belong to TempPDF and PDFBlob rows
+SWEPT_DIRECTORIES = ['temp_pdfs', 'blobs']
+
+
+def temp_data_settings():
+    return {**DEFAULT_TEMP_DATA_SETTINGS, **getattr(settings, 'QUIZ_TEMP_DATA', {})}
+
+
+def _batches(queryset, batch_size, *fields):
+    """
+    Yield lists of up to batch_size rows from `queryset` until it is empty. Every batch is read
+    afresh, so the caller must delete (or exclude) the rows of a batch before asking for the next.
+    """
+    fields = fields or ('pk',)
+    while True:
+        rows = list(queryset.order_by('pk').values_list(*fields, flat=len(fields) == 1)[:batch_size])
+        if not rows:
+            return
+        yield rows
+
+
+def sweep_temp_questions(cutoff, batch_size):
+    """
+    Delete temp questions created before `cutoff`, and their answers, batch_size questions per
+    transaction. Neither has delete signals, so the answers go in a single DELETE and the questions
+    are only read for their primary keys. Returns (questions deleted, answers deleted).
+    """
+    questions = answers = 0
+    for ids in _batches(TempQuestion.objects.filter(created_at__lt=cutoff), batch_size):
+        with transaction.atomic():
+            answers += TempAnswer.objects.filter(temp_question_id__in=ids).delete()[0]
+            _, deleted = TempQuestion.objects.filter(pk__in=ids).only('pk').delete()
+            questions += deleted.get(TempQuestion._meta.label, 0)
+    return questions, answers
+
+
+def sweep_temp_pdfs(cutoff, batch_size):
+    """
+    Delete temp PDFs uploaded before `cutoff`, except those a queued or running job is about to read.
+    They are deleted with their signals, which release their blob references, and the files of
+    PDFs stored before blobs existed are deleted. Returns (temp PDFs deleted, bytes freed).
+    """
+    active_jobs = GenerationJob.objects.filter(
+        status__in=[GenerationJob.STATUS_QUEUED, GenerationJob.STATUS_RUNNING],
+    )
+    expired = TempPDF.objects.filter(uploaded_at__lt=cutoff).exclude(
+        pk__in=active_jobs.filter(temp_pdf__isnull=False).values('temp_pdf_id'),
+    )
+
+    deleted = freed = 0
+    # size of every blob released, counted as freed if it is gone once the sweep is over
+    released_blobs = {}
+    for rows in _batches(expired, batch_size, 'pk', 'file', 'blob_id'):
+        ids = [pk for pk, _, _ in rows]
+        blob_ids = {blob_id for _, _, blob_id in rows if blob_id}
+        released_blobs.update(PDFBlob.objects.filter(pk__in=blob_ids).values_list('pk', 'size'))
+        with transaction.atomic():
+            GenerationJob.objects.filter(temp_pdf_id__in=ids).update(temp_pdf=None)
+            _, by_model = TempPDF.objects.filter(pk__in=ids).delete()
+            deleted += by_model.get(TempPDF._meta.label, 0)
+
+        for _, name, blob_id in rows:
+            if not blob_id and name and default_storage.exists(name):
+                freed += default_storage.size(name)
+                default_storage.delete(name)
+
+    if released_blobs:
+        # blobs whose deletion on commit did not run yet, as when sweeping inside a transaction
+        delete_unreferenced_blobs(released_blobs)
+        remaining = set(PDFBlob.objects.filter(pk__in=released_blobs).values_list('pk', flat=True))
+        freed += sum(size for blob_id, size in released_blobs.items() if blob_id not in remaining)
+    return deleted, freed
+
+
+def _walk(directory):
+    if not default_storage.exists(directory):
+        return
+    subdirectories, files = default_storage.listdir(directory)
+    for name in files:
+        yield f"{directory}/{name}"
+    for subdirectory in subdirectories:
+        yield from _walk(f"{directory}/{subdirectory}")
+
+
+def sweep_orphaned_files(cutoff):
+    """
+    Delete files under SWEPT_DIRECTORIES that no TempPDF or PDFBlob refers to, such as files left
+    behind by a crashed upload. Files newer than `cutoff` are kept, since an upload saves its file
+    before it creates the row. Returns (files deleted, bytes freed).
+    """
+    referenced = set(TempPDF.objects.values_list('file', flat=True).iterator())
+    referenced.update(PDFBlob.objects.values_list('file', flat=True).iterator())
+
+    deleted = freed = 0
+    for directory in SWEPT_DIRECTORIES:
+        for name in _walk(directory):
+            if name in referenced or default_storage.get_modified_time(name) >= cutoff:
+                continue
+            freed += default_storage.size(name)
+            default_storage.delete(name)
+            deleted += 1
+    return deleted, freed
+
+
+def sweep_expired_temp_data(max_age=None, batch_size=None, include_files=True):
+    """
+    Delete temp questions, temp answers and temp PDFs older than max_age seconds, left behind when
+    users do not finish reviewing generated questions, along with their unreferenced files.
+
+    Rows are removed in short transactions of batch_size rows, so the tables live uploads write to
+    are never locked for long. Returns a report of what was reclaimed.
+    """
+    config = temp_data_settings()
+    max_age = config['MAX_AGE'] if max_age is None else max_age
+    batch_size = batch_size or config['BATCH_SIZE']
+    cutoff = timezone.now() - timedelta(seconds=max_age)
+    started = time.monotonic()
+
+    report = {}
+    report['temp_questions'], report['temp_answers'] = sweep_temp_questions(cutoff, batch_size)
+    report['temp_pdfs'], report['bytes_freed'] = sweep_temp_pdfs(cutoff, batch_size)
+    # blobs whose references drifted to zero outside of release_blob
+    report['bytes_freed'] += delete_unreferenced_blobs()
+    report['orphaned_files'] = 0
+    if include_files:
+        report['orphaned_files'], orphaned_bytes = sweep_orphaned_files(cutoff)
+        report['bytes_freed'] += orphaned_bytes
+    report['seconds'] = round(time.monotonic() - started, 3)
+
+    logger.info(f"Swept expired temp data: {report}")
+    return report
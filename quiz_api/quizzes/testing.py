@@ -0,0 +1,64 @@
+# quizzes/testing.py
+
+"""
+Helpers for tests and benchmarks that need real PDF files without shipping binary fixtures.
+"""
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def build_pdf(pages):
+    """
+    Return the bytes of a minimal PDF with one page per entry in `pages`.
+
+    Each entry is a list of text lines, drawn top to bottom in Helvetica so PyPDF2 can extract them.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+
+    for lines in pages:
+        commands = ["BT", "/F1 11 Tf", "14 TL", "50 800 Td"]
+        for line in lines:
+            commands.append(f"({_escape(line)}) Tj T*")
+        commands.append("ET")
+        stream = "\n".join(commands).encode('latin-1', 'replace')
+
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(output)
+
+
+def lecture_pages(num_pages, words_per_page=60):
+    """Text for a synthetic lecture deck whose pages are all different from each other"""
+    pages = []
+    for page in range(1, num_pages + 1):
+        words = [f"topic{page}term{word}" for word in range(words_per_page)]
+        lines = [f"Lecture page {page}"] + [' '.join(words[i:i + 10]) for i in range(0, len(words), 10)]
+        pages.append(lines)
+    return pages
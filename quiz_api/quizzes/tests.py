@@ -1,9 +1,53 @@
-from django.test import TestCase
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.core.management import call_command
 from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
 from rest_framework import status
 from rest_framework.test import APITestCase
 from django.urls import reverse
-from quizzes.models import Quiz, Question, Answer
+from django.utils import timezone
+from django.db import connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from quizzes.models import (Category, Tag, Quiz, Question, Answer, TempPDF, TempQuestion, TempAnswer,
+                            GenerationJob, CachedSlideQuestions, FacetCount)
+from quizzes import counters, facets, question_cache, quiz_cache, search
+from attempts.models import QuizAttempt
+from quizzes.jobs import claim_next_job, requeue_stale_jobs, run_job
+from documents.extraction import extract_document
+from documents.models import PDF, PDFBlob
+from documents.storage import store_pdf
+from quizzes.pdf_processor import (generate_questions, iter_generated_questions, save_temp_questions,
+                                   extract_slides_from_pdf, process_pdf_and_generate_questions, iter_slides_from_document,
+                                   SlidePacker, SYSTEM_PROMPT)
+from quizzes.testing import build_pdf, lecture_pages
+from quizzes.utils import make_permanent
+from quizzes.sweeper import sweep_expired_temp_data
+from quizzes.events import GenerationEventStream
+from quizzes.backends import AnthropicBackend, StubBackend, GenerationBackendError, TokenUsage, get_backend
+from quizzes.benchmark import benchmark_search, run_benchmarks, compare_to_baseline
+from quizzes.token_budget import BoilerplateTrimmer, estimate_tokens, split_slide
+from quizzes.json_stream import QuestionStreamParser
+from quizzes.tracing import job_trace_id, load_trace, summarize
+from quizzes.llm_guard import (LLMGuard, TokenBucketLimiter, CircuitBreaker, CircuitOpenError, guard_stats,
+                               reset_guard_stats)
 
 class QuizModelTest(TestCase):
     """Test case for the Quiz model"""
@@ -71,6 +115,363 @@ class QuestionAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(Question.objects.count(), 0)
 
+class QuizListTest(APITestCase):
+    """Test case for the paginated quiz summary list"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.category = Category.objects.create(name='Biology')
+        self.tag = Tag.objects.create(name='cells')
+        self.quizzes = []
+        for n in range(5):
+            quiz = Quiz.objects.create(title=f'Quiz {n}', creator=self.user,
+                                       difficulty='hard' if n % 2 else 'easy',
+                                       category=self.category if n < 2 else None)
+            for q in range(n):
+                question = Question.objects.create(quiz=quiz, text=f'Question {q}')
+                Answer.objects.create(question=question, text='Yes', is_correct=True)
+            self.quizzes.append(quiz)
+        self.quizzes[3].tags.add(self.tag)
+        other = User.objects.create_user(username='other', password='12345')
+        Quiz.objects.create(title='Not mine', creator=other)
+
+    def test_list_is_a_paginated_summary_of_own_quizzes(self):
+        """Test that the list pages through the user's quizzes, newest first, without their questions"""
+        response = self.client.get('/api/quizzes/', {'page_size': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first = response.data['results']
+        self.assertEqual([quiz['title'] for quiz in first], ['Quiz 4', 'Quiz 3', 'Quiz 2'])
+        self.assertEqual(set(first[0]), {'id', 'title', 'difficulty', 'category', 'tags', 'question_count'})
+        self.assertEqual((first[0]['question_count'], first[1]['tags']), (4, [self.tag.id]))
+
+        second = self.client.get(response.data['next']).data
+        self.assertEqual([quiz['title'] for quiz in second['results']], ['Quiz 1', 'Quiz 0'])
+        self.assertIsNone(second['next'])
+
+    def test_list_filters(self):
+        """Test filtering the list by difficulty, category and tag"""
+        def titles(**params):
+            return [quiz['title'] for quiz in self.client.get('/api/quizzes/', params).data['results']]
+
+        self.assertEqual(titles(difficulty='hard'), ['Quiz 3', 'Quiz 1'])
+        self.assertEqual(titles(category=self.category.id), ['Quiz 1', 'Quiz 0'])
+        self.assertEqual(titles(tag=self.tag.id), ['Quiz 3'])
+        self.assertEqual(self.client.get('/api/quizzes/', {'tag': 'cells'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_queries_do_not_grow_with_questions(self):
+        """Test that the list runs the same queries however many questions the quizzes have"""
+        with CaptureQueriesContext(connection) as before:
+            self.client.get('/api/quizzes/')
+        for quiz in self.quizzes:
+            for _ in range(20):
+                Question.objects.create(quiz=quiz, text='More')
+        with CaptureQueriesContext(connection) as after:
+            response = self.client.get('/api/quizzes/')
+        self.assertEqual(len(before), len(after))
+        self.assertEqual(response.data['results'][0]['question_count'], 24)
+
+    def test_detail_keeps_questions_nested(self):
+        """Test that the detail route still returns every question with its answers"""
+        response = self.client.get(f'/api/quizzes/{self.quizzes[2].id}/')
+        self.assertEqual(len(response.data['questions']), 2)
+        self.assertEqual(response.data['questions'][0]['answers'][0]['text'], 'Yes')
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'quiz-payloads'},
+})
+class QuizPayloadCacheTest(APITestCase):
+    """Test case for the versioned quiz detail cache and conditional GETs"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.quiz = Quiz.objects.create(title='Test Quiz', creator=self.user)
+        self.question = Question.objects.create(quiz=self.quiz, text='What is 2+2?')
+        self.answer = Answer.objects.create(question=self.question, text='4', is_correct=True)
+        self.url = f'/api/quizzes/{self.quiz.id}/'
+        quiz_cache.clear_local_cache()
+
+    def test_cached_payload_and_not_modified(self):
+        """Test that repeated fetches skip the question tables, and a matching ETag gets a 304"""
+        first = self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(self.url)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertFalse([q for q in queries.captured_queries if 'quizzes_question' in q['sql']])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(queries), 1)
+
+    def test_writes_change_the_version(self):
+        """Test that question and answer writes, through any route, invalidate the cached payload"""
+        etag = self.client.get(self.url)['ETag']
+
+        update = {'text': 'What is 3+3?', 'question_type': 'mcq', 'answers': [{'text': '6', 'is_correct': True}]}
+        self.client.put(f'/api/quizzes/{self.quiz.id}/questions/{self.question.id}/', update, format='json')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['questions'][0]['answers'][0]['text'], '6')
+
+        etag = response['ETag']
+        answer = Answer.objects.get(question=self.question)
+        self.client.patch(f'/api/quizzes/{self.quiz.id}/questions/{self.question.id}/answers/{answer.id}/',
+                          {'text': 'six'}, format='json')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.data['questions'][0]['answers'][0]['text'], 'six')
+
+        # saving a quiz read before those writes does not bring its version back
+        stale = Quiz.objects.get(pk=self.quiz.pk)
+        Question.objects.create(quiz=self.quiz, text='Another')
+        stale.title = 'Renamed'
+        stale.save()
+        response = self.client.get(self.url)
+        self.assertEqual((response.data['title'], len(response.data['questions'])), ('Renamed', 2))
+
+    @override_settings(QUIZ_PAYLOAD_CACHE={'SHARED_CACHE': 'shared'})
+    def test_shared_cache_serves_other_processes(self):
+        """Test that a payload built by one process is found in the shared cache by another"""
+        first = self.client.get(self.url)
+        quiz_cache.clear_local_cache()
+        before = quiz_cache.cache_stats()
+        second = self.client.get(self.url)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(quiz_cache.cache_stats()['shared_hits'], before['shared_hits'] + 1)
+
+
+class QuizCounterTest(TestCase):
+    """Test case for the denormalized question and attempt counters on Quiz"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.quiz = Quiz.objects.create(title='Test Quiz', creator=self.user)
+        self.questions = [Question.objects.create(quiz=self.quiz, text=f'Question {n}') for n in range(6)]
+        for question in self.questions:
+            Answer.objects.create(question=question, text='Yes', is_correct=True)
+
+    def counters(self):
+        return Quiz.objects.values_list(*counters.COUNTERS).get(pk=self.quiz.pk)
+
+    @staticmethod
+    def quiz_updates(queries):
+        return [q for q in queries.captured_queries if q['sql'].startswith('UPDATE "quizzes_quiz"')]
+
+    def test_questions_and_attempts_are_counted(self):
+        """Test that creating, finishing and deleting attempts and questions keeps the counters exact"""
+        temp_question = TempQuestion.objects.create(quiz=self.quiz, text='Promoted')
+        make_permanent(temp_question)
+        self.assertEqual(self.counters(), (7, 0, 0, 0))
+
+        first = QuizAttempt.objects.create(user=self.user, quiz=self.quiz)
+        second = QuizAttempt.objects.create(user=self.user, quiz=self.quiz)
+        first.end_time, first.score = timezone.now(), 50.0
+        first.save()
+        first.save()
+        second.end_time, second.score = timezone.now(), 80.0
+        second.save()
+        self.assertEqual(self.counters(), (7, 2, 2, 130.0))
+        self.assertEqual(Quiz.objects.get(pk=self.quiz.pk).average_score, 65.0)
+
+        first.delete()
+        self.assertEqual(self.counters(), (7, 1, 1, 80.0))
+
+    def test_bulk_deletes_update_each_quiz_once(self):
+        """Test that a queryset delete costs one counter UPDATE, and a quiz delete none"""
+        with CaptureQueriesContext(connection) as queries:
+            Question.objects.filter(pk__in=[question.pk for question in self.questions[:4]]).delete()
+        self.assertEqual(len(self.quiz_updates(queries)), 1)
+        self.assertEqual(self.counters()[0], 2)
+
+        QuizAttempt.objects.create(user=self.user, quiz=self.quiz)
+        with CaptureQueriesContext(connection) as queries:
+            self.quiz.delete()
+        self.assertEqual(self.quiz_updates(queries), [])
+
+    def test_reconcile_recomputes_drifted_counters(self):
+        """Test that the reconciliation command fixes counters changed behind the signals' back"""
+        QuizAttempt.objects.create(user=self.user, quiz=self.quiz, end_time=timezone.now(), score=40.0)
+        other = Quiz.objects.create(title='Other Quiz', creator=self.user)
+        Quiz.objects.filter(pk=self.quiz.pk).update(question_count=0, score_sum=1.5)
+
+        out = StringIO()
+        call_command('reconcile_quiz_counters', batch_size=1, stdout=out)
+        self.assertIn('Corrected the counters of 1 quizzes', out.getvalue())
+        self.assertEqual(self.counters(), (6, 1, 1, 40.0))
+        self.assertEqual(Quiz.objects.values_list(*counters.COUNTERS).get(pk=other.pk), (0, 0, 0, 0))
+
+
+class QuizSearchTest(APITestCase):
+    """Test case for ranked quiz search"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        other = User.objects.create_user(username='other', password='12345')
+        self.biology = Category.objects.create(name='Biology')
+        self.exam = Tag.objects.create(name='exam')
+        self.cells = Quiz.objects.create(title='Cell biology', description='Membranes and organelles',
+                                         creator=other, category=self.biology, difficulty='hard')
+        self.cells.tags.add(self.exam)
+        self.history = Quiz.objects.create(title='Modern history', creator=self.user)
+        Question.objects.create(quiz=self.history, text='Which cells did the prisoners share?')
+        self.chemistry = Quiz.objects.create(title='Chemistry', description='Reactions in living cells',
+                                             creator=self.user, category=self.biology)
+        search.inverted_index.clear()
+
+    def search(self, **params):
+        response = self.client.get('/api/quizzes/search/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [quiz['title'] for quiz in response.data['results']]
+
+    def test_results_are_ranked(self):
+        """Test that title matches rank above description matches, which rank above question matches"""
+        self.assertEqual(self.search(q='cell'), ['Cell biology', 'Chemistry', 'Modern history'])
+        self.assertEqual(self.search(q='prisoners cells'), ['Modern history'])
+        self.assertEqual(self.search(q='organelles history'), [])
+        self.assertEqual(self.client.get('/api/quizzes/search/').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filters_and_pages(self):
+        """Test that search results can be filtered like the list, and are paginated"""
+        self.assertEqual(self.search(q='cells', category=self.biology.id), ['Cell biology', 'Chemistry'])
+        self.assertEqual(self.search(q='cells', tag=self.exam.id, difficulty='hard'), ['Cell biology'])
+
+        response = self.client.get('/api/quizzes/search/', {'q': 'cells', 'page_size': 2})
+        self.assertEqual((response.data['count'], len(response.data['results'])), (3, 2))
+        self.assertGreater(response.data['results'][0]['rank'], response.data['results'][1]['rank'])
+        self.assertEqual(len(self.client.get(response.data['next']).data['results']), 1)
+
+    def test_index_follows_writes(self):
+        """Test that edits, new questions and deletes are searchable right away"""
+        self.assertEqual(self.search(q='photosynthesis'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Question.objects.create(quiz=self.chemistry, text='Where does photosynthesis happen?')
+        self.assertEqual(self.search(q='photosynthesis'), ['Chemistry'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.history.title = 'Photosynthesis history'
+            self.history.save()
+        self.assertEqual(self.search(q='photosynthesis'), ['Photosynthesis history', 'Chemistry'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chemistry.delete()
+        self.assertEqual(self.search(q='photosynthesis'), ['Photosynthesis history'])
+
+    def test_index_is_kept_between_searches(self):
+        """Test that searches only read the quiz table again for changed quizzes, or once per interval"""
+        self.search(q='cell')
+        # the matches and their tags
+        with self.assertNumQueries(2):
+            self.search(q='cell')
+
+        # written by another process, which marks nothing in this one
+        Quiz.objects.filter(pk=self.history.pk).update(title='Revolutions', version=F('version') + 1)
+        self.assertEqual(self.search(q='revolutions'), [])
+        with override_settings(QUIZ_SEARCH={'RESYNC_INTERVAL': 0}):
+            self.assertEqual(self.search(q='revolutions'), ['Revolutions'])
+
+
+class QuizFacetTest(APITestCase):
+    """Test case for the precomputed quiz counts by category, tag and difficulty"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.biology = Category.objects.create(name='Biology')
+        self.chemistry = Category.objects.create(name='Chemistry')
+        self.exam = Tag.objects.create(name='exam')
+        self.intro = Tag.objects.create(name='intro')
+        self.cells = Quiz.objects.create(title='Cells', creator=self.user, category=self.biology, difficulty='hard')
+        self.cells.tags.add(self.exam, self.intro)
+        self.genes = Quiz.objects.create(title='Genes', creator=self.user, category=self.biology)
+        self.genes.tags.add(self.exam)
+        self.acids = Quiz.objects.create(title='Acids', creator=self.user, category=self.chemistry)
+        cache.clear()
+
+    def assertCountsExact(self):
+        stored = {(row.scope, row.facet, row.value): row.count
+                  for row in FacetCount.objects.filter(count__gt=0)}
+        self.assertEqual(stored, dict(facets.count_facets()))
+
+    def facets(self, **params):
+        response = self.client.get('/api/quizzes/facets/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_counts_follow_writes(self):
+        """Test that creating, recategorizing, retagging and deleting keeps every count exact"""
+        self.assertCountsExact()
+        self.cells.category, self.cells.difficulty = self.chemistry, 'easy'
+        self.cells.save()
+        self.assertCountsExact()
+        self.cells.tags.remove(self.exam, self.exam.pk + 100)
+        self.intro.quizzes.add(self.genes, self.acids)
+        self.assertCountsExact()
+        self.intro.quizzes.clear()
+        self.genes.tags.set([self.exam, self.intro])
+        self.assertCountsExact()
+
+        self.exam.delete()
+        self.biology.delete()
+        self.acids.delete()
+        self.assertCountsExact()
+        data = self.facets()
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(data['category'], [{'id': None, 'name': None, 'count': 1},
+                                            {'id': self.chemistry.id, 'name': 'Chemistry', 'count': 1}])
+        self.assertEqual(data['tag'], [{'id': self.intro.id, 'name': 'intro', 'count': 1}])
+
+    def test_scoped_facets_are_cached(self):
+        """Test that counts within a category or difficulty are served from the cache until a count changes"""
+        data = self.facets(category=self.biology.id)
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(data['category'], [])
+        self.assertEqual([(tag['name'], tag['count']) for tag in data['tag']], [('exam', 2), ('intro', 1)])
+        self.assertEqual([(level['value'], level['count']) for level in data['difficulty']],
+                         [('hard', 1), ('not_specified', 1)])
+        self.assertEqual(self.facets(difficulty='hard')['category'][0]['name'], 'Biology')
+
+        # only the version of the scope is read, and writes bump it without touching this process's cache
+        with self.assertNumQueries(1):
+            self.facets(category=self.biology.id)
+        self.acids.tags.add(self.exam)
+        # a chemistry quiz changed no count within biology
+        with self.assertNumQueries(1):
+            self.facets(category=self.biology.id)
+        self.chemistry.name = 'Organic chemistry'
+        self.chemistry.save()
+        self.assertEqual(self.facets()['tag'][0], {'id': self.exam.id, 'name': 'exam', 'count': 3})
+        self.assertEqual(self.facets(difficulty='not_specified')['category'][1]['name'], 'Organic chemistry')
+
+        self.assertEqual(self.client.get('/api/quizzes/facets/', {'difficulty': 'extreme'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/api/quizzes/facets/', {'category': 1, 'difficulty': 'hard'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_rebuild_fixes_drift(self):
+        """Test that the rebuild command corrects counts changed behind the signals' back"""
+        FacetCount.objects.filter(scope='', facet='tag', value=str(self.exam.id)).update(count=7)
+        FacetCount.objects.filter(scope='', facet='category', value=str(self.chemistry.id)).delete()
+        Quiz.tags.through.objects.filter(tag=self.intro).delete()
+
+        out = StringIO()
+        call_command('rebuild_quiz_facets', stdout=out)
+        self.assertIn('Corrected 5 facet counts', out.getvalue())
+        self.assertCountsExact()
+        # the intro tag's rows are kept at 0, so the version of their scopes never goes back
+        self.assertEqual(set(FacetCount.objects.filter(facet='tag', value=str(self.intro.id))
+                             .values_list('count', flat=True)), {0})
+
+
 class QuestionAnswerAPITest(APITestCase):
     """Test case for Question-Answer interactions in the API"""
 
@@ -153,4 +554,1181 @@ class QuestionAnswerAPITest(APITestCase):
         response = self.client.delete(url)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(Question.objects.count(), 0)
-        self.assertEqual(Answer.objects.count(), 0)
\ No newline at end of file
+        self.assertEqual(Answer.objects.count(), 0)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), QUIZ_TRACING={'PATH': None})
+class GenerationJobAPITest(APITestCase):
+    """Test case for the queued PDF question generation"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.quiz = Quiz.objects.create(title='Test Quiz', creator=self.user)
+
+    def upload(self):
+        pdf = SimpleUploadedFile('deck.pdf', b'%PDF-1.4 test', content_type='application/pdf')
+        return self.client.post(f'/api/quizzes/{self.quiz.id}/upload_pdf/', {'pdf': pdf}, format='multipart')
+
+    def test_upload_queues_job(self):
+        """Test that uploading a PDF returns immediately with a queued job"""
+        with mock.patch('quizzes.jobs.process_pdf_and_generate_questions') as process:
+            response = self.upload()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['job']['status'], GenerationJob.STATUS_QUEUED)
+        self.assertEqual(TempPDF.objects.count(), 1)
+        process.assert_not_called()
+
+    def test_worker_runs_job_and_reports_status(self):
+        """Test that a claimed job runs to completion and is visible through the status endpoint"""
+        job_id = self.upload().data['job']['id']
+
+        def fake_process(path, quiz, progress_callback=None, blob=None, usage=None, regenerate=None, tracer=None,
+                         job=None, failed_slides=None, cache_counts=None):
+            progress_callback(2, 2)
+            return 4
+
+        with mock.patch('quizzes.jobs.process_pdf_and_generate_questions', side_effect=fake_process):
+            job = claim_next_job('test-worker')
+            self.assertEqual(job.id, job_id)
+            run_job(job)
+        self.assertIsNone(claim_next_job('test-worker'))
+
+        response = self.client.get(f'/api/quizzes/{self.quiz.id}/generation_jobs/{job_id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], GenerationJob.STATUS_SUCCEEDED)
+        self.assertEqual(response.data['progress'], 2)
+        self.assertEqual(response.data['num_questions'], 4)
+
+    def test_only_jobs_without_a_heartbeat_are_requeued(self):
+        """Test that a long job reporting progress stays running, and a retry drops the questions of the dead run"""
+        self.upload()
+        job = claim_next_job('test-worker')
+        GenerationJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(requeue_stale_jobs(stale_after=60), 0)
+
+        save_temp_questions(self.quiz, make_slides_data(num_slides=3, questions_per_slide=1), job=job)
+        GenerationJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(requeue_stale_jobs(stale_after=60), 1)
+
+        def fake_process(path, quiz, job=None, **kwargs):
+            save_temp_questions(quiz, make_slides_data(num_slides=3, questions_per_slide=1), job=job)
+            return 3
+
+        with mock.patch('quizzes.jobs.process_pdf_and_generate_questions', side_effect=fake_process):
+            job = run_job(claim_next_job('test-worker'))
+        self.assertEqual((job.status, job.attempts), (GenerationJob.STATUS_SUCCEEDED, 2))
+        self.assertEqual(TempQuestion.objects.filter(job=job).count(), 3)
+
+    def test_failed_job_records_error(self):
+        """Test that an exception during generation marks the job as failed"""
+        self.upload()
+        with mock.patch('quizzes.jobs.process_pdf_and_generate_questions', side_effect=RuntimeError('boom')):
+            job = run_job(claim_next_job('test-worker'))
+        self.assertEqual(job.status, GenerationJob.STATUS_FAILED)
+        self.assertEqual(job.error, 'boom')
+        self.assertEqual(TempPDF.objects.count(), 0)
+
+
+def use_backend(backend):
+    """Patch the question generation backend for the duration of a with block"""
+    return mock.patch('quizzes.pdf_processor.get_backend', return_value=backend)
+
+
+def make_slides(count):
+    return [f"Slide {n}\n\n" + ' '.join(f'word{n}x{w}' for w in range(30)) for n in range(1, count + 1)]
+
+
+@override_settings(QUIZ_PACKING={'MAX_SLIDES': 1})
+class GenerateQuestionsTest(TestCase):
+    """Test case for the concurrent question generation"""
+
+    def test_results_are_in_slide_order(self):
+        """Test that slides come back in order even when calls finish out of order"""
+        backend = StubBackend(latency=0.01)
+        with use_backend(backend):
+            data = generate_questions(make_slides(12), concurrency=4)
+        self.assertEqual([s['slide_number'] for s in data['slides']], list(range(1, 13)))
+        self.assertEqual(backend.calls, 12)
+
+    def test_concurrency_limit(self):
+        """Test that no more than `concurrency` calls are in flight at once"""
+        backend = StubBackend(latency=0.05)
+        with use_backend(backend):
+            started = time.monotonic()
+            generate_questions(make_slides(8), concurrency=4)
+            elapsed = time.monotonic() - started
+        self.assertEqual(backend.max_in_flight, 4)
+        # two rounds of four calls instead of eight sequential ones
+        self.assertLess(elapsed, 0.05 * 8)
+
+    def test_failed_slide_does_not_sink_the_deck(self):
+        """Test that a failing slide is reported and the other slides still get questions"""
+        backend = StubBackend(fail_on=[2])
+        with use_backend(backend):
+            data = generate_questions(make_slides(3), concurrency=2)
+        self.assertEqual([s['slide_number'] for s in data['slides']], [1, 3])
+        self.assertEqual(data['failed_slides'], [2])
+
+
+@override_settings(QUIZ_PACKING={'MAX_SLIDES': 1})
+class QuestionCacheTest(TestCase):
+    """Test case for the per-slide question cache"""
+
+    def setUp(self):
+        question_cache.reset_cache_stats()
+
+    def generate(self, slides):
+        backend = StubBackend()
+        with use_backend(backend):
+            data = generate_questions(slides, concurrency=2)
+        return data, backend.calls
+
+    def test_reupload_is_served_from_cache(self):
+        """Test that generating the same slides twice only calls the LLM once per slide"""
+        first, first_calls = self.generate(make_slides(3))
+        # the same content at a different position in another deck still hits
+        second, second_calls = self.generate(list(reversed(make_slides(3))))
+        self.assertEqual(first_calls, 3)
+        self.assertEqual(second_calls, 0)
+        self.assertEqual(len(second['slides']), 3)
+        stats = question_cache.cache_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (3, 3, 3))
+
+    def test_expired_entries_are_ignored(self):
+        """Test that entries older than the TTL are treated as misses"""
+        self.generate(make_slides(1))
+        with override_settings(QUIZ_QUESTION_CACHE={'TTL': 0}, QUIZ_PACKING={'MAX_SLIDES': 1}):
+            _, calls = self.generate(make_slides(1))
+        self.assertEqual(calls, 1)
+
+    def test_expired_entries_are_refreshed_when_stored_again(self):
+        """Test that storing an expired key again makes it live, with the new questions"""
+        question_cache.store_questions({'slide-key': [{'question_text': 'Old?'}]}, 'model', '1')
+        CachedSlideQuestions.objects.update(created_at=timezone.now() - timedelta(days=365))
+        self.assertEqual(question_cache.get_cached_questions(['slide-key']), {})
+
+        question_cache.store_questions({'slide-key': [{'question_text': 'New?'}]}, 'model', '1')
+        self.assertEqual(question_cache.get_cached_questions(['slide-key']),
+                         {'slide-key': [{'question_text': 'New?'}]})
+        self.assertEqual(CachedSlideQuestions.objects.count(), 1)
+
+    def test_size_based_eviction(self):
+        """Test that the least recently used entries are evicted once the cache is over MAX_SIZE"""
+        self.generate(make_slides(2))
+        size = CachedSlideQuestions.objects.first().size
+        with override_settings(QUIZ_QUESTION_CACHE={'MAX_SIZE': size * 2}, QUIZ_PACKING={'MAX_SLIDES': 1}):
+            self.generate(make_slides(3)[2:])
+        self.assertEqual(CachedSlideQuestions.objects.count(), 2)
+        self.assertEqual(question_cache.cache_stats()['evictions'], 1)
+
+
+class SlidePackingTest(TestCase):
+    """Test case for packing short slides into shared LLM requests"""
+
+    def test_short_slides_share_a_request(self):
+        """Test that adjacent short slides are sent together and split back by slide number"""
+        backend = StubBackend()
+        with override_settings(QUIZ_PACKING={'TOKEN_BUDGET': 1000, 'MAX_SLIDES': 5}):
+            with use_backend(backend):
+                data = generate_questions(make_slides(10), use_cache=False)
+        self.assertEqual(backend.calls, 2)
+        self.assertEqual([s['slide_number'] for s in data['slides']], list(range(1, 11)))
+        for slide_data in data['slides']:
+            self.assertIn(f"slide {slide_data['slide_number']}?", slide_data['questions'][0]['question_text'])
+
+    def test_token_budget_closes_batches(self):
+        """Test that a batch never goes over the token budget unless a single slide does"""
+        slides = [(1, 'a' * 400), (2, 'b' * 400), (3, 'c' * 2000), (4, 'd' * 40)]
+        packer = SlidePacker(token_budget=250, max_slides=10)
+        batches = [packer.add((n, slide), slide) for n, slide in slides] + [packer.flush()]
+        self.assertEqual([[n for n, _ in batch] for batch in batches if batch], [[1, 2], [3], [4]])
+
+
+class NearDuplicateSlideTest(TestCase):
+    """Test case for collapsing near-duplicate slides before generation"""
+
+    agenda = ('Agenda for today: relational model, keys and constraints, normal forms, '
+              'functional dependencies, decomposition, lossless joins and dependency preservation')
+    content = ('A primary key uniquely identifies each row in a table and cannot contain null values, '
+               'while a foreign key references the primary key of another table to link the two')
+
+    def test_near_duplicates_are_grouped(self):
+        """Test that repeated and build-up slides collapse onto the most complete one"""
+        texts = [self.agenda, self.content, f'{self.content} in a database', self.agenda]
+        slides = [f'Slide {n}\n\n{text}' for n, text in enumerate(texts, 1)]
+        with use_backend(StubBackend()):
+            data = generate_questions(slides, use_cache=False)
+        self.assertEqual({s['slide_number']: s['duplicate_slide_numbers'] for s in data['slides']}, {1: [4], 3: [2]})
+
+    def test_duplicates_are_generated_once(self):
+        """Test that only representatives reach the LLM and carry the merged slide numbers"""
+        slides = [f'Slide {n}\n\n{text}' for n, text in enumerate([self.agenda, self.content, self.agenda], 1)]
+        backend = StubBackend()
+        with use_backend(backend):
+            data = generate_questions(slides, use_cache=False)
+        self.assertEqual([s['slide_number'] for s in data['slides']], [1, 2])
+        self.assertEqual(data['slides'][0]['duplicate_slide_numbers'], [3])
+        self.assertEqual(data['slides'][1]['duplicate_slide_numbers'], [])
+
+
+def make_slides_data(num_slides, questions_per_slide):
+    return [
+        {'slide_number': n, 'questions': [{
+            'question_text': f'Question {q} on slide {n}?',
+            'options': {'A': 'Right', 'B': 'Wrong', 'C': 'Wrong', 'D': 'Wrong'},
+            'correct_answer': 'A',
+        } for q in range(questions_per_slide)]}
+        for n in range(1, num_slides + 1)
+    ]
+
+
+class BulkPersistenceTest(APITestCase):
+    """Test case for the bulk saving of generated and promoted questions"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.quiz = Quiz.objects.create(title='Test Quiz', creator=self.user)
+
+    def count_queries(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        return len(queries)
+
+    def test_saving_generated_questions_is_constant_queries(self):
+        """Test that the number of INSERTs does not grow with the number of questions"""
+        small = self.count_queries(lambda: save_temp_questions(self.quiz, make_slides_data(1, 1)))
+        # kept under SQLite's bound-parameter limit, which splits larger bulk INSERTs into batches
+        large = self.count_queries(lambda: save_temp_questions(self.quiz, make_slides_data(20, 3)))
+        self.assertEqual(small, large)
+        self.assertEqual(TempQuestion.objects.count(), 61)
+        self.assertEqual(TempAnswer.objects.filter(is_correct=True).count(), 61)
+        self.assertEqual(TempAnswer.objects.count(), 61 * 4)
+
+    def test_add_selected_questions_is_constant_queries(self):
+        """Test that promoting questions copies their answers without per-question queries"""
+        url = f'/api/quizzes/{self.quiz.id}/add_selected_questions/'
+        # the quiz already having questions changes the detail prefetch, so start from that state
+        Question.objects.create(quiz=self.quiz, text='Existing question?', question_type='mcq')
+        save_temp_questions(self.quiz, make_slides_data(1, 1))
+        ids = list(TempQuestion.objects.values_list('id', flat=True))
+        small = self.count_queries(lambda: self.client.post(url, {'question_ids': ids}, format='json'))
+
+        save_temp_questions(self.quiz, make_slides_data(20, 3))
+        ids = list(TempQuestion.objects.values_list('id', flat=True))
+        large = self.count_queries(lambda: self.client.post(url, {'question_ids': ids}, format='json'))
+
+        self.assertEqual(small, large)
+        self.assertEqual(Question.objects.filter(quiz=self.quiz).count(), 62)
+        self.assertEqual(Answer.objects.filter(question__quiz=self.quiz).count(), 61 * 4)
+        self.assertEqual(TempQuestion.objects.count(), 0)
+
+    def test_make_permanent(self):
+        """Test that a single temp question is promoted with its answers"""
+        save_temp_questions(self.quiz, make_slides_data(1, 1))
+        question = make_permanent(TempQuestion.objects.get())
+        self.assertEqual(question.answers.count(), 4)
+        self.assertEqual(question.answers.get(is_correct=True).text, 'Right')
+        self.assertFalse(TempAnswer.objects.exists())
+
+
+class SlideExtractionTest(TestCase):
+    """Test case for the serial and sharded PDF text extraction"""
+
+    def setUp(self):
+        pages = lecture_pages(9)
+        # a page holding two slides, split by the slide splitter
+        pages[4] = ['First half of the page', 'Slide', 'Second half of the page']
+        self.path = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False).name
+        self.addCleanup(os.remove, self.path)
+        with open(self.path, 'wb') as f:
+            f.write(build_pdf(pages))
+
+    def test_parallel_extraction_matches_serial(self):
+        """Test that sharding across processes gives the same slides and numbering as serial extraction"""
+        serial = extract_slides_from_pdf(self.path, workers=1)
+        with override_settings(QUIZ_EXTRACTION={'MIN_PAGES': 2, 'SHARD_PAGES': 2}):
+            parallel = extract_slides_from_pdf(self.path, workers=3)
+        self.assertEqual(len(serial), 10)
+        self.assertEqual(parallel, serial)
+        self.assertTrue(serial[5].startswith('Slide 6\n\nSlide\nSecond half'))
+        self.assertTrue(serial[9].startswith('Slide 10\n\nLecture page 9\ntopic9term0'))
+        # the "Lecture page N" header repeats on every page, but slides within budget are kept as written
+        with override_settings(QUIZ_TOKEN_BUDGET={'MAX_SLIDE_TOKENS': 50}):
+            trimmed = extract_slides_from_pdf(self.path, workers=1)
+        self.assertTrue(trimmed[9].startswith('Slide 10\n\ntopic9term0'))
+
+    def test_small_files_are_extracted_serially(self):
+        """Test that files below MIN_PAGES never start a process pool"""
+        with mock.patch('quizzes.extraction.ProcessPoolExecutor') as pool:
+            slides = extract_slides_from_pdf(self.path, workers=4)
+        pool.assert_not_called()
+        self.assertEqual(len(slides), 10)
+
+
+class StreamingPipelineTest(TestCase):
+    """Test case for saving questions while the PDF is still being read"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.quiz = Quiz.objects.create(title='Test Quiz', creator=self.user)
+        self.pulled = 0
+
+    def slow_slides(self, slides):
+        for slide in slides:
+            self.pulled += 1
+            time.sleep(0.005)
+            yield slide
+
+    def run_pipeline(self, slides):
+        backend = StubBackend()
+        with mock.patch('quizzes.pdf_processor.iter_slides_from_pdf', return_value=self.slow_slides(slides)), \
+                use_backend(backend):
+            return process_pdf_and_generate_questions('deck.pdf', self.quiz)
+
+    def test_first_questions_are_saved_before_extraction_ends(self):
+        """Test that questions land in TempQuestion while later slides are still being extracted"""
+        pulled_at_first_save = []
+        real_save = save_temp_questions
+
+        def spy(quiz, slides_data, job=None):
+            pulled_at_first_save.append(self.pulled)
+            return real_save(quiz, slides_data, job=job)
+
+        with mock.patch('quizzes.pdf_processor.save_temp_questions', side_effect=spy):
+            total = self.run_pipeline(make_slides(40))
+        self.assertEqual(total, 40)
+        self.assertLess(pulled_at_first_save[0], 40)
+
+    def test_late_duplicate_updates_saved_questions(self):
+        """Test that a recap slide far from the original is merged into the already saved questions"""
+        agenda = NearDuplicateSlideTest.agenda
+        slides = [f'Slide 1\n\n{agenda}'] + make_slides(30)[1:25] + [f'Slide 26\n\n{agenda}']
+        self.run_pipeline(slides)
+        question = TempQuestion.objects.get(slide_number=1)
+        self.assertEqual(question.duplicate_slide_numbers, [26])
+        self.assertEqual(TempQuestion.objects.count(), 25)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), QUIZ_PACKING={'MAX_SLIDES': 1})
+class StoredDocumentGenerationTest(TestCase):
+    """Test case for generating questions from the stored pages of a document"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.quiz = Quiz.objects.create(title='Test Quiz', creator=self.user)
+        blob = store_pdf(SimpleUploadedFile('deck.pdf', build_pdf(lecture_pages(8)), content_type='application/pdf'))
+        self.document = PDF.objects.create(user=self.user, file=blob.file.name, blob=blob, title='Deck')
+
+    def test_page_range_is_generated_without_reading_the_pdf(self):
+        """Test that a page range of an extracted document is generated from its stored text"""
+        extract_document(self.document)
+
+        with mock.patch('PyPDF2.PdfReader', side_effect=AssertionError('PDF was parsed')), \
+                use_backend(StubBackend()):
+            total = process_pdf_and_generate_questions(None, self.quiz, document=self.document, pages=(3, 5))
+        self.assertEqual(total, 3)
+        numbers = TempQuestion.objects.order_by('slide_number').values_list('slide_number', flat=True)
+        self.assertEqual(list(numbers), [1, 2, 3])
+
+        slides = list(iter_slides_from_document(self.document, 3, 5))
+        self.assertIn('topic3term0', slides[0])
+        self.assertIn('topic5term0', slides[-1])
+
+    def test_document_must_be_extracted_first(self):
+        """Test that a document without stored pages is refused"""
+        with self.assertRaises(ValueError):
+            process_pdf_and_generate_questions(None, self.quiz, document=self.document)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), QUIZ_TRACING={'PATH': None})
+class DeduplicatedUploadTest(APITestCase):
+    """Test case for processing the same PDF bytes more than once"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.pdf_bytes = build_pdf(lecture_pages(4))
+
+    def upload_and_process(self):
+        quiz = Quiz.objects.create(title='Test Quiz', creator=self.user)
+        pdf = SimpleUploadedFile('deck.pdf', self.pdf_bytes, content_type='application/pdf')
+        self.client.post(f'/api/quizzes/{quiz.id}/upload_pdf/', {'pdf': pdf}, format='multipart')
+        backend = StubBackend()
+        with use_backend(backend):
+            job = run_job(claim_next_job('test-worker'))
+        return job, backend.calls
+
+    def test_reprocessing_skips_extraction_and_generation(self):
+        """Test that a second upload of the same bytes reuses the stored file, slides and questions"""
+        first, first_calls = self.upload_and_process()
+        with mock.patch('quizzes.pdf_processor.iter_slides_from_pdf') as extract:
+            second, second_calls = self.upload_and_process()
+
+        extract.assert_not_called()
+        self.assertEqual((first_calls, second_calls), (1, 0))
+        self.assertEqual(first.num_questions, second.num_questions)
+        self.assertEqual((first.question_cache_hits, first.question_cache_misses), (0, 4))
+        self.assertEqual((second.question_cache_hits, second.question_cache_misses), (4, 0))
+        self.assertEqual(TempPDF.objects.values('blob').distinct().count(), 1)
+        self.assertEqual(TempPDF.objects.first().blob.ref_count, 2)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class TempDataSweepTest(TestCase):
+    """Test case for deleting abandoned temp questions and temp PDFs"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.quiz = Quiz.objects.create(title='Test Quiz', creator=self.user)
+        self.long_ago = timezone.now() - timedelta(days=30)
+
+    def upload(self, content):
+        blob = store_pdf(SimpleUploadedFile('deck.pdf', content, content_type='application/pdf'))
+        return TempPDF.objects.create(user=self.user, quiz=self.quiz, file=blob.file.name, blob=blob)
+
+    def test_sweep_deletes_expired_temp_data_in_batches(self):
+        """Test that only expired rows are deleted, without loading whole rows first"""
+        save_temp_questions(self.quiz, make_slides_data(num_slides=5, questions_per_slide=1))
+        TempQuestion.objects.update(created_at=self.long_ago)
+        save_temp_questions(self.quiz, make_slides_data(num_slides=1, questions_per_slide=1))
+
+        with CaptureQueriesContext(connection) as queries:
+            report = sweep_expired_temp_data(max_age=60 * 60, batch_size=2, include_files=False)
+
+        self.assertEqual(report['temp_questions'], 5)
+        self.assertEqual(report['temp_answers'], 20)
+        self.assertEqual(TempQuestion.objects.count(), 1)
+        self.assertEqual(TempAnswer.objects.count(), 4)
+        # nothing selects whole temp question rows, as Django's deletion collector would
+        self.assertFalse(any('"quizzes_tempquestion"."text"' in query['sql'] for query in queries))
+
+    def test_sweep_releases_blobs_of_expired_pdfs(self):
+        """Test that expired temp PDFs release their blob, and busy or recent ones are kept"""
+        expired = self.upload(b'%PDF-1.4 abandoned')
+        busy = self.upload(b'%PDF-1.4 still generating')
+        recent = self.upload(b'%PDF-1.4 just uploaded')
+        shared = self.upload(b'%PDF-1.4 just uploaded')
+        done_job = GenerationJob.objects.create(quiz=self.quiz, user=self.user, temp_pdf=expired,
+                                                status=GenerationJob.STATUS_SUCCEEDED)
+        GenerationJob.objects.create(quiz=self.quiz, user=self.user, temp_pdf=busy)
+        TempPDF.objects.filter(pk__in=[expired.pk, busy.pk, shared.pk]).update(uploaded_at=self.long_ago)
+
+        report = sweep_expired_temp_data(max_age=60 * 60, include_files=False)
+
+        self.assertEqual(report['temp_pdfs'], 2)
+        self.assertEqual(PDFBlob.objects.get(pk=recent.blob_id).ref_count, 1)
+        self.assertEqual(report['bytes_freed'], len(b'%PDF-1.4 abandoned'))
+        self.assertEqual(set(TempPDF.objects.values_list('pk', flat=True)), {busy.pk, recent.pk})
+        self.assertFalse(PDFBlob.objects.filter(pk=expired.blob_id).exists())
+        self.assertFalse(default_storage.exists(expired.file.name))
+        done_job.refresh_from_db()
+        self.assertIsNone(done_job.temp_pdf)
+
+    def test_sweep_deletes_orphaned_files(self):
+        """Test that old files without a TempPDF or blob are deleted, and new or referenced ones kept"""
+        kept = self.upload(b'%PDF-1.4 kept')
+        orphan = default_storage.save('temp_pdfs/orphan.pdf', SimpleUploadedFile('orphan.pdf', b'orphan'))
+        os.utime(default_storage.path(orphan), (self.long_ago.timestamp(), self.long_ago.timestamp()))
+        os.utime(default_storage.path(kept.file.name), (self.long_ago.timestamp(), self.long_ago.timestamp()))
+        in_progress = default_storage.save('blobs/in_progress.pdf', SimpleUploadedFile('new.pdf', b'new'))
+
+        report = sweep_expired_temp_data(max_age=60 * 60)
+
+        self.assertEqual(report['orphaned_files'], 1)
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertTrue(default_storage.exists(kept.file.name))
+        self.assertTrue(default_storage.exists(in_progress))
+
+
+def parse_events(chunks):
+    """(event, data) pairs of a Server-Sent Events stream, skipping comments"""
+    events = []
+    for message in ''.join(chunk.decode() if isinstance(chunk, bytes) else chunk for chunk in chunks).split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in message.splitlines() if not line.startswith(':'))
+        if fields:
+            events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+class GenerationEventStreamTest(APITestCase):
+    """Test case for streaming generation progress as Server-Sent Events"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.quiz = Quiz.objects.create(title='Test Quiz', creator=self.user)
+        self.job = GenerationJob.objects.create(quiz=self.quiz, user=self.user, progress=2, total=2, num_questions=4,
+                                                status=GenerationJob.STATUS_SUCCEEDED)
+        self.saved = save_temp_questions(self.quiz, make_slides_data(num_slides=2, questions_per_slide=2), job=self.job)
+
+    def events_url(self):
+        return f'/api/quizzes/{self.quiz.id}/generation_jobs/{self.job.id}/events/'
+
+    def test_stream_sends_slides_progress_and_done(self):
+        """Test that the events endpoint streams each slide's questions, the progress and the finished job"""
+        response = self.client.get(self.events_url(), HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        events = parse_events(response.streaming_content)
+        self.assertEqual([event for event, _ in events], ['slide', 'slide', 'progress', 'done'])
+        self.assertEqual([data['slide_number'] for _, data in events[:2]], [1, 2])
+        self.assertEqual(len(events[0][1]['questions']), 2)
+        self.assertEqual(len(events[0][1]['questions'][0]['temp_answers']), 4)
+        self.assertEqual(events[2][1], {'progress': 2, 'total': 2})
+        self.assertEqual(events[3][1]['num_questions'], 4)
+
+    def test_stream_resumes_after_last_event_id(self):
+        """Test that a reconnecting client only gets the slides it has not seen"""
+        response = self.client.get(self.events_url(), HTTP_ACCEPT='text/event-stream',
+                                   HTTP_LAST_EVENT_ID=str(self.saved[1].pk))
+        events = parse_events(response.streaming_content)
+        self.assertEqual([data['slide_number'] for event, data in events if event == 'slide'], [2])
+
+        # an id that is not ours starts over instead of failing
+        response = self.client.get(self.events_url(), HTTP_ACCEPT='text/event-stream', HTTP_LAST_EVENT_ID='abc')
+        events = parse_events(response.streaming_content)
+        self.assertEqual([data['slide_number'] for event, data in events if event == 'slide'], [1, 2])
+
+    def test_slides_saved_over_several_polls_are_sent_whole(self):
+        """Test that a slide whose questions arrive in pieces is sent once per poll, with all its questions"""
+        stream = GenerationEventStream(self.job)
+        stream.poll()
+        save_temp_questions(self.quiz, make_slides_data(num_slides=3, questions_per_slide=1)[2:], job=self.job)
+        save_temp_questions(self.quiz, make_slides_data(num_slides=1, questions_per_slide=1), job=self.job)
+        save_temp_questions(self.quiz, make_slides_data(num_slides=3, questions_per_slide=1)[2:], job=self.job)
+
+        slides = [data for event, data in parse_events(stream.poll()) if event == 'slide']
+        self.assertEqual([(data['slide_number'], len(data['questions'])) for data in slides], [(1, 3), (3, 2)])
+
+    def test_questions_of_other_jobs_are_not_sent(self):
+        """Test that questions saved for the quiz by another job are not streamed as this job's"""
+        stream = GenerationEventStream(self.job)
+        stream.poll()
+        other = GenerationJob.objects.create(quiz=self.quiz, user=self.user, status=GenerationJob.STATUS_RUNNING)
+        save_temp_questions(self.quiz, make_slides_data(num_slides=3, questions_per_slide=1), job=other)
+
+        self.assertNotIn('slide', [event for event, _ in parse_events(stream.poll())])
+
+    def test_async_iteration(self):
+        """Test that the stream can be consumed on an event loop, as it is under ASGI"""
+        async def consume():
+            return [event async for event in GenerationEventStream(self.job, poll_interval=0)]
+
+        events = parse_events(async_to_sync(consume)())
+        self.assertEqual([event for event, _ in events], ['slide', 'slide', 'progress', 'done'])
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_upload_can_stream_its_job(self):
+        """Test that uploading with Accept: text/event-stream streams the queued job instead of returning it"""
+        pdf = SimpleUploadedFile('deck.pdf', b'%PDF-1.4 test', content_type='application/pdf')
+        response = self.client.post(f'/api/quizzes/{self.quiz.id}/upload_pdf/', {'pdf': pdf},
+                                    format='multipart', HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first = next(iter(response.streaming_content))
+        response.close()
+        self.assertEqual(parse_events([first]), [('progress', {'progress': 0, 'total': 0})])
+
+        # a bad Last-Event-ID does not undo the upload of a queued job
+        GenerationJob.objects.filter(status=GenerationJob.STATUS_QUEUED).update(status=GenerationJob.STATUS_FAILED)
+        pdf = SimpleUploadedFile('deck.pdf', b'%PDF-1.4 other', content_type='application/pdf')
+        response = self.client.post(f'/api/quizzes/{self.quiz.id}/upload_pdf/', {'pdf': pdf}, format='multipart',
+                                    HTTP_ACCEPT='text/event-stream', HTTP_LAST_EVENT_ID='not-an-id')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response.close()
+        self.assertEqual(TempPDF.objects.filter(generation_jobs__isnull=False).count(), 2)
+
+    def test_upload_errors_are_sent_as_an_event(self):
+        """Test that a rejected streaming upload still gets a readable error event"""
+        response = self.client.post(f'/api/quizzes/{self.quiz.id}/upload_pdf/', {}, format='multipart',
+                                    HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(parse_events([response.content]), [('error', {'error': 'No PDF file provided'})])
+
+
+class GenerationBackendTest(TestCase):
+    """Test case for the configurable question generation backends"""
+
+    def test_backend_is_chosen_in_settings(self):
+        """Test that get_backend builds the configured backend once, with its options"""
+        backends = {'stub': {'BACKEND': 'quizzes.backends.StubBackend', 'OPTIONS': {'questions_per_slide': 3}}}
+        with override_settings(QUIZ_GENERATION_BACKENDS=backends, QUIZ_GENERATION_BACKEND='stub'):
+            backend = get_backend()
+            self.assertIsInstance(backend, StubBackend)
+            self.assertIs(get_backend(), backend)
+            data = generate_questions(make_slides(2), use_cache=False)
+        self.assertEqual([len(slide['questions']) for slide in data['slides']], [3, 3])
+
+    def test_stub_failures_are_repeatable(self):
+        """Test that injected failures depend only on the prompt and the seed"""
+        def failures(backend):
+            failed = []
+            for slide in make_slides(40):
+                try:
+                    backend.complete(slide, max_tokens=100, temperature=0)
+                except GenerationBackendError:
+                    failed.append(slide)
+            return failed
+
+        first = failures(StubBackend(failure_rate=0.5))
+        self.assertTrue(0 < len(first) < 40)
+        self.assertEqual(first, failures(StubBackend(failure_rate=0.5)))
+
+    def test_stub_only_remembers_recent_prompts(self):
+        """Test that the stub keeps attempt counts for a bounded number of prompts"""
+        backend = StubBackend(max_prompts=5)
+        for slide in make_slides(20):
+            backend.complete(slide, max_tokens=100, temperature=0)
+        self.assertEqual(len(backend._attempts), 5)
+
+    @override_settings(QUIZ_PACKING={'MAX_SLIDES': 1})
+    def test_replay_answers_from_a_recording(self):
+        """Test that a recorded run is replayed without calling the recorded backend again"""
+        path = os.path.join(tempfile.mkdtemp(), 'replays', 'recording.jsonl')
+        backends = {
+            'stub': {'BACKEND': 'quizzes.backends.StubBackend'},
+            'record': {'BACKEND': 'quizzes.backends.ReplayBackend', 'OPTIONS': {'path': path, 'record': 'stub'}},
+            'replay': {'BACKEND': 'quizzes.backends.ReplayBackend', 'OPTIONS': {'path': path}},
+        }
+        with override_settings(QUIZ_GENERATION_BACKENDS=backends, QUIZ_GENERATION_BACKEND='record'):
+            recorded = generate_questions(make_slides(2), use_cache=False)
+            self.assertEqual(get_backend('stub').calls, 2)
+        with override_settings(QUIZ_GENERATION_BACKENDS=backends, QUIZ_GENERATION_BACKEND='replay'):
+            self.assertEqual(generate_questions(make_slides(2), use_cache=False), recorded)
+            self.assertEqual(generate_questions(make_slides(3), use_cache=False)['failed_slides'], [3])
+
+    def test_urls_do_not_import_generation_dependencies(self):
+        """Test that loading the URLconf leaves the LLM SDK and PDF library unimported"""
+        code = ("import django, sys; django.setup(); import quiz_api.urls; "
+                "print(sorted(name for name in ('anthropic', 'PyPDF2') if name in sys.modules))")
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'quiz_api.settings'}).stdout
+        self.assertEqual(output.strip(), '[]')
+
+
+class BenchmarkTest(TestCase):
+    """Test case for the offline generation benchmark"""
+
+    def test_report_covers_every_stage(self):
+        """Test that a benchmark run reports each stage and leaves no rows behind"""
+        report = run_benchmarks([4], latency=0)
+
+        stages = report['decks']['4']
+        self.assertEqual(list(stages), ['extraction', 'generation', 'persistence', 'pipeline'])
+        self.assertEqual(stages['extraction']['slides'], 4)
+        self.assertEqual(stages['generation']['llm_calls'], 1)
+        self.assertEqual(stages['persistence']['questions'], 4)
+        self.assertIsNotNone(stages['pipeline']['time_to_first_question'])
+        self.assertTrue(all(stage['peak_rss_mb'] > 0 for stage in stages.values()))
+        json.dumps(report)
+        self.assertFalse(Quiz.objects.exists())
+        self.assertFalse(TempQuestion.objects.exists())
+
+    def test_compare_to_baseline_flags_regressions(self):
+        """Test that only metrics that grew beyond the tolerance are regressions"""
+        baseline = {'decks': {'10': {'pipeline': {'seconds': 1.0, 'queries': 40, 'llm_calls': 2}}}}
+        report = {'decks': {'10': {'pipeline': {'seconds': 1.5, 'queries': 40, 'llm_calls': 1}},
+                            '100': {'pipeline': {'seconds': 9.0}}}}
+
+        rows = compare_to_baseline(report, baseline, tolerance=0.2)
+        self.assertEqual([(metric, regressed) for _, _, metric, _, _, _, regressed in rows],
+                         [('seconds', True), ('queries', False), ('llm_calls', False)])
+
+    def test_search_benchmark_rolls_back(self):
+        """Test that the search benchmark reports latencies and leaves no rows behind"""
+        report = benchmark_search(300, questions_per_quiz=30, num_queries=6, vocabulary_size=200)
+        self.assertEqual((report['questions'], report['quizzes']), (300, 10))
+        self.assertLessEqual(report['search_ms']['p50'], report['search_ms']['max'])
+        self.assertFalse(Quiz.objects.exists())
+        self.assertFalse(Question.objects.exists())
+
+
+class LLMGuardTest(TestCase):
+    """Test case for rate limiting, retrying and circuit breaking of LLM calls"""
+
+    def setUp(self):
+        reset_guard_stats()
+
+    def test_limiter_is_shared_through_its_state_file(self):
+        """Test that two limiters on the same file, as in two worker processes, draw from one bucket"""
+        path = os.path.join(tempfile.mkdtemp(), 'limits.json')
+        first = TokenBucketLimiter(path, requests_per_minute=600, tokens_per_minute=60000)
+        second = TokenBucketLimiter(path, requests_per_minute=600, tokens_per_minute=60000)
+
+        # a fake clock that sleeping moves forward
+        clock = [time.time()]
+        with mock.patch('quizzes.llm_guard.time.time', side_effect=lambda: clock[0]), \
+                mock.patch('quizzes.llm_guard.time.sleep', side_effect=lambda seconds: clock.append(clock.pop() + seconds)):
+            first.acquire(tokens=59000)
+            second.acquire(tokens=500)
+            self.assertEqual(guard_stats()['limiter_waits'], 0)
+            # the token bucket has 500 left and refills 1000 a second, so 2000 takes 1.5 seconds
+            waited = second.acquire(tokens=2000)
+
+        self.assertAlmostEqual(waited, 1.5, places=1)
+        self.assertEqual(guard_stats()['limiter_waits'], 1)
+
+    def test_transient_failures_are_retried(self):
+        """Test that retryable errors are retried until the call succeeds"""
+        backend = StubBackend(failure_rate=0.5)
+        backend.guard = LLMGuard(attempts=10, base_delay=0)
+        with use_backend(backend), override_settings(QUIZ_PACKING={'MAX_SLIDES': 1}):
+            data = generate_questions(make_slides(8), use_cache=False)
+
+        self.assertEqual(data['failed_slides'], [])
+        self.assertEqual(len(data['slides']), 8)
+        self.assertEqual(guard_stats()['retries'], backend.calls - 8)
+        self.assertGreater(guard_stats()['retries'], 0)
+
+    def test_permanent_failures_are_not_retried(self):
+        """Test that an error the provider will repeat is raised straight away"""
+        backend = StubBackend(fail_on=[1])
+        backend.guard = LLMGuard(attempts=5, base_delay=0)
+        with self.assertRaises(GenerationBackendError):
+            backend.request(make_slides(1)[0], max_tokens=100, temperature=0)
+        self.assertEqual(backend.calls, 1)
+
+    def test_circuit_breaker_fails_fast_then_tries_again(self):
+        """Test that the breaker rejects calls after repeated failures and closes after a good trial call"""
+        backend = StubBackend(failure_rate=1)
+        backend.guard = LLMGuard(breaker=CircuitBreaker(failures=2, reset_after=0.05))
+        prompt = make_slides(1)[0]
+
+        for _ in range(2):
+            with self.assertRaises(GenerationBackendError):
+                backend.request(prompt, max_tokens=100, temperature=0)
+        with self.assertRaises(CircuitOpenError):
+            backend.request(prompt, max_tokens=100, temperature=0)
+        self.assertEqual(backend.calls, 2)
+
+        time.sleep(0.06)
+        backend.failure_rate = 0
+        backend.request(prompt, max_tokens=100, temperature=0)
+        backend.request(prompt, max_tokens=100, temperature=0)
+        self.assertEqual(backend.calls, 4)
+        self.assertEqual(guard_stats()['circuit_rejected'], 1)
+
+    def test_trial_stream_closed_early_lets_the_next_trial_through(self):
+        """Test that a trial stream its consumer stops reading does not keep the circuit open for good"""
+        backend = StubBackend(failure_rate=1, chunk_size=10)
+        breaker = CircuitBreaker(failures=1, reset_after=0.05)
+        backend.guard = LLMGuard(breaker=breaker)
+        prompt = make_slides(1)[0]
+        with self.assertRaises(GenerationBackendError):
+            backend.request(prompt, max_tokens=100, temperature=0)
+
+        time.sleep(0.06)
+        backend.failure_rate = 0
+        stream = backend.request_stream(prompt, max_tokens=100, temperature=0)
+        next(stream)
+        stream.close()
+
+        backend.request(prompt, max_tokens=100, temperature=0)
+        self.assertIsNone(breaker.opened_at)
+        self.assertEqual(guard_stats()['circuit_rejected'], 0)
+
+    def test_streams_are_not_retried_once_text_was_received(self):
+        """Test that a stream cut off midway is raised to the caller with the text it already got"""
+        backend = StubBackend(cut_off_on=[1], chunk_size=10)
+        backend.guard = LLMGuard(attempts=5, base_delay=0)
+        received = []
+        with self.assertRaises(GenerationBackendError):
+            for chunk in backend.request_stream(make_slides(1)[0], max_tokens=100, temperature=0):
+                received.append(chunk)
+        self.assertEqual(backend.calls, 1)
+        self.assertTrue(received)
+        self.assertEqual(guard_stats()['retries'], 0)
+
+
+class TokenBudgetTest(TestCase):
+    """Test case for keeping prompts and output budgets small"""
+
+    def test_oversized_slides_are_split_between_bullets(self):
+        """Test that a large slide is split into parts that fit, without breaking bullets"""
+        bullets = [f"- point {n}: " + ' '.join(f'detail{n}x{w}' for w in range(30)) for n in range(10)]
+        slide = "Slide 4\n\n" + '\n'.join(bullets) + '\n'
+
+        parts = split_slide(slide, max_tokens=150)
+
+        self.assertGreater(len(parts), 1)
+        self.assertTrue(all(estimate_tokens(part) <= 150 for part in parts))
+        self.assertTrue(all(part.startswith('Slide 4\n\n') for part in parts))
+        self.assertEqual([line for part in parts for line in part.split('\n')[2:] if line], bullets)
+        self.assertEqual(split_slide("Slide 1\n\nshort\n", max_tokens=150), ["Slide 1\n\nshort\n"])
+
+    def test_long_paragraphs_are_split_between_sentences(self):
+        """Test that text without line breaks is split at sentence ends"""
+        sentences = [' '.join(f'word{n}x{w}' for w in range(20)) + '.' for n in range(8)]
+        parts = split_slide('Slide 2\n\n' + ' '.join(sentences), max_tokens=100)
+
+        self.assertGreater(len(parts), 1)
+        self.assertTrue(all(part.rstrip().endswith('.') for part in parts))
+
+    def test_repeated_headers_footers_and_page_numbers_are_trimmed(self):
+        """Test that boilerplate lines are dropped once they repeat, and content is kept"""
+        trimmer = BoilerplateTrimmer(min_repeats=3)
+        cleaned = [
+            trimmer.clean(f"CS2102 Database Systems\nTopic {n} content line\nMore on topic {n}\n{n + 1}")
+            for n in range(5)
+        ]
+
+        self.assertEqual(cleaned[0], "CS2102 Database Systems\nTopic 0 content line\nMore on topic 0")
+        self.assertEqual(cleaned[4], "Topic 4 content line\nMore on topic 4")
+
+    def test_slides_within_budget_are_not_trimmed(self):
+        """Test that only slides over the token budget lose their boilerplate, blank lines included"""
+        trimmer = BoilerplateTrimmer(min_repeats=2, max_tokens=30)
+        short = [f"CS2102 Database Systems\n\nTopic {n}\n{n + 1}" for n in range(3)]
+        self.assertEqual([trimmer.clean(text) for text in short], short)
+
+        long = "CS2102 Database Systems\n\n" + ' '.join(f'word{w}' for w in range(40)) + "\n4"
+        self.assertEqual(trimmer.clean(long), ' '.join(f'word{w}' for w in range(40)))
+
+    @override_settings(QUIZ_TOKEN_BUDGET={'MAX_SLIDE_TOKENS': 60}, QUIZ_PACKING={'MAX_SLIDES': 6})
+    def test_split_slides_are_generated_in_parts(self):
+        """Test that the parts of a split slide get their own requests, sized by the questions expected"""
+        requests = []
+
+        class RecordingBackend(StubBackend):
+            def stream(self, prompt, max_tokens, temperature, **kwargs):
+                requests.append((self.SLIDE_PATTERN.findall(prompt), max_tokens))
+                return super().stream(prompt, max_tokens, temperature, **kwargs)
+
+        long_slide = "Slide 1\n\n" + '\n'.join(f"- item{n} " + ' '.join(f'w{n}x{w}' for w in range(20))
+                                                for n in range(6))
+        progress = []
+        with use_backend(RecordingBackend()):
+            data = generate_questions([long_slide, make_slides(2)[1]], use_cache=False,
+                                      progress_callback=lambda done, seen: progress.append((done, seen)))
+
+        self.assertGreater(len(requests), 2)
+        self.assertTrue(all(numbers.count('1') <= 1 for numbers, _ in requests))
+        self.assertEqual(data['slides'][0]['slide_number'], 1)
+        self.assertEqual(len(data['slides'][0]['questions']), len(requests) - 1)
+        self.assertEqual(progress[-1], (2, 2))
+        self.assertTrue(all(max_tokens < 4000 for _, max_tokens in requests))
+
+
+@override_settings(QUIZ_PACKING={'MAX_SLIDES': 1}, QUIZ_TRACING={'PATH': None})
+class PromptCachingTest(APITestCase):
+    """Test case for caching the shared instructions with the LLM provider"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.quiz = Quiz.objects.create(title='Test Quiz', creator=self.user)
+        # the stub caches what the configured model caches
+        self.configured = AnthropicBackend(**settings.QUIZ_GENERATION_BACKENDS['default']['OPTIONS'])
+        self.backend = StubBackend(cache_min_tokens=self.configured.cache_min_tokens)
+
+    def test_instructions_are_written_once_and_read_after(self):
+        """Test that only the first request pays for writing the system prompt to the cache"""
+        usage = TokenUsage()
+        with use_backend(self.backend):
+            generate_questions(make_slides(4), use_cache=False, concurrency=1, usage=usage)
+
+        system_tokens = estimate_tokens(SYSTEM_PROMPT)
+        totals = usage.as_dict()
+        self.assertEqual(totals['requests'], 4)
+        self.assertEqual(totals['cache_write_tokens'], system_tokens)
+        self.assertEqual(totals['cache_read_tokens'], 3 * system_tokens)
+        # only the slides are paid for as regular input
+        self.assertLess(totals['input_tokens'], system_tokens)
+
+    def test_job_records_its_token_usage(self):
+        """Test that a generation job stores the tokens its requests used, cache reads included"""
+        pdf = SimpleUploadedFile('deck.pdf', build_pdf(lecture_pages(3)), content_type='application/pdf')
+        self.client.post(f'/api/quizzes/{self.quiz.id}/upload_pdf/', {'pdf': pdf}, format='multipart')
+        with use_backend(self.backend):
+            job = run_job(claim_next_job('test-worker'))
+
+        self.assertEqual(job.status, GenerationJob.STATUS_SUCCEEDED)
+        response = self.client.get(f'/api/quizzes/{self.quiz.id}/generation_jobs/{job.id}/')
+        self.assertEqual(response.data['cache_write_tokens'], estimate_tokens(SYSTEM_PROMPT))
+        self.assertEqual(response.data['cache_read_tokens'], 2 * estimate_tokens(SYSTEM_PROMPT))
+        self.assertGreater(response.data['input_tokens'], 0)
+        self.assertGreater(response.data['output_tokens'], 0)
+
+    def test_anthropic_request_marks_the_system_prompt_cacheable(self):
+        """Test that the instructions are sent as a cacheable system block and cache usage is read back"""
+        backend = AnthropicBackend()
+        backend._client = mock.Mock()
+        backend._client.messages.create.return_value = mock.Mock(
+            content=[mock.Mock(text='{"slides": []}')],
+            usage=mock.Mock(input_tokens=40, output_tokens=10, cache_creation_input_tokens=0,
+                            cache_read_input_tokens=900),
+        )
+
+        completion = backend.complete('Slide 1', max_tokens=100, temperature=0, system=SYSTEM_PROMPT)
+
+        request = backend._client.messages.create.call_args.kwargs
+        self.assertEqual(request['system'], [{'type': 'text', 'text': SYSTEM_PROMPT,
+                                              'cache_control': {'type': 'ephemeral'}}])
+        self.assertEqual(request['messages'], [{'role': 'user', 'content': 'Slide 1'}])
+        self.assertEqual(completion.usage['cache_read_tokens'], 900)
+        self.assertEqual(completion.usage['input_tokens'], 40)
+        # short of it, the marker would be ignored
+        self.assertEqual(self.configured.cache_min_tokens, 2048)
+        self.assertGreaterEqual(estimate_tokens(SYSTEM_PROMPT), self.configured.cache_min_tokens)
+
+
+class StreamedGenerationTest(TestCase):
+    """Test case for parsing and saving questions while the LLM answer streams in"""
+
+    def test_parser_yields_each_question_when_it_closes(self):
+        """Test that questions come out of the parser as soon as their closing brace arrives"""
+        question = {'question_text': 'Which {brace} "quote"?', 'options': {'A': 'x', 'B': 'y'}, 'correct_answer': 'A'}
+        answer = '```json\n' + json.dumps({'slides': [
+            {'slide_number': 1, 'questions': [question, question]},
+            {'questions': [question], 'slide_number': '4'},
+        ]})
+        first_end = answer.index('}, {"question_text"') + 1
+
+        parser = QuestionStreamParser()
+        self.assertEqual(parser.feed(answer[:first_end - 1]), [])
+        self.assertEqual(parser.feed(answer[first_end - 1:first_end]), [(1, question)])
+        # the third question is held until its slide's number, written after it, has been read
+        self.assertEqual(parser.feed(answer[first_end:]), [(1, question), (4, question)])
+
+    def test_questions_arrive_before_the_answer_is_finished(self):
+        """Test that the pipeline yields streamed questions while the LLM call is still running"""
+        release = threading.Event()
+
+        class HoldingBackend(StubBackend):
+            def stream(self, *args, **kwargs):
+                yield from super().stream(*args, **kwargs)
+                release.wait(5)
+
+        with use_backend(HoldingBackend(questions_per_slide=2, chunk_size=16)):
+            results = iter_generated_questions(make_slides(1), use_cache=False)
+            first = next(results)
+            self.assertFalse(release.is_set())
+            self.assertTrue(first['questions'])
+            release.set()
+            rest = list(results)
+
+        self.assertEqual(len(first['questions']) + sum(len(result['questions']) for result in rest), 2)
+        self.assertEqual(rest[-1]['questions'], [])
+        self.assertIsNone(rest[-1]['error'])
+
+    @override_settings(QUIZ_PACKING={'MAX_SLIDES': 1})
+    def test_questions_of_a_cut_off_answer_are_kept(self):
+        """Test that the questions parsed before a stream broke off are saved, and the slide reported failed"""
+        user = User.objects.create_user(username='testuser', password='12345')
+        quiz = Quiz.objects.create(title='Test Quiz', creator=user)
+        slides = make_slides(3)
+
+        with use_backend(StubBackend(questions_per_slide=4, cut_off_on=[2], chunk_size=10)), \
+                mock.patch('quizzes.pdf_processor.iter_slides_from_pdf', return_value=iter(slides)):
+            saved = process_pdf_and_generate_questions('deck.pdf', quiz)
+
+        per_slide = {number: TempQuestion.objects.filter(quiz=quiz, slide_number=number).count() for number in (1, 2, 3)}
+        self.assertEqual((per_slide[1], per_slide[3]), (4, 4))
+        self.assertTrue(0 < per_slide[2] < 4)
+        self.assertEqual(saved, sum(per_slide.values()))
+        # the partial answer is not cached
+        self.assertEqual(CachedSlideQuestions.objects.count(), 2)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), QUIZ_PACKING={'MAX_SLIDES': 1}, QUIZ_TRACING={'PATH': None})
+class DeckRevisionTest(APITestCase):
+    """Test case for regenerating only the slides a re-uploaded deck changed"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.quiz = Quiz.objects.create(title='Test Quiz', creator=self.user)
+        self.pages = lecture_pages(60)
+        self.upload_and_process(self.pages)
+        # the instructor keeps the questions of two slides
+        picked = TempQuestion.objects.filter(slide_number__in=[10, 30]).values_list('id', flat=True)
+        self.client.post(f'/api/quizzes/{self.quiz.id}/add_selected_questions/', {'question_ids': list(picked)},
+                         format='json')
+
+    def upload_and_process(self, pages, backend=None):
+        pdf = SimpleUploadedFile('deck.pdf', build_pdf(pages), content_type='application/pdf')
+        self.client.post(f'/api/quizzes/{self.quiz.id}/upload_pdf/', {'pdf': pdf}, format='multipart')
+        backend = backend or StubBackend()
+        with use_backend(backend):
+            job = run_job(claim_next_job('test-worker'))
+        self.assertEqual(job.status, GenerationJob.STATUS_SUCCEEDED)
+        return self.client.get(f'/api/quizzes/{self.quiz.id}/generation_jobs/{job.id}/').data, backend.calls
+
+    @staticmethod
+    def edit(page):
+        return page[:3] + ['an edited line with a few new words'] + page[4:]
+
+    def test_edited_slides_are_the_only_ones_regenerated(self):
+        """Test that a two slide edit costs two LLM calls and keeps every other question"""
+        pages = list(self.pages)
+        pages[9], pages[39] = self.edit(pages[9]), self.edit(pages[39])
+
+        job, calls = self.upload_and_process(pages)
+
+        self.assertEqual(calls, 2)
+        self.assertEqual(job['num_questions'], 2)
+        diff = job['diff']
+        self.assertEqual((diff['unchanged'], diff['changed'], diff['added'], diff['removed']), (58, [10, 40], [], []))
+        self.assertEqual((diff['temp_questions_carried_over'], diff['temp_questions_dropped']), (57, 1))
+        self.assertEqual(diff['questions_to_review'], 1)
+        self.assertEqual(TempQuestion.objects.filter(quiz=self.quiz).count(), 59)
+        self.assertEqual(TempQuestion.objects.filter(slide_number=40).count(), 1)
+        self.assertEqual(sorted(Question.objects.values_list('slide_number', flat=True)), [10, 30])
+
+    def test_questions_follow_their_slides_when_slides_move(self):
+        """Test that inserting and removing slides renumbers the carried over questions"""
+        pages = list(self.pages)
+        del pages[49]
+        pages.insert(20, ['Lecture page 99'] + [' '.join(f'brandnew{w}' for w in range(10))] * 3)
+
+        job, calls = self.upload_and_process(pages)
+
+        self.assertEqual(calls, 1)
+        self.assertEqual((job['diff']['added'], job['diff']['removed']), ([21], [50]))
+        moved = TempQuestion.objects.get(text__startswith='Which statement appears on slide 45?')
+        self.assertEqual(moved.slide_number, 46)
+        self.assertFalse(TempQuestion.objects.filter(text__startswith='Which statement appears on slide 50?').exists())
+        promoted = dict(Question.objects.values_list('text', 'slide_number'))
+        self.assertEqual(sorted(promoted.values()), [10, 31])
+
+        # uploading the same deck again changes nothing
+        job, calls = self.upload_and_process(pages)
+        self.assertEqual((calls, job['diff']['unchanged'], job['diff']['temp_questions_dropped']), (0, 60, 0))
+
+    def test_only_the_previous_jobs_questions_are_carried_over(self):
+        """Test that leftovers of other jobs are not renumbered, and a quiz runs one job at a time"""
+        failed = GenerationJob.objects.create(quiz=self.quiz, user=self.user, status=GenerationJob.STATUS_FAILED)
+        leftover = TempQuestion.objects.create(quiz=self.quiz, job=failed, text='Leftover', slide_number=45)
+        pages = list(self.pages)
+        del pages[0]
+
+        pdf = SimpleUploadedFile('deck.pdf', build_pdf(pages), content_type='application/pdf')
+        self.client.post(f'/api/quizzes/{self.quiz.id}/upload_pdf/', {'pdf': pdf}, format='multipart')
+        pdf = SimpleUploadedFile('other.pdf', build_pdf(self.pages), content_type='application/pdf')
+        response = self.client.post(f'/api/quizzes/{self.quiz.id}/upload_pdf/', {'pdf': pdf}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(TempPDF.objects.filter(quiz=self.quiz).count(), 2)
+
+        with use_backend(StubBackend()):
+            job = run_job(claim_next_job('test-worker'))
+        self.assertEqual(job.diff['temp_questions_carried_over'], 57)
+        self.assertEqual(TempQuestion.objects.filter(job=job).count(), 57 + job.num_questions)
+        leftover.refresh_from_db()
+        self.assertEqual((leftover.slide_number, leftover.job_id), (45, failed.pk))
+
+    def test_carried_over_questions_are_not_swept_with_the_old_upload(self):
+        """Test that the questions a re-upload keeps expire with it"""
+        TempQuestion.objects.update(created_at=timezone.now() - timedelta(days=8))
+        pages = list(self.pages)
+        pages[19] = self.edit(pages[19])
+        job, _ = self.upload_and_process(pages)
+
+        report = sweep_expired_temp_data(include_files=False)
+        self.assertEqual(report['temp_questions'], 0)
+        self.assertEqual(TempQuestion.objects.filter(job_id=job['id']).count(), 58)
+
+    @override_settings(QUIZ_PACKING={'MAX_SLIDES': 1})
+    def test_slides_without_questions_are_generated_again(self):
+        """Test that re-uploading a deck fills in the slides that failed or lost their questions"""
+        self.quiz = Quiz.objects.create(title='Other Quiz', creator=self.user)
+        # not the cached slides of the other quiz
+        pages = lecture_pages(10, words_per_page=50)
+        job, calls = self.upload_and_process(pages, StubBackend(fail_on=[3]))
+        self.assertEqual((calls, job['failed_slides']), (10, [3]))
+
+        # the provider is back
+        job, calls = self.upload_and_process(pages)
+        self.assertEqual(calls, 1)
+        self.assertEqual((job['diff']['unchanged'], job['diff']['changed'], job['failed_slides']), (9, [3], []))
+        self.assertEqual(TempQuestion.objects.filter(quiz=self.quiz, slide_number=3).count(), 1)
+
+        # slide 5 is answered from the question cache this time
+        TempQuestion.objects.filter(quiz=self.quiz, slide_number=5).delete()
+        job, calls = self.upload_and_process(pages)
+        self.assertEqual((calls, job['diff']['changed']), (0, [5]))
+        self.assertEqual(TempQuestion.objects.filter(quiz=self.quiz).count(), 10)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), QUIZ_PACKING={'MAX_SLIDES': 2})
+class GenerationTraceTest(APITestCase):
+    """Test case for tracing generation jobs stage by stage"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.quiz = Quiz.objects.create(title='Test Quiz', creator=self.user)
+        self.path = os.path.join(tempfile.mkdtemp(), 'traces.jsonl')
+
+    def run_upload(self, backend):
+        pdf = SimpleUploadedFile('deck.pdf', build_pdf(lecture_pages(6)), content_type='application/pdf')
+        self.client.post(f'/api/quizzes/{self.quiz.id}/upload_pdf/', {'pdf': pdf}, format='multipart')
+        with use_backend(backend), override_settings(QUIZ_TRACING={'PATH': self.path}):
+            return run_job(claim_next_job('test-worker'))
+
+    def test_job_stores_a_summary_of_its_trace(self):
+        """Test that the summary covers the stages, every slide and the tokens used"""
+        job = self.run_upload(StubBackend(fail_on=[3]))
+
+        summary = self.client.get(f'/api/quizzes/{self.quiz.id}/generation_jobs/{job.id}/').data['trace_summary']
+        stages = {stage['path']: stage for stage in summary['stages']}
+        for path in ['generation_job', 'generation_job/extract', 'generation_job/save', 'generation_job/slide',
+                     'generation_job/llm_batch/llm', 'generation_job/carry_over']:
+            self.assertIn(path, stages)
+        self.assertEqual(stages['generation_job/slide']['count'], 6)
+        self.assertEqual(stages['generation_job/llm_batch']['errors'], 1)
+        self.assertEqual(summary['slides'], {'generated': 4, 'failed': 2})
+        self.assertEqual(summary['tokens']['input_tokens'], job.input_tokens)
+
+    def test_job_stores_what_the_llm_guard_did(self):
+        """Test that the retries of a job's LLM calls are stored on the job, not only counted in the worker"""
+        reset_guard_stats()
+        backend = StubBackend(failure_rate=0.5)
+        backend.guard = LLMGuard(attempts=10, base_delay=0)
+        job = self.run_upload(backend)
+
+        stats = self.client.get(f'/api/quizzes/{self.quiz.id}/generation_jobs/{job.id}/').data['guard_stats']
+        self.assertEqual(job.status, GenerationJob.STATUS_SUCCEEDED)
+        self.assertGreater(stats['retries'], 0)
+        self.assertEqual(stats['retries'], guard_stats()['retries'])
+        self.assertEqual(stats['circuit_rejected'], 0)
+
+    def test_trace_is_exported_and_printed(self):
+        """Test that the exported spans can be loaded back and shown as a breakdown"""
+        job = self.run_upload(StubBackend())
+
+        spans = load_trace(self.path, job_trace_id(job.pk, 1))
+        self.assertEqual(summarize(spans), job.trace_summary)
+
+        out = StringIO()
+        call_command('show_generation_trace', job.pk, path=self.path, stdout=out)
+        output = out.getvalue()
+        self.assertIn('  extract', output)
+        self.assertIn('    llm', output)
+        self.assertIn('Slides: 6 generated', output)
+
+        # a retry is traced apart from the first attempt
+        GenerationJob.objects.filter(pk=job.pk).update(status=GenerationJob.STATUS_QUEUED)
+        with use_backend(StubBackend()), override_settings(QUIZ_TRACING={'PATH': self.path}):
+            retried = run_job(claim_next_job('test-worker'))
+        self.assertEqual(retried.attempts, 2)
+        self.assertEqual(load_trace(self.path, job_trace_id(job.pk, 1)), spans)
+        self.assertEqual(summarize(load_trace(self.path, job_trace_id(job.pk, 2))), retried.trace_summary)
+        out = StringIO()
+        call_command('show_generation_trace', job.pk, path=self.path, stdout=out)
+        self.assertIn('Slides: 6 cached', out.getvalue())
+
+        # without the file, the summary stored on the job is shown
+        os.remove(self.path)
+        out = StringIO()
+        call_command('show_generation_trace', job.pk, path=self.path, stdout=out)
+        self.assertIn('  extract', out.getvalue())
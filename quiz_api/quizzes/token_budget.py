@@ -0,0 +1,144 @@
+# quizzes/token_budget.py
+
+"""
+Keeping prompts small: a fast local token estimate, splitting of slides that are too large for one
+prompt, trimming of headers, footers and page numbers repeated on every page, and an output budget
+sized to the number of questions asked for.
+"""
+
+import re
+from collections import Counter
+
+# words and numbers, or single punctuation characters, roughly what a BPE tokenizer splits on
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+SLIDE_HEADER_PATTERN = re.compile(r'^(Slide \d+)\n\n', re.MULTILINE)
+BULLET_PATTERN = re.compile(r'^\s*(?:[-*•▪‣◦o]|\d+[.)]|[a-z][.)])\s+')
+SENTENCE_PATTERN = re.compile(r'(?<=[.!?;:])\s+')
+PAGE_NUMBER_PATTERN = re.compile(r'^\s*(?:page|slide|p\.)?\s*\d+\s*(?:(?:/|of)\s*\d+)?\s*$', re.IGNORECASE)
+
+
+def estimate_tokens(text):
+    """
+    Estimate the tokens of `text` without a tokenizer: one per word or punctuation mark, plus one
+    for every six characters of long words, which BPE vocabularies split into several pieces.
+    """
+    return sum(1 + (len(piece) - 1) // 6 for piece in TOKEN_PATTERN.findall(text)) + 1
+
+
+def max_output_tokens(num_slides, questions_per_slide=3, tokens_per_question=120, overhead=50, limit=4000):
+    """
+    max_tokens for a request asking for up to `questions_per_slide` questions on each of `num_slides`
+    slides, so small requests do not reserve a large output budget.
+    """
+    return min(limit, overhead + num_slides * (40 + questions_per_slide * tokens_per_question))
+
+
+def _split_long_unit(unit, max_tokens):
+    """Split a line that is too long at sentence ends, and at word boundaries as a last resort"""
+    pieces = []
+    for sentence in SENTENCE_PATTERN.split(unit):
+        if estimate_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+        words = sentence.split()
+        chunk = []
+        for word in words:
+            if chunk and estimate_tokens(' '.join(chunk + [word])) > max_tokens:
+                pieces.append(' '.join(chunk))
+                chunk = []
+            chunk.append(word)
+        if chunk:
+            pieces.append(' '.join(chunk))
+    return pieces
+
+
+def _units(body):
+    """Lines of the slide body, with wrapped continuation lines joined back onto their bullet"""
+    units = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        if units and not BULLET_PATTERN.match(line) and not re.search(r'[.!?:;]\s*$', units[-1]):
+            units[-1] = f"{units[-1]} {line.strip()}"
+        else:
+            units.append(line.rstrip())
+    return units
+
+
+def split_slide(slide, max_tokens):
+    """
+    Split a slide of more than `max_tokens` estimated tokens into parts that fit, breaking between
+    bullets or sentences where possible. Every part keeps the "Slide N" header, so its questions
+    are still attributed to the slide. Slides that fit are returned as they are.
+    """
+    if estimate_tokens(slide) <= max_tokens:
+        return [slide]
+
+    match = SLIDE_HEADER_PATTERN.match(slide)
+    header = match.group(1) if match else None
+    body = slide[match.end():] if match else slide
+    budget = max_tokens - (estimate_tokens(header) if header else 0)
+
+    units = []
+    for unit in _units(body):
+        units.extend([unit] if estimate_tokens(unit) <= budget else _split_long_unit(unit, budget))
+
+    parts = []
+    current = []
+    current_tokens = 0
+    for unit in units:
+        tokens = estimate_tokens(unit)
+        if current and current_tokens + tokens > budget:
+            parts.append(current)
+            current = []
+            current_tokens = 0
+        current.append(unit)
+        current_tokens += tokens
+    if current:
+        parts.append(current)
+
+    text_parts = ['\n'.join(part) for part in parts]
+    return [f"{header}\n\n{text}\n" for text in text_parts] if header else text_parts
+
+
+class BoilerplateTrimmer:
+    """
+    Removes page numbers and the header and footer lines a deck repeats on its pages, such as the
+    course name or "Lecture 5 | Page 12", from a stream of slide texts.
+
+    Only the first and last `edge_lines` lines of a slide are candidates. Lines are compared with
+    standalone numbers masked, and a line is boilerplate once it has been seen on `min_repeats` slides; the
+    first few occurrences are kept, as the trimmer cannot look ahead in a stream.
+
+    With `max_tokens`, only slides estimated over it are trimmed, and the others are passed through
+    exactly as they are, so the model sees the slide as written whenever it fits.
+    """
+
+    def __init__(self, min_repeats=3, edge_lines=1, max_tokens=None):
+        self.min_repeats = min_repeats
+        self.edge_lines = edge_lines
+        self.max_tokens = max_tokens
+        self.seen = Counter()
+
+    @staticmethod
+    def _normalize(line):
+        return re.sub(r'\b\d+\b', '#', ' '.join(line.lower().split()))
+
+    def clean(self, text):
+        lines = [line for line in text.splitlines() if line.strip()]
+        edges = set(range(min(self.edge_lines, len(lines))))
+        edges.update(range(max(0, len(lines) - self.edge_lines), len(lines)))
+
+        # every slide counts towards what repeats, trimmed or not
+        for normalized in {self._normalize(lines[index]) for index in edges}:
+            self.seen[normalized] += 1
+        if self.max_tokens is not None and estimate_tokens(text) <= self.max_tokens:
+            return text
+
+        kept = []
+        for index, line in enumerate(lines):
+            if index in edges and (PAGE_NUMBER_PATTERN.match(line)
+                                   or self.seen[self._normalize(line)] >= self.min_repeats):
+                continue
+            kept.append(line)
+        return '\n'.join(kept)
@@ -0,0 +1,239 @@
+# quizzes/tracing.py
+
+"""
+Lightweight span tracing of the generation pipeline. A Tracer collects the spans of one generation
+job in memory: the stages of the pipeline, a span per slide and per LLM batch, with their timings,
+token counts and outcome. Finished traces are appended to a JSONL file (QUIZ_TRACING) and
+summarized on the job, and `manage.py show_generation_trace` prints a breakdown of either.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+DEFAULT_TRACING = {
+    'PATH': None,  # JSONL file the spans are appended to, None to keep only the summary
+}
+
+# attributes of the llm_batch spans that are added up in the summary
+TOKEN_ATTRIBUTES = ('input_tokens', 'output_tokens', 'cache_write_tokens', 'cache_read_tokens')
+
+
+def tracing_settings():
+    return {**DEFAULT_TRACING, **getattr(settings, 'QUIZ_TRACING', {})}
+
+
+def job_trace_id(job_id, attempt):
+    """Trace id of an attempt at a generation job, so the spans of a retried job are not mixed up"""
+    return f'job-{job_id}-{attempt}'
+
+
+class Span:
+    """
+    A timed operation. Spans are context managers that record the exception leaving them, or can
+    be ended explicitly when they do not fit a with block, like a slide that is read in one place
+    and finished in another.
+
+    A span made with `aggregate=True` measures only the time spent in its timed() blocks, for stages
+    such as extraction that run in many short steps interleaved with the rest of the pipeline.
+    """
+
+    def __init__(self, tracer, span_id, name, parent_id, attributes, aggregate=False):
+        self.tracer = tracer
+        self.span_id = span_id
+        self.name = name
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.busy = 0.0 if aggregate else None
+        self.seconds = None
+        self.status = 'ok'
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def child(self, name, aggregate=False, **attributes):
+        return self.tracer.start_span(name, parent=self, aggregate=aggregate, **attributes)
+
+    @contextmanager
+    def timed(self):
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.busy += time.perf_counter() - started
+
+    def end(self, error=None):
+        if self.seconds is not None:
+            return
+        if error is not None:
+            self.status = 'error'
+            self.error = str(error)
+        self.seconds = self.busy if self.busy is not None else time.perf_counter() - self._started
+        self.tracer._finish(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end(error=exc_value)
+
+    def as_dict(self):
+        return {
+            'trace_id': self.tracer.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': round(self.start, 6),
+            'seconds': round(self.seconds, 6),
+            'status': self.status,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+class Tracer:
+    """
+    Collects the spans of one trace. Spans started without a parent hang off the first span of the
+    trace, its root. Thread-safe, so spans can be started and ended on the generation thread pool.
+    """
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.root = None
+        self.spans = []
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def start_span(self, name, parent=None, aggregate=False, **attributes):
+        with self._lock:
+            span_id = self._next_id
+            self._next_id += 1
+            parent_id = parent.span_id if parent is not None else getattr(self.root, 'span_id', None)
+            span = Span(self, span_id, name, parent_id, attributes, aggregate=aggregate)
+            if self.root is None:
+                self.root = span
+        return span
+
+    # spans are context managers, so starting one in a with block times the block
+    span = start_span
+
+    def _finish(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def as_dicts(self):
+        with self._lock:
+            return sorted((span.as_dict() for span in self.spans), key=lambda span: span['span_id'])
+
+    def summary(self):
+        return summarize(self.as_dicts())
+
+    def export(self, path):
+        """Append the finished spans to the JSONL file at `path`, one line per span"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        lines = ''.join(json.dumps(span) + '\n' for span in self.as_dicts())
+        with open(path, 'a') as trace_file:
+            trace_file.write(lines)
+
+
+class _NullSpan:
+    def set(self, **attributes):
+        pass
+
+    def child(self, name, aggregate=False, **attributes):
+        return self
+
+    @contextmanager
+    def timed(self):
+        yield self
+
+    def end(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class _NullTracer:
+    """Stands in for a Tracer when nothing is traced, so instrumented code needs no checks"""
+    _span = _NullSpan()
+
+    def start_span(self, name, parent=None, aggregate=False, **attributes):
+        return self._span
+
+    span = start_span
+
+
+NULL_TRACER = _NullTracer()
+
+
+def load_trace(path, trace_id):
+    """The spans of `trace_id` in the JSONL file at `path`, or [] if it has none"""
+    spans = []
+    try:
+        with open(path) as trace_file:
+            for line in trace_file:
+                if f'"{trace_id}"' in line:
+                    span = json.loads(line)
+                    if span['trace_id'] == trace_id:
+                        spans.append(span)
+    except FileNotFoundError:
+        pass
+    return spans
+
+
+def summarize(spans, slowest=5):
+    """
+    Summary of a trace, from its spans as dicts: the total time and count of the spans at every path
+    of span names ("generation_job/llm_batch/llm"), in the order they first started, what happened to
+    the slides, the slowest slides and the tokens used.
+    """
+    by_id = {span['span_id']: span for span in spans}
+
+    def path(span):
+        names = [span['name']]
+        while span['parent_id'] in by_id:
+            span = by_id[span['parent_id']]
+            names.append(span['name'])
+        return '/'.join(reversed(names))
+
+    stages = {}
+    for span in sorted(spans, key=lambda span: span['start']):
+        stage = stages.setdefault(path(span), {'path': path(span), 'count': 0, 'seconds': 0.0, 'errors': 0})
+        stage['count'] += 1
+        stage['seconds'] += span['seconds']
+        stage['errors'] += span['status'] == 'error'
+    for stage in stages.values():
+        stage['seconds'] = round(stage['seconds'], 4)
+
+    slides = [span for span in spans if span['name'] == 'slide']
+    tokens = defaultdict(int)
+    for span in spans:
+        if span['name'] == 'llm_batch':
+            for name in TOKEN_ATTRIBUTES:
+                tokens[name] += span['attributes'].get(name, 0)
+
+    roots = [span for span in spans if span['parent_id'] not in by_id]
+    return {
+        'trace_id': spans[0]['trace_id'] if spans else None,
+        'seconds': round(sum(span['seconds'] for span in roots), 4),
+        'stages': list(stages.values()),
+        'slides': dict(Counter(span['attributes'].get('outcome', 'unknown') for span in slides)),
+        'slowest_slides': [
+            {'slide_number': span['attributes'].get('slide_number'), 'seconds': round(span['seconds'], 4),
+             'outcome': span['attributes'].get('outcome')}
+            for span in sorted(slides, key=lambda span: -span['seconds'])[:slowest]
+        ],
+        'tokens': dict(tokens),
+    }
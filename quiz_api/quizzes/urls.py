@@ -17,5 +17,7 @@ urlpatterns = [
     path('<int:quiz_pk>/questions/<int:question_pk>/', include(question_router.urls)),
     path('<int:pk>/upload_pdf/', QuizViewSet.as_view({'post': 'upload_pdf'}), name='quiz-upload-pdf'),
     path('<int:pk>/add_selected_questions/', QuizViewSet.as_view({'post': 'add_selected_questions'}), name='quiz-add-selected-questions'),
+    path('<int:pk>/generation_jobs/<int:job_id>/', QuizViewSet.as_view({'get': 'generation_job'}), name='quiz-generation-job'),
+    path('<int:pk>/generation_jobs/<int:job_id>/events/', QuizViewSet.as_view({'get': 'generation_job_events'}), name='quiz-generation-job-events'),
     path('<int:pk>/temp_questions/', QuizViewSet.as_view({'get': 'temp_questions'}), name='quiz-temp-questions'),
 ]
\ No newline at end of file
@@ -1,23 +1,45 @@
 # quizzes/utils.py
 
-from .models import Question, Answer
+from django.db import transaction
+
+from .models import Question, Answer, TempQuestion
+from .counters import adjust_quiz_counters
+from .search import inverted_index
+
+
+def promote_temp_questions(temp_questions, quiz):
+    """
+    Copy temp questions and their answers into `quiz` with one bulk INSERT per table.
+
+    `temp_questions` should have `temp_answers` prefetched, otherwise every question costs a query.
+    Returns the new questions in the same order.
+    """
+    temp_questions = list(temp_questions)
+    questions = [
+        Question(quiz=quiz, text=temp_question.text, question_type=temp_question.question_type,
+                 slide_number=temp_question.slide_number)
+        for temp_question in temp_questions
+    ]
+
+    with transaction.atomic():
+        Question.objects.bulk_create(questions)
+        Answer.objects.bulk_create([
+            Answer(question=question, text=temp_answer.text, is_correct=temp_answer.is_correct)
+            for question, temp_question in zip(questions, temp_questions)
+            for temp_answer in temp_question.temp_answers.all()
+        ])
+        # bulk_create sends no signals
+        adjust_quiz_counters({quiz.pk: {'question_count': len(questions), 'version': 1}})
+        transaction.on_commit(lambda: inverted_index.mark_changed(quiz.pk))
+
+    return questions
 
 
 def make_permanent(temp_question):
     """
     Function to permanently add the question to the quiz and deletes the temporary question or answers.
     """
-    permanent_question = Question.objects.create(
-        quiz=temp_question.quiz,
-        text=temp_question.text,
-        question_type=temp_question.question_type,
-    )
-
-    for temp_answer in temp_question.temp_answers.all():
-        Answer.objects.create(
-            question=permanent_question,
-            text=temp_answer.text,
-            is_correct=temp_answer.is_correct
-        )
-    temp_question.delete()  # This will also delete associated temp answers
+    with transaction.atomic():
+        permanent_question = promote_temp_questions([temp_question], temp_question.quiz)[0]
+        temp_question.delete()  # This will also delete associated temp answers
     return permanent_question
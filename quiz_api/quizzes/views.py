@@ -1,31 +1,131 @@
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from rest_framework import viewsets, permissions, status
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
 from .models import Quiz, Question, Answer
-from .serializers import QuizSerializer, QuestionSerializer, AnswerSerializer
+from .serializers import (QuizSerializer, QuizSummarySerializer, QuizSearchResultSerializer, QuestionSerializer,
+                          AnswerSerializer)
+from .pagination import QuizCursorPagination, SearchPagination
+from .quiz_cache import get_quiz_payload, quiz_etag
+from .search import search_quizzes
+from .facets import category_scope, difficulty_scope, get_facets
 
 # for the pdf upload and quiz generation
 from rest_framework.decorators import action
-from .models import TempPDF, TempQuestion
-from .serializers import TempQuestionSerializer
-from .pdf_processor import process_pdf_and_generate_questions
+from rest_framework.settings import api_settings
+from .models import TempPDF, TempQuestion, GenerationJob
+from .serializers import TempQuestionSerializer, GenerationJobSerializer
+from .jobs import GenerationInProgress, enqueue_generation_job
+from .events import EventStreamRenderer, event_stream_response
+from documents.storage import store_pdf, release_blob
+from .utils import promote_temp_questions
 
 
 class QuizViewSet(viewsets.ModelViewSet):
     queryset = Quiz.objects.all()
     serializer_class = QuizSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = QuizCursorPagination
 
     def perform_create(self, serializer):
         serializer.save(creator=self.request.user)
 
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return QuizSummarySerializer
+        return QuizSerializer
+
     def get_queryset(self):
+        if self.action == 'list':
+            return self.get_list_queryset()
+        if self.action == 'retrieve':
+            # the questions are only read when the payload is not cached, see retrieve()
+            return Quiz.objects.only('id', 'version', 'created_at')
         return Quiz.objects.prefetch_related('questions', 'questions__answers')
 
+    def retrieve(self, request, *args, **kwargs):
+        """
+        The quiz with its questions and answers, served from the payload cache for its current version.
+        The version is the ETag, so a client sending it back in If-None-Match gets a 304 after a
+        single query on the quiz table.
+        """
+        quiz = self.get_object()
+        etag = quiz_etag(quiz)
+        if_none_match = request.headers.get('If-None-Match', '')
+        if etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')] or if_none_match == '*':
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        def build():
+            full = get_object_or_404(Quiz.objects.prefetch_related('questions', 'questions__answers'), pk=quiz.pk)
+            return self.get_serializer(full).data
+
+        return Response(get_quiz_payload(quiz, build), headers={'ETag': etag})
+
+    def get_list_queryset(self):
+        """
+        The requesting user's quizzes, optionally filtered (see filter_quizzes), with their question
+        count (a counter on the quiz) instead of their questions.
+        """
+        return self.filter_quizzes(Quiz.objects.filter(creator=self.request.user)).prefetch_related('tags')
+
+    def filter_quizzes(self, queryset):
+        """Apply the ?difficulty=, ?category= and ?tag= filters, the last two taking ids"""
+        difficulty = self.request.query_params.get('difficulty')
+        if difficulty:
+            queryset = queryset.filter(difficulty=difficulty)
+        for param, lookup in [('category', 'category_id'), ('tag', 'tags')]:
+            value = self.request.query_params.get(param)
+            if not value:
+                continue
+            if not value.isdigit():
+                raise ValidationError({param: 'Must be an id.'})
+            queryset = queryset.filter(**{lookup: value})
+        return queryset
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Quizzes whose title, description or questions match ?q=, best first and by page, with the
+        same filters as the list. Every user's quizzes are searched, as anyone can take them.
+        """
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            raise ValidationError({'q': 'A search query is required.'})
+
+        results = search_quizzes(self.filter_quizzes(Quiz.objects.prefetch_related('tags')), text)
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(results, request, view=self)
+        return paginator.get_paginated_response(QuizSearchResultSerializer(page, many=True).data)
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """
+        Quiz counts by category, tag and difficulty, over all quizzes or within ?category= (an id) or
+        ?difficulty=, from the precomputed counts in quizzes.facets.
+        """
+        category = request.query_params.get('category')
+        difficulty = request.query_params.get('difficulty')
+        if category and difficulty:
+            raise ValidationError('Facets are counted within a category or a difficulty, not both.')
+        if category:
+            if not category.isdigit():
+                raise ValidationError({'category': 'Must be an id.'})
+            scope = category_scope(int(category))
+        elif difficulty:
+            if difficulty not in dict(Quiz.DIFFICULTY_CHOICES):
+                raise ValidationError({'difficulty': 'Unknown difficulty.'})
+            scope = difficulty_scope(difficulty)
+        else:
+            scope = ''
+        return Response(get_facets(scope))
+
     # for the pdf upload and quiz generation
-    @action(detail=True, methods=['post'])
+    # with `Accept: text/event-stream` (or ?format=event-stream) the job's progress and questions are
+    # streamed back as they are generated, instead of returning the queued job
+    @action(detail=True, methods=['post'],
+            renderer_classes=api_settings.DEFAULT_RENDERER_CLASSES + [EventStreamRenderer])
     def upload_pdf(self, request, pk=None):
         quiz = self.get_object()
 
@@ -38,32 +138,52 @@ class QuizViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Empty PDF file provided'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
+            # identical uploads share one stored file and its cached extraction
+            blob = store_pdf(pdf_file)
             temp_pdf = TempPDF.objects.create(
                 user=request.user,
-                file=pdf_file,
+                file=blob.file.name,
+                blob=blob,
                 quiz=quiz
             )
 
-            # process pdf and generate the questions
-            num_questions = process_pdf_and_generate_questions(temp_pdf.file.path, quiz)
-
-            # fetch the generated temp questions
-            temp_questions = TempQuestion.objects.filter(quiz=quiz).order_by('slide_number')
-            serializer = TempQuestionSerializer(temp_questions, many=True)
-
-            return Response({
-                'message': f'{num_questions} questions generated',
-                'questions': serializer.data
-            }, status=status.HTTP_201_CREATED)
-
+            # generation runs in a worker process, the client polls the job for progress
+            job = enqueue_generation_job(temp_pdf)
         except ValidationError as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except GenerationInProgress as e:
+            temp_pdf.delete()
+            return Response({'error': str(e), 'job': GenerationJobSerializer(e.job).data},
+                            status=status.HTTP_409_CONFLICT)
         except Exception as e:
             # if an error occurs, delete the temp pdf and return an error response
             if 'temp_pdf' in locals():
                 temp_pdf.delete()
+            elif 'blob' in locals():
+                release_blob(blob.pk)
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        # the job is queued now and will read the PDF, so nothing from here on may clean it up
+        if request.accepted_renderer.format == EventStreamRenderer.format:
+            return event_stream_response(request, job)
+        return Response({
+            'message': 'PDF uploaded, question generation queued',
+            'job': GenerationJobSerializer(job).data
+        }, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'], url_path=r'generation_jobs/(?P<job_id>\d+)')
+    def generation_job(self, request, pk=None, job_id=None):
+        quiz = self.get_object()
+        job = get_object_or_404(GenerationJob, pk=job_id, quiz=quiz)
+        return Response(GenerationJobSerializer(job).data)
+
+    @action(detail=True, methods=['get'], url_path=r'generation_jobs/(?P<job_id>\d+)/events',
+            renderer_classes=api_settings.DEFAULT_RENDERER_CLASSES + [EventStreamRenderer])
+    def generation_job_events(self, request, pk=None, job_id=None):
+        quiz = self.get_object()
+        job = get_object_or_404(GenerationJob, pk=job_id, quiz=quiz)
+        return event_stream_response(request, job)
+
     @action(detail=True, methods=['post'])
     def add_selected_questions(self, request, pk=None):
         quiz = self.get_object()
@@ -72,32 +192,26 @@ class QuizViewSet(viewsets.ModelViewSet):
         if not question_ids:
             return Response({'error': 'No question ids provided'}, status=status.HTTP_400_BAD_REQUEST)
 
-        selected_questions = TempQuestion.objects.filter(id__in=question_ids, quiz=quiz)
-        permanent_questions = []
+        selected_questions = (
+            TempQuestion.objects
+            .filter(id__in=question_ids, quiz=quiz)
+            .order_by('slide_number', 'id')
+            .prefetch_related('temp_answers')
+        )
 
-        for temp_question in selected_questions:
-            question = Question.objects.create(
-                quiz=quiz,
-                text=temp_question.text,
-                question_type=temp_question.question_type
-            )
-            for temp_answer in temp_question.temp_answers.all():
-                Answer.objects.create(
-                    question=question,
-                    text=temp_answer.text,
-                    is_correct=temp_answer.is_correct
-                )
-            permanent_questions.append(question)
+        with transaction.atomic():
+            permanent_questions = promote_temp_questions(selected_questions, quiz)
 
-            # Delete all temporary questions for this quiz
-        TempQuestion.objects.filter(quiz=quiz).delete()
+            # the questions that were not picked stay pending, so the next upload of the deck can carry
+            # over those of the latest job; unused ones expire with the rest of the temp data
+            TempQuestion.objects.filter(id__in=question_ids, quiz=quiz).delete()
 
         return Response({'success': f'{len(permanent_questions)} questions added to the quiz'})
 
     @action(detail=True, methods=['get'])
     def temp_questions(self, request, pk=None):
         quiz = self.get_object()
-        temp_questions = TempQuestion.objects.filter(quiz=quiz)
+        temp_questions = TempQuestion.objects.filter(quiz=quiz).prefetch_related('temp_answers')
         serializer = TempQuestionSerializer(temp_questions, many=True)
         return Response(serializer.data)
 